@@ -0,0 +1,287 @@
+"""Hot paths of the validators, timed against fixed synthetic inputs.
+
+The classes follow asv conventions (setup, time_* methods, params) and are
+run by benchmarks/regression.py, which stores the timings of every commit
+and fails when one slows down by more than a threshold.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import functools
+import numpy
+import pandas
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xenaMatrix
+import numericUtils
+import syntheticProject
+import geneExpressionValidation
+import mirnaValidation
+import methylationValidation
+import cnvGeneLevelValidation
+import cnvSegmentedValidation
+import somaticMutationValidation
+import proteinValidation
+import survivalAnalysisEndpointValidation
+import clinicalValidation
+
+PROJECT = "SYN-BENCH"
+
+# Changing the inputs makes earlier timings incomparable, so they are part of the input key.
+INPUT_SETTINGS = {
+    "samples": 100,
+    "replicates": 0.05,
+    "normals": 0.1,
+    "nanDensity": 0.01,
+    "genes": 2000,
+    "mirnas": 500,
+    "isoforms": 1000,
+    "probes": 5000,
+    "proteins": 200,
+    "segments": 100,
+    "mutations": 50
+}
+# rows x samples of the matrices the parsers are timed on: full GDC row counts, fewer samples than a large project
+LARGE_MATRICES = {
+    "STAR": (60660, 100),
+    "methylation450": (485577, 20)
+}
+INPUT_TYPES = ["STAR", "mirna", "methylation450", "gene-level_ascat3", "masked_cnv_DNAcopy", "somaticmutation_wxs",
+               "protein", "clinical", "survival"]
+
+# the validators log every sample, which is not what is being measured
+benchmarkLogger = logging.getLogger("benchmarks")
+benchmarkLogger.setLevel(logging.WARNING)
+
+
+@functools.lru_cache(maxsize=None)
+def inputs():
+    """Directory with the synthetic project and its gdcFiles, generated once per version of the inputs."""
+    with open(syntheticProject.__file__, "rb") as source:
+        key = hashlib.md5(source.read() + json.dumps([INPUT_SETTINGS, INPUT_TYPES]).encode()).hexdigest()[:12]
+    directory = os.path.join(tempfile.gettempdir(), "xenaGdcBenchmarks", key)
+    if not os.path.isdir(directory):
+        building = f"{directory}.{os.getpid()}.tmp"
+        syntheticProject.configure(**INPUT_SETTINGS)
+        syntheticProject.generate(PROJECT, building, INPUT_TYPES, seed=0, gdcFiles=os.path.join(building, "gdcFiles"))
+        try:
+            os.replace(building, directory)
+        except OSError:
+            # another process generated the same inputs first
+            shutil.rmtree(building, ignore_errors=True)
+    return directory
+
+
+@functools.lru_cache(maxsize=None)
+def largeMatrix(dataType):
+    """Path of a Xena matrix of LARGE_MATRICES size, written once per size.
+
+    STAR cells are log2(count + 1) of negative binomial counts, methylation
+    cells beta values with 1% missing, both at full float64 precision.
+    """
+    rows, samples = LARGE_MATRICES[dataType]
+    directory = os.path.join(tempfile.gettempdir(), "xenaGdcBenchmarks", "large")
+    path = os.path.join(directory, f"{dataType}.{rows}x{samples}.tsv")
+    if os.path.isfile(path):
+        return path
+    rng = numpy.random.default_rng(0)
+    if dataType == "STAR":
+        index = pandas.Index([f"ENSG{row:011d}.1" for row in range(rows)], name="Ensembl_ID")
+        values = numpy.log2(rng.negative_binomial(2, 0.002, (rows, samples)) + 1)
+    else:
+        index = pandas.Index([f"cg{row:08d}" for row in range(rows)], name="Composite Element REF")
+        values = rng.beta(0.6, 0.6, (rows, samples))
+        values[rng.random((rows, samples)) < 0.01] = numpy.nan
+    xenaDF = pandas.DataFrame(values, index=index, columns=[f"{PROJECT}-{sample:05d}-01A" for sample in range(samples)])
+    os.makedirs(directory, exist_ok=True)
+    xenaDF.to_csv(f"{path}.{os.getpid()}.tmp", sep="\t", na_rep="NA")
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return path
+
+
+def enter():
+    # the validators read gdcFiles/<project>/<data type> relative to the working directory
+    os.chdir(inputs())
+
+
+def xenaPath(dataType):
+    return os.path.join(inputs(), PROJECT, "Xena_Matrices", f"{PROJECT}.{dataType}.tsv")
+
+
+@functools.lru_cache(maxsize=None)
+def gdcFiles():
+    with open(os.path.join(inputs(), PROJECT, "gdcFixtures", "files.json"), "r") as filesFile:
+        return json.load(filesFile)
+
+
+def sampleDict(dataType, numbered=False):
+    """The sample -> file map a validator's metadata query returns, read from the fixtures.
+
+    Args:
+        dataType (str): Synthetic data type, e.g. "methylation450".
+        numbered (bool): Key every file as "<sample>.<n>" with a "file_name",
+            as the segment and mutation validators do.
+    """
+    workflow, category, gdcDataType, strategy, platform, suffix = syntheticProject.FILE_METADATA[dataType]
+    samples = {}
+    seen = {}
+    for document in gdcFiles():
+        if (document["data_type"], document["experimental_strategy"], document["platform"]) != \
+                (gdcDataType, strategy, platform):
+            continue
+        if workflow is not None and document["analysis"]["workflow_type"] != workflow:
+            continue
+        sample = document["cases"][0]["samples"][0]["submitter_id"]
+        if numbered:
+            seen[sample] = seen.get(sample, 0) + 1
+            samples[f"{sample}.{seen[sample]}"] = {document["file_id"]: {"file_name": document["file_name"],
+                                                                         "md5sum": document["md5sum"]}}
+        else:
+            samples.setdefault(sample, {})[document["file_id"]] = {"fileName": document["file_name"],
+                                                                   "md5sum": document["md5sum"]}
+    return samples
+
+
+XENA_DATAFRAMES = {
+    "star_counts": geneExpressionValidation.xenaDataframe,
+    "mirna": mirnaValidation.xenaDataframe,
+    "methylation450": methylationValidation.xenaDataframe,
+    "gene-level_ascat3": cnvGeneLevelValidation.xenaDataframe,
+    "masked_cnv_DNAcopy": cnvSegmentedValidation.xenaDataframe,
+    "somaticmutation_wxs": somaticMutationValidation.xenaDataframe
+}
+
+
+class NumericKernels:
+    """The significant digit kernel that replaced round_ForNans and custom_round."""
+
+    def setup(self):
+        values = numpy.random.default_rng(0).normal(0, 100, 1000000)
+        values[::97] = numpy.nan
+        self.values = values
+        self.other = values.copy()
+
+    def time_significantDigitKeys(self):
+        numericUtils.significantDigitKeys(self.values)
+
+    def time_roundSignificant(self):
+        numericUtils.roundSignificant(self.values)
+
+    def time_compareValues(self):
+        numericUtils.compareValues(self.values, self.other)
+
+
+class XenaDataframe:
+    params = list(XENA_DATAFRAMES)
+    param_names = ["dataType"]
+
+    def setup(self, dataType):
+        enter()
+
+    def time_xenaDataframe(self, dataType):
+        XENA_DATAFRAMES[dataType](xenaPath(dataType))
+
+
+class XenaParser:
+    """First-time loads of large matrices, before xenaMatrix has a sidecar of them."""
+    params = [["pandas", "pyarrow"], list(LARGE_MATRICES)]
+    param_names = ["parser", "dataType"]
+
+    def setup(self, parser, dataType):
+        if parser == "pyarrow" and xenaMatrix.pyarrow is None:
+            raise NotImplementedError("pyarrow is not installed")
+        self.path = largeMatrix(dataType)
+
+    def time_parse(self, parser, dataType):
+        xenaMatrix.parse(self.path, parser)
+
+
+class Compare:
+    params = ["STAR", "mirna", "methylation450", "gene-level_ascat3", "protein", "survival", "clinical"]
+    param_names = ["dataType"]
+
+    def setup(self, dataType):
+        enter()
+        if dataType == "STAR":
+            columns = geneExpressionValidation.STAR_DATA_COLUMNS
+            samples = sampleDict("STAR")
+            xenaDFs = {starType: geneExpressionValidation.xenaDataframe(xenaPath(starType)) for starType in columns}
+            self.compare = lambda: geneExpressionValidation.compare(benchmarkLogger, columns, samples, xenaDFs,
+                                                                    PROJECT)
+        elif dataType == "mirna":
+            gdcDF = mirnaValidation.mirnaDataframe(sampleDict("mirna"), PROJECT, "mirna")
+            xenaDF = mirnaValidation.xenaDataframe(xenaPath("mirna"))
+            self.compare = lambda: mirnaValidation.compare(benchmarkLogger, gdcDF, xenaDF)
+        elif dataType == "methylation450":
+            samples = sampleDict(dataType)
+            xenaDF = methylationValidation.xenaDataframe(xenaPath(dataType))
+            self.compare = lambda: methylationValidation.compare(samples, xenaDF, PROJECT, dataType)
+        elif dataType == "gene-level_ascat3":
+            samples = sampleDict(dataType)
+            xenaDF = cnvGeneLevelValidation.xenaDataframe(xenaPath(dataType))
+            self.compare = lambda: cnvGeneLevelValidation.compare(benchmarkLogger, samples, xenaDF, PROJECT, dataType)
+        elif dataType == "protein":
+            gdcDF = proteinValidation.proteinDataframe(sampleDict("protein"), PROJECT, "protein")
+            xenaDF = pandas.read_csv(xenaPath("protein"), sep="\t", index_col=0)
+            self.compare = lambda: proteinValidation.compare(benchmarkLogger, gdcDF, xenaDF)
+        elif dataType == "survival":
+            xenaDF = pandas.read_csv(xenaPath("survival"), sep="\t").sort_values(by=["sample"])
+            xenaDF = xenaDF.reset_index(drop=True).set_index("sample", drop=False)
+            xenaDF = xenaDF.astype({'sample': 'str', "OS.time": "float64", "OS": "int64", "_PATIENT": "str"})
+            gdcDF = xenaDF.copy()
+            self.compare = lambda: survivalAnalysisEndpointValidation.compare(benchmarkLogger, gdcDF, xenaDF)
+        elif dataType == "clinical":
+            xenaDF = pandas.read_csv(xenaPath("clinical"), sep="\t").sort_values(by=["sample"]).reset_index(drop=True)
+            gdcDF = xenaDF.copy()
+            self.compare = lambda: clinicalValidation.compare(benchmarkLogger, gdcDF, xenaDF)
+
+    def time_compare(self, dataType):
+        self.compare()
+
+
+class SampleDataframe:
+    params = ["masked_cnv_DNAcopy", "somaticmutation_wxs", "protein"]
+    param_names = ["dataType"]
+
+    def setup(self, dataType):
+        enter()
+        if dataType == "masked_cnv_DNAcopy":
+            samples = sampleDict(dataType, numbered=True)
+            self.build = lambda: cnvSegmentedValidation.sampleDataframe("DNAcopy", samples, PROJECT, dataType)
+        elif dataType == "somaticmutation_wxs":
+            samples = sampleDict(dataType, numbered=True)
+            nonEmpty, sampleNames = somaticMutationValidation.nonEmptySamples(samples, PROJECT, dataType)
+            self.build = lambda: somaticMutationValidation.sampleDataframe(samples, nonEmpty, PROJECT, dataType)
+        elif dataType == "protein":
+            samples = sampleDict("protein")
+            self.build = lambda: proteinValidation.proteinDataframe(samples, PROJECT, "protein")
+
+    def time_sampleDataframe(self, dataType):
+        self.build()
+
+
+class Clinical:
+
+    def setup(self):
+        enter()
+        cases = {}
+        for document in gdcFiles():
+            cases[document["cases"][0]["case_id"]] = document["cases"][0]
+        self.cases = list(cases.values())
+        xenaDF = pandas.read_csv(xenaPath("clinical"), sep="\t")
+        # Xena cells against their GDC counterparts: numbers, strings, empty cells and lists
+        self.pairs = [(value, str(value)) for value in xenaDF.to_numpy().ravel()]
+        self.pairs.extend([("['G1', 'G2']", ["G1", "G2"]), ("[1.5, 2]", [1.5, 2.0])] * 100)
+
+    def time_unpack_dict(self):
+        for case in self.cases:
+            clinicalValidation.unpack_dict(case)
+
+    def time_general_compare(self):
+        for xenaValue, gdcValue in self.pairs:
+            clinicalValidation.general_compare(xenaValue, gdcValue)
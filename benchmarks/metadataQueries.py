@@ -0,0 +1,128 @@
+"""Latency and payload of the sample -> file lookup.
+
+Compares the single /files query the validators now make with the
+/cases -> /files round trip they used to make, where every sample id of
+the project was posted back to /files as a filter.
+
+    python benchmarks/metadataQueries.py TCGA-BRCA [-r 3]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gdcClient
+import geneExpressionValidation
+import mirnaValidation
+import methylationValidation
+import cnvGeneLevelValidation
+import cnvSegmentedValidation
+import somaticMutationValidation
+
+# The same arguments the validators' main functions pass.
+LOOKUPS = {
+    "STAR": lambda project: geneExpressionValidation.dataTypeSamples(project),
+    "mirna": lambda project: mirnaValidation.miRNASamples(project, "miRNA Expression Quantification"),
+    "methylation450": lambda project: methylationValidation.dataTypeSamples(project, "illumina human methylation 450"),
+    "gene-level_ascat3": lambda project: cnvGeneLevelValidation.dataTypeSamples(project, "ASCAT3", "Genotyping Array"),
+    "masked_cnv_DNAcopy": lambda project: cnvSegmentedValidation.dataTypeSamples(
+        project, "DNAcopy", "Masked Copy Number Segment", "Genotyping Array"),
+    "somaticmutation_wxs": lambda project: somaticMutationValidation.dataTypeSamples(project, "WXS"),
+}
+
+
+def filesQuery(lookup, project):
+    """The /files parameters a lookup sends, captured without querying the GDC."""
+    captured = []
+    hits = gdcClient.hits
+    gdcClient.hits = lambda endpoint, params: captured.append((endpoint, params)) or []
+    try:
+        lookup(project)
+    finally:
+        gdcClient.hits = hits
+    return captured[0][1]
+
+
+def casesFilter(filesFilter):
+    """The /cases filter the removed getAllSamples helpers built for a /files filter."""
+    content = []
+    for clause in filesFilter["content"]:
+        field = clause["content"]["field"]
+        if not field.startswith("cases."):
+            field = "files." + field
+        content.append(dict(clause, content=dict(clause["content"], field=field)))
+    return dict(filesFilter, content=content)
+
+
+class Meter:
+    """Counts requests and bytes sent and received through the client session."""
+
+    def __init__(self):
+        self.requests = 0
+        self.sent = 0
+        self.received = 0
+        gdcClient.session().hooks["response"].append(self)
+
+    def __call__(self, response, *args, **kwargs):
+        self.requests += 1
+        self.sent += len(response.request.body or b"")
+        self.received += len(response.content)
+
+
+def oneShot(params):
+    return [hit["file_id"] for hit in gdcClient.hits("files", params)]
+
+
+def twoStep(params):
+    filesFilter = json.loads(params["filters"]) if isinstance(params["filters"], str) else params["filters"]
+    caseParams = {"filters": json.dumps(casesFilter(filesFilter)), "fields": "submitter_sample_ids", "format": "json"}
+    samples = [sample for case in gdcClient.hits("cases", caseParams) for sample in case["submitter_sample_ids"]]
+    sampleClause = {"op": "in", "content": {"field": "cases.samples.submitter_id", "value": samples}}
+    sampleFilter = dict(filesFilter, content=filesFilter["content"] + [sampleClause])
+    return [hit["file_id"] for hit in gdcClient.hits("files", dict(params, filters=json.dumps(sampleFilter)))]
+
+
+def measure(flow, params, repeat):
+    best = None
+    for _ in range(repeat):
+        gdcClient.configure(cacheDir="")
+        meter = Meter()
+        start = time.perf_counter()
+        fileIDs = flow(params)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best["seconds"]:
+            best = {"seconds": seconds, "requests": meter.requests, "sent": meter.sent,
+                    "received": meter.received, "fileIDs": sorted(fileIDs)}
+    return best
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('project', help='GDC project, e.g. TCGA-BRCA.')
+    parser.add_argument('-d', '--datatype', nargs='*', default=list(LOOKUPS), choices=list(LOOKUPS),
+                        help='Lookups to benchmark, all by default.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per flow, the fastest is reported.')
+    return parser
+
+
+def main():
+    options = create_parser().parse_args()
+    row = "{:<22}{:>10}{:>10}{:>12}{:>14}{:>10}"
+    print(row.format("lookup", "flow", "requests", "sent KiB", "received KiB", "seconds"))
+    for dataType in options.datatype:
+        params = filesQuery(LOOKUPS[dataType], options.project)
+        results = {"two-step": measure(twoStep, params, options.repeat),
+                   "one-shot": measure(oneShot, params, options.repeat)}
+        for flow, result in results.items():
+            print(row.format(dataType, flow, result["requests"], f"{result['sent'] / 1024:.1f}",
+                             f"{result['received'] / 1024:.1f}", f"{result['seconds']:.2f}"))
+        same = results["two-step"]["fileIDs"] == results["one-shot"]["fileIDs"]
+        print(f"{dataType}: {len(results['one-shot']['fileIDs'])} files, "
+              f"{'same' if same else 'DIFFERENT'} file sets")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Run the hot path benchmarks, store the timings of this commit and compare them with a baseline.
+
+Timings are written to benchmarks/results/<commit>.json. The baseline is the
+newest result of another commit from the same machine, or --baseline. The
+run fails when any benchmark is slower than the baseline by more than the
+threshold.
+
+    python benchmarks/regression.py [-b Compare] [--threshold 0.2] [--baseline HEAD~1]
+"""
+import os
+import re
+import sys
+import json
+import time
+import timeit
+import inspect
+import logging
+import argparse
+import platform
+import itertools
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import hotPaths
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def benchmarks(pattern=None):
+    """Yield (name, class, method name, params) for every time_* benchmark in hotPaths.
+
+    As in asv, params is either a list of values for a single parameter or
+    a list of such lists, whose product is benchmarked.
+    """
+    for className, benchmarkClass in inspect.getmembers(hotPaths, inspect.isclass):
+        if benchmarkClass.__module__ != hotPaths.__name__:
+            continue
+        params = getattr(benchmarkClass, "params", [])
+        if params and not isinstance(params[0], (list, tuple)):
+            params = [params]
+        for methodName in sorted(name for name in dir(benchmarkClass) if name.startswith("time_")):
+            for combination in itertools.product(*params):
+                name = f"{className}.{methodName}"
+                if combination:
+                    name += f"({', '.join(str(value) for value in combination)})"
+                if pattern is None or re.search(pattern, name):
+                    yield name, benchmarkClass, methodName, combination
+
+
+def timeBenchmark(benchmarkClass, methodName, combination, repeat):
+    """Best time in seconds of one call, the minimum over repeat autoranged runs."""
+    instance = benchmarkClass()
+    cwd = os.getcwd()
+    try:
+        if hasattr(instance, "setup"):
+            instance.setup(*combination)
+        method = getattr(instance, methodName)
+        timer = timeit.Timer(lambda: method(*combination))
+        number, _ = timer.autorange()
+        return min(timer.repeat(repeat=repeat, number=number)) / number
+    finally:
+        os.chdir(cwd)
+
+
+def machine():
+    return f"{platform.node()}-{platform.machine()}"
+
+
+def loadResults(commit):
+    resultsPath = os.path.join(RESULTS_DIR, f"{commit}.json")
+    if not os.path.isfile(resultsPath):
+        return None
+    with open(resultsPath, "r") as resultsFile:
+        return json.load(resultsFile)
+
+
+def saveResults(commit, results):
+    """Merge results into those stored for commit, so a filtered run keeps the other benchmarks."""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stored = loadResults(commit)
+    if stored is None or stored["machine"] != machine():
+        stored = {"commit": commit, "machine": machine(), "results": {}}
+    stored["date"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    stored["python"] = platform.python_version()
+    stored["results"].update(results)
+    resultsPath = os.path.join(RESULTS_DIR, f"{commit}.json")
+    with open(f"{resultsPath}.tmp", "w") as resultsFile:
+        json.dump(stored, resultsFile, indent=2, sort_keys=True)
+    os.replace(f"{resultsPath}.tmp", resultsPath)
+    return stored
+
+
+def baselineResults(commit, baseline=None):
+    if baseline is not None:
+        return loadResults(git("rev-parse", baseline))
+    candidates = []
+    if os.path.isdir(RESULTS_DIR):
+        for entry in os.scandir(RESULTS_DIR):
+            if not entry.name.endswith(".json") or entry.name == f"{commit}.json":
+                continue
+            stored = loadResults(entry.name[:-len(".json")])
+            if stored["machine"] == machine():
+                candidates.append(stored)
+    return max(candidates, key=lambda stored: stored["date"], default=None)
+
+
+def compare(results, baseline, threshold):
+    """Log every benchmark against the baseline.
+
+    Returns:
+        regressions (list): Names of the benchmarks slower than the baseline by more than threshold.
+    """
+    regressions = []
+    logger.info(f"{'benchmark':<60} {'time':>12} {'baseline':>12} {'ratio':>7}")
+    for name, seconds in results.items():
+        previous = baseline["results"].get(name) if baseline is not None else None
+        if previous is None:
+            logger.info(f"{name:<60} {seconds * 1000:>10.3f}ms {'-':>12} {'-':>7}")
+            continue
+        ratio = seconds / previous
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        logger.info(f"{name:<60} {seconds * 1000:>10.3f}ms {previous * 1000:>10.3f}ms {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Time the validators' hot paths and fail on a slowdown against a baseline commit.")
+    parser.add_argument("-b", "--bench", type=str, default=None,
+                        help="Only run benchmarks whose name matches this regular expression")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark, the best one counts")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown as a fraction of the baseline time, 0.2 by default")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Commit to compare with, by default the newest stored results of another commit")
+    return parser
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=(logging.StreamHandler(sys.stdout),)
+    )
+    args = create_parser().parse_args()
+    commit = git("rev-parse", "HEAD")
+    if git("status", "--porcelain", "--untracked-files=no"):
+        logger.info(f"Working tree has uncommitted changes, results are stored for {commit[:10]} anyway")
+    logger.info(f"Synthetic inputs at {hotPaths.inputs()}")
+    results = {}
+    for name, benchmarkClass, methodName, combination in benchmarks(args.bench):
+        try:
+            results[name] = timeBenchmark(benchmarkClass, methodName, combination, args.repeat)
+        except NotImplementedError as error:
+            # as in asv, a setup raising NotImplementedError skips the benchmark
+            logger.info(f"{name}: skipped, {error}")
+            continue
+        logger.info(f"{name}: {results[name] * 1000:.3f}ms")
+    if len(results) == 0:
+        logger.info(f"No benchmark matches {args.bench}")
+        sys.exit(1)
+    saveResults(commit, results)
+    baseline = baselineResults(commit, args.baseline)
+    if baseline is None:
+        logger.info("No baseline results to compare with")
+    else:
+        logger.info(f"Baseline: {baseline['commit'][:10]} from {baseline['date']}")
+    regressions = compare(results, baseline, args.threshold)
+    if len(regressions) != 0:
+        logger.info(f"{len(regressions)} benchmarks slowed down by more than {args.threshold:.0%}: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 import sys
-import requests
+import gdcClient
 import json
 import pandas
 import numpy
 import pandas
 import ast
 import logging
+import jobMetrics
+import resultsStore
 
 logger = logging.getLogger(__name__)
 
@@ -248,8 +250,7 @@ def update_dict_without_overwriting(original_dict, new_dict):
 
 
 def availableFields():
-    response = requests.get("https://api.gdc.cancer.gov/files/_mapping")
-    availableFields = response.json()["fields"]
+    availableFields = gdcClient.cachedGet("files/_mapping")["fields"]
     wantedFields = []
     for field in availableFields:
         if field not in GDC_DROPPED_FIELDS and not field.startswith('cases.summary.') and field.startswith("cases.") and not field.startswith("cases.follow_ups.") and not field.startswith("cases.samples.portions"):
@@ -257,11 +258,6 @@ def availableFields():
     return wantedFields
 
 
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-    return jsonObj
-
-
 def getFieldData(fields, projectName):
     projectFields = [x.removeprefix("cases.project.") for x in fields if "cases.project." in x]
     for x in fields:
@@ -319,12 +315,10 @@ def getFieldData(fields, projectName):
     caseParams = {
         "filters": json.dumps(caseFilter),
         "fields": ",".join(sampleFields) + ",case_id",
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
 
-    response = requests.post("https://api.gdc.cancer.gov/cases/", json=caseParams, headers={"Content-Type": "application/json"})
-    sampleResponseJson = unpeelJson(response.json())
+    sampleResponseJson = gdcClient.hits("cases", caseParams)
     sampleResponseDictionary = {case["case_id"]: case for case in sampleResponseJson}
     for case in sampleResponseDictionary:
         for key in list(sampleResponseDictionary[case].keys()):
@@ -334,12 +328,10 @@ def getFieldData(fields, projectName):
     projectParams = {
         "filters": json.dumps(projectFilter),
         "fields": ",".join(projectFields),
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
 
-    response = requests.post("https://api.gdc.cancer.gov/projects/", json=projectParams, headers={"Content-Type": "application/json"})
-    projectResponseJson = unpeelJson(response.json())
+    projectResponseJson = list(gdcClient.hits("projects", projectParams))
     projectData = {"project": projectResponseJson[0]}
 
     callOneFields = fields[(len(fields)//2):]
@@ -347,12 +339,10 @@ def getFieldData(fields, projectName):
     params = {
         "filters": json.dumps(fileFilter),
         "fields": ",".join(callOneFields) + ",cases.case_id" + ',cases.diagnoses.treatments.treatment_id'+ ",cases.diagnoses.diagnosis_id",
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
 
-    response = requests.post("https://api.gdc.cancer.gov/files/", json=params, headers={"Content-Type": "application/json"})
-    response1Json = unpeelJson(response.json())
+    response1Json = gdcClient.hits("files", params)
     response1Dictionary = {case["cases"][0]["case_id"]: case["cases"][0] for case in response1Json}
 
     callTwoFields = fields[:(len(fields)//2)]
@@ -360,11 +350,9 @@ def getFieldData(fields, projectName):
     params = {
         "filters": json.dumps(fileFilter),
         "fields": ",".join(callTwoFields) + ",cases.case_id" + ',cases.diagnoses.treatments.treatment_id' + ",cases.diagnoses.diagnosis_id",
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
-    response = requests.post("https://api.gdc.cancer.gov/files/", json=params, headers={"Content-Type": "application/json"})
-    response2Json = unpeelJson(response.json())
+    response2Json = gdcClient.hits("files", params)
     response2Dictionary = {case["cases"][0]["case_id"]: case["cases"][0] for case in response2Json}
 
     combinedData = update_dict_without_overwriting(response1Dictionary, response2Dictionary)
@@ -413,12 +401,10 @@ def validSamples(caseData, projectName):
     params = {
         "filters": json.dumps(fileFilter),
         "fields": 'data_category,cases.samples.submitter_id,cases.samples.tissue_type',
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
 
-    response = requests.post("https://api.gdc.cancer.gov/files/", json=params, headers={"Content-Type": "application/json"})
-    response = unpeelJson(response.json())
+    response = gdcClient.hits("files", params)
     keepSamples = []
 
     for file in response:
@@ -682,18 +668,27 @@ def formatGDCDataframe(gdcDF):
 
 
 def main(projectName, xenaFilePath, dataType):
+    jobMetrics.stage("metadata")
+    # clinical data has no GDC files, it changes with the data release
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, {}):
+        return "PASSED"
     wantedFields = availableFields()
     caseData = getFieldData(wantedFields, projectName)
+    jobMetrics.stage("GDC load")
     caseData = formatDiagnosis(caseData)
     caseData = formatTreatments(caseData)
 
     for id in caseData:
         caseData[id] = unpack_dict(caseData[id])
 
+    jobMetrics.stage("metadata")
     caseData = validSamples(caseData, projectName)
+    jobMetrics.stage("GDC load")
     sampleOrientedData = processSamples(caseData)
 
+    jobMetrics.stage("Xena load")
     xenaDataframe = pandas.read_csv(xenaFilePath, sep='\t')
+    jobMetrics.stage("GDC load")
     gdcDataframe = pandas.DataFrame(list(sampleOrientedData.values()))
 
 
@@ -710,6 +705,7 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in gdcSamples]}")
         exit(1)
 
+    jobMetrics.stage("compare")
     gdcDataframe.dropna(axis=1, how='all', inplace=True)
 
 
@@ -742,6 +738,8 @@ def main(projectName, xenaFilePath, dataType):
     xenaDataframe.reset_index(drop=True, inplace=True)
 
     result = compare(logger, gdcDataframe, xenaDataframe)
+    resultsStore.sampleResults(projectName, dataType, gdcSamples, result)
+    jobMetrics.stage("report")
     if len(result) == 0:
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return "PASSED"
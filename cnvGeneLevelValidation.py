@@ -1,54 +1,19 @@
 import os
 import logging
-import requests
+import gdcClient
 import json
-import subprocess
 import pandas
-import numpy
-import hashlib
+import numericUtils
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
+import xenaMatrix
 
 logger = logging.getLogger(__name__)
 
 
-def round_ForNans(x):
-    if (pandas.notna(x)):
-        return numpy.format_float_scientific(x, precision=8)
-    else:
-        return numpy.nan
-
-
-def downloadFiles(fileList, projectName, dataType):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/{dataType}"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     with open(xenaFile, "r") as xenaData:
         header = xenaData.readline()  # get column labels from xena matrix
@@ -59,82 +24,8 @@ def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     return sampleList
 
 
-def getAllSamples(projectName, workflowType, experimentalStrategy):
-    casesEndpt = "https://api.gdc.cancer.gov/cases"
-    allSamplesFilter = {
-        "op": "and",
-        "content": [
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.project.project_id",
-                    "value": [
-                        projectName
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.analysis.workflow_type",
-                    "value": [
-                        workflowType
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_category",
-                    "value": [
-                        "Copy Number Variation"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_type",
-                    "value": [
-                        "Gene Level Copy Number"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.experimental_strategy",
-                    "value": [
-                        experimentalStrategy
-                    ]
-                }
-            }
-        ]
-    }
-    params = {
-        "filters": json.dumps(allSamplesFilter),
-        "fields": "submitter_sample_ids",
-        "format": "json",
-        "size": 20000
-    }
-    response = requests.post(casesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
-    allSamples = []
-    for caseDict in responseJson:
-        for sample in caseDict["submitter_sample_ids"]:
-            allSamples.append(sample)
-
-    return allSamples
-
-
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-
-    return jsonObj
-
-
-def dataTypeSamples(projectName, samples, workflowType, experimentalStrategy):
-    filesEndpt = "https://api.gdc.cancer.gov/files"
+def dataTypeSamples(projectName, workflowType, experimentalStrategy):
+    filesEndpt = "files"
     dataTypeFilter = {
         "op": "and",
         "content": [
@@ -181,13 +72,6 @@ def dataTypeSamples(projectName, samples, workflowType, experimentalStrategy):
                     ]
                 }
             },
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.samples.submitter_id",
-                    "value": samples
-                }
-            },
             {
                 "op": "in",
                 "content": {
@@ -202,11 +86,9 @@ def dataTypeSamples(projectName, samples, workflowType, experimentalStrategy):
     params = {
         "filters": json.dumps(dataTypeFilter),
         "fields": "cases.samples.submitter_id,cases.samples.tissue_type,file_id,file_name,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
+    responseJson = gdcClient.hits(filesEndpt, params)
     dataTypeDict = {}
     for caseDict in responseJson:
         for sample in caseDict["cases"][0]["samples"]:
@@ -226,29 +108,15 @@ def dataTypeSamples(projectName, samples, workflowType, experimentalStrategy):
 
 
 def xenaDataframe(xenaFile):
-    xenaDF = pandas.read_csv(xenaFile, sep="\t", index_col=0)
-    for column in xenaDF:
-        if pandas.api.types.is_numeric_dtype(xenaDF[column]):
-            xenaDF[column] = xenaDF[column].apply(round_ForNans)
+    xenaDF = xenaMatrix.read(xenaFile)
 
     return xenaDF
 
 
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
-
-
 def existing_md5sums(logger, projectName, dataType, sampleDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/{dataType}") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/{dataType}/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {sampleDict[sample][fileID]["md5sum"]: fileID for sample in sampleDict for fileID in
                          sampleDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/{dataType}", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/{dataType}")
     fileIdDict = {innerKey: value
@@ -267,34 +135,27 @@ def compare(logger, sampleDict, xenaDF, projectName, dataType):
     sampleNum = 1
     total = len(sampleDict)
     for sample in sampleDict:
-        fileCount = 0
-        for fileID in sampleDict[sample]:
-            fileName = sampleDict[sample][fileID]["fileName"]
-            sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
-            if fileCount == 0:
-                sampleDataDF = pandas.read_csv(sampleFile, sep="\t")
-                sampleDataDF["nonNanCount"] = 0
-                sampleDataDF["nonNanCount"] = sampleDataDF.apply(
-                    lambda x: 1 if (not (pandas.isna(x["copy_number"]))) else 0, axis=1)
-                sampleDataDF["copy_number"] = sampleDataDF["copy_number"].fillna(0)
-            else:
-                tempDF = pandas.read_csv(sampleFile, sep="\t")
-                tempDF["nonNanCount"] = 0
-                tempDF["nonNanCount"] = tempDF.apply(lambda x: 1 if (not (pandas.isna(x["copy_number"]))) else 0,
-                                                     axis=1)
-                tempDF["copy_number"] = tempDF["copy_number"].fillna(0)
-                sampleDataDF["nonNanCount"] += tempDF["nonNanCount"]
-                sampleDataDF["copy_number"] += tempDF["copy_number"]
-            fileCount += 1
-        cellsCorrect = 0
-        sampleDataDF["copy_number"] = sampleDataDF.apply(
-            lambda x: x["copy_number"] / x["nonNanCount"] if x["nonNanCount"] != 0 else numpy.nan, axis=1)
-        sampleDataDF["copy_number"] = sampleDataDF["copy_number"].apply(round_ForNans)
         xenaColumn = xenaDF[sample]
-        sampleColumn = sampleDataDF["copy_number"]
-        xenaColumn.reset_index(inplace=True, drop=True)
-        sampleColumn.reset_index(inplace=True, drop=True)
-        if (sampleColumn.equals(xenaColumn)):
+        # samples whose Xena column and GDC files are unchanged keep their previous result
+        previous = resultsStore.reusedResult(projectName, dataType, sample, xenaColumn, sampleDict[sample])
+        if previous is not None:
+            equal = previous == "PASSED"
+        else:
+            jobMetrics.stage("GDC load")
+            replicates = []
+            for fileID in sampleDict[sample]:
+                fileName = sampleDict[sample][fileID]["fileName"]
+                sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
+                with traceEvents.span(fileName, "parse"):
+                    sampleDataDF = pandas.read_csv(sampleFile, sep="\t", usecols=["copy_number"])
+                replicates.append(sampleDataDF["copy_number"].to_numpy(dtype=float))
+            jobMetrics.stage("compare")
+            with traceEvents.span(sample, "compare"):
+                sampleColumn = numericUtils.replicateMean(replicates)
+                # non-numeric Xena columns can never match the GDC copy numbers
+                equal = pandas.api.types.is_numeric_dtype(xenaColumn) and \
+                    numericUtils.compareValues(xenaColumn, sampleColumn)[0]
+        if equal:
             status = "[{:d}/{:d}] Sample: {} - Passed"
             logger.info(status.format(sampleNum, total, sample))
             samplesCorrect += 1
@@ -323,9 +184,12 @@ def main(projectName, xenaFilePath, dataType):
     }
     workflowType = workflowDict[dataType]
     experimentalStrategy = experimentalStrategyDict[workflowType]
+    jobMetrics.stage("metadata")
+    sampleDict = dataTypeSamples(projectName, workflowType, experimentalStrategy)
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, gdcDownload.sampleMd5sums(sampleDict)):
+        return 'PASSED'
+    jobMetrics.stage("Xena load")
     xenaSamples = getXenaSamples(xenaFilePath)
-    allSamples = getAllSamples(projectName, workflowType, experimentalStrategy)
-    sampleDict = dataTypeSamples(projectName, allSamples, workflowType, experimentalStrategy)
     xenaDF = xenaDataframe(xenaFilePath)
     if sorted(sampleDict) != sorted(xenaSamples):
         logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
@@ -334,6 +198,7 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"Samples from GDC and not in Xena: {[x for x in sampleDict if x not in xenaSamples]}")
         logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in sampleDict]}")
         exit(1)
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/{dataType}"):
         fileIDs = existing_md5sums(logger, projectName, dataType, sampleDict)
     else:
@@ -342,8 +207,11 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"0 files found at gdcFiles/{projectName}/{dataType}")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName, dataType)
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/{dataType}", gdcDownload.sampleMd5sums(sampleDict))
     result = compare(logger, sampleDict, xenaDF, projectName, dataType)
+    resultsStore.sampleResults(projectName, dataType, list(sampleDict), result)
+    jobMetrics.stage("report")
     if len(result) == 0:
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return 'PASSED'
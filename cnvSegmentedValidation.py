@@ -3,31 +3,24 @@ import sys
 import logging
 import pandas
 import difflib
-import requests
+import gdcClient
 import json
-import subprocess
 import pandas
-import numpy
-import hashlib
+import numericUtils
+import workspace
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
 
 
 logger = logging.getLogger(__name__)
 
 
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
-
-
 def existing_md5sums(logger, projectName, dataType, sampleDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/{dataType}") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/{dataType}/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {sampleDict[sample][fileID]["md5sum"]: fileID for sample in sampleDict for fileID in sampleDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/{dataType}", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/{dataType}")
     fileIdDict = {innerKey: value
@@ -38,45 +31,6 @@ def existing_md5sums(logger, projectName, dataType, sampleDict):
     return filesNeededToUpdate
 
 
-def round_ForNans(x):
-    if( pandas.notna(x) ):
-        return numpy.format_float_scientific(x, precision=8)
-    else:
-        return numpy.nan
-
-
-def downloadFiles(fileList, projectName, dataType):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/{dataType}"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     xenaMatrix = pandas.read_csv(xenaFile, sep="\t")
     sampleList = list(xenaMatrix["sample"].unique())
@@ -84,82 +38,8 @@ def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     return sampleList
 
 
-def getAllSamples(projectName, workflowType, gdcDataType, experimentalStrategy):
-    casesEndpt = "https://api.gdc.cancer.gov/cases"
-    allSamplesFilter = {
-        "op": "and",
-        "content": [
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.project.project_id",
-                    "value": [
-                        projectName
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.analysis.workflow_type",
-                    "value": [
-                        workflowType
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_category",
-                    "value": [
-                        "copy number variation"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_type",
-                    "value": [
-                        gdcDataType
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.experimental_strategy",
-                    "value": [
-                        experimentalStrategy
-                    ]
-                }
-            }
-        ]
-    }
-    params = {
-        "filters": json.dumps(allSamplesFilter),
-        "fields": "submitter_sample_ids",
-        "format": "json",
-        "size": 20000
-    }
-    response = requests.post(casesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
-    allSamples = []
-    for caseDict in responseJson:
-        for sample in caseDict["submitter_sample_ids"]:
-            allSamples.append(sample)
-    
-    return allSamples
-
-
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-    
-    return jsonObj
-
-
-def dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy, samples):
-    filesEndpt = "https://api.gdc.cancer.gov/files"
+def dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy):
+    filesEndpt = "files"
     dataTypeFilter = {
         "op": "and",
         "content": [
@@ -206,13 +86,6 @@ def dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy
                     ]
                 }
             },
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.samples.submitter_id",
-                    "value": samples
-                }
-            },
             {
                 "op": "in",
                 "content": {
@@ -227,11 +100,9 @@ def dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy
     params = {
         "filters": json.dumps(dataTypeFilter),
         "fields": "cases.samples.submitter_id,cases.samples.tissue_type,file_id,file_name,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
+    responseJson = gdcClient.hits(filesEndpt, params)
     dataTypeDict = {}
     # create seen dict to see how many times a sample has been seen
     seenDict = {}
@@ -250,7 +121,7 @@ def dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy
 
 def xenaDataframe(xenaFile):
     xenaDF = pandas.read_csv(xenaFile, sep="\t")
-    xenaDF["value"] = xenaDF["value"].apply(round_ForNans)
+    xenaDF["value"] = numericUtils.roundSignificant(xenaDF["value"])
     
     return xenaDF
 
@@ -264,7 +135,8 @@ def sampleDataframe(workflowType, sampleDict, projectName, dataType):
             sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
             normalSampleName = sample[:sample.index(".")]
             # Create data frame for sample data
-            sampleDataDF = pandas.read_csv(sampleFile, sep="\t")
+            with traceEvents.span(fileName, "parse"):
+                sampleDataDF = pandas.read_csv(sampleFile, sep="\t")
             sampleDataDF.rename(columns={'Chromosome': 'Chrom'}, inplace=True)
             sampleDataDF.rename(columns={'GDC_Aliquot': 'sample'}, inplace=True)
             if( workflowType == "DNAcopy" ):
@@ -274,7 +146,7 @@ def sampleDataframe(workflowType, sampleDict, projectName, dataType):
             sampleDataDF.drop(columns=['Major_Copy_Number', 'Minor_Copy_Number', 'Num_Probes'], inplace=True, errors="ignore")
             sampleDataDF.replace(sampleDataDF.iloc[0].iat[0], normalSampleName, inplace=True)
             dataFrame = pandas.concat([dataFrame, sampleDataDF])
-    dataFrame["value"] = dataFrame["value"].apply(round_ForNans)
+    dataFrame["value"] = numericUtils.roundSignificant(dataFrame["value"])
     
     return dataFrame
 
@@ -305,9 +177,12 @@ def main(projectName, xenaFilePath, dataType):
     workflowType = workflowDict[dataType]
     gdcDataType = gdcDataTypeDict[dataType]
     experimentalStrategy = experimentalStrategyDict[dataType]
+    jobMetrics.stage("metadata")
+    sampleDict, seenSamples = dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy)
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, gdcDownload.sampleMd5sums(sampleDict)):
+        return 'PASSED'
+    jobMetrics.stage("Xena load")
     xenaSamples = getXenaSamples(xenaFilePath)
-    allSamples = getAllSamples(projectName, workflowType, gdcDataType, experimentalStrategy)
-    sampleDict, seenSamples = dataTypeSamples(projectName, workflowType, gdcDataType, experimentalStrategy, allSamples)
     xenaDF = xenaDataframe(xenaFilePath)
     if sorted(seenSamples) != sorted(xenaSamples):
         logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
@@ -316,6 +191,7 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"Samples from GDC and not in Xena: {[x for x in seenSamples if x not in xenaSamples]}")
         logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in seenSamples]}")
         exit(1)
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/{dataType}"):
         fileIDs = existing_md5sums(logger, projectName, dataType, sampleDict)
     else:
@@ -324,29 +200,37 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"0 files found at gdcFiles/{projectName}/{dataType}")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName, dataType)
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/{dataType}", gdcDownload.sampleMd5sums(sampleDict))
+    jobMetrics.stage("Xena load")
     # sort data frame
     xenaDF.sort_values(by=sorted(xenaDF), inplace=True)
+    jobMetrics.stage("GDC load")
     # create dataframe for samples
     sampleDf = sampleDataframe(workflowType, sampleDict, projectName, dataType)
+    jobMetrics.stage("compare")
     # sort sample dataframe as well
     sampleDf.sort_values(by=sorted(sampleDf), inplace=True)
     # then reset index ordering for each one
     xenaDF.reset_index(inplace=True, drop=True)
     sampleDf.reset_index(inplace=True, drop=True)
-    with open("sampleDF.csv", "w") as sampleFile:
+    sampleCsv = workspace.path("sampleDF.csv")
+    xenaCsv = workspace.path("xenaDF.csv")
+    with open(sampleCsv, "w") as sampleFile:
         sampleDf.to_csv(sampleFile)
-    with open("xenaDF.csv", "w") as xenaDfFile:
+    with open(xenaCsv, "w") as xenaDfFile:
         xenaDF.to_csv(xenaDfFile)
-    if sampleDf.equals(xenaDF):
+    equal = sampleDf.equals(xenaDF)
+    jobMetrics.stage("report")
+    if equal:
         logger.info("Testing in progress ...")
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return 'PASSED'
     else:
         logger.info("[{}] test failed for [{}].".format(dataType, projectName))
         logger.info("Diff file is being generated with unequal values.")
-        with open("sampleDF.csv", "r") as sampleFile:
-            with open("xenaDF.csv", "r") as xenaDfFile:
+        with open(sampleCsv, "r") as sampleFile:
+            with open(xenaCsv, "r") as xenaDfFile:
                 # if they are not equal then output diff of both files
                 sys.stdout.writelines(difflib.unified_diff(sampleFile.readlines(), xenaDfFile.readlines(),
                                                         fromfile="sampleDF.csv", tofile="xenaDF.csv"))                                        
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import logging
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Dot file, so the validators' directory listings skip it.
+MANIFEST_NAME = ".manifest.json"
+
+settings = {
+    "verify": False,
+    # hashlib releases the GIL while hashing large buffers, so threads scale with cores
+    "workers": os.cpu_count() or 1,
+    "chunkSize": 8 << 20
+}
+
+_manifestLock = threading.Lock()
+
+
+def configure(verify=None, workers=None):
+    """Override the cache settings for this process."""
+    if verify is not None:
+        settings["verify"] = verify
+    if workers is not None:
+        settings["workers"] = workers
+
+
+def md5sum(filePath):
+    md5_hash = hashlib.md5()
+
+    with open(filePath, "rb") as file:
+        for chunk in iter(lambda: file.read(settings["chunkSize"]), b""):
+            md5_hash.update(chunk)
+
+    return md5_hash.hexdigest()
+
+
+def md5sums(filePaths):
+    """md5sums of several files, hashed concurrently.
+
+    Returns:
+        md5sums (dict): File path to md5sum.
+    """
+    filePaths = list(filePaths)
+    if len(filePaths) <= 1:
+        return {filePath: md5sum(filePath) for filePath in filePaths}
+    with ThreadPoolExecutor(max_workers=settings["workers"]) as executor:
+        return dict(zip(filePaths, executor.map(md5sum, filePaths)))
+
+
+def _loadManifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), "r") as manifestFile:
+            return json.load(manifestFile)
+    except (OSError, ValueError):
+        return {}
+
+
+def _saveManifest(directory, manifest):
+    manifestPath = os.path.join(directory, MANIFEST_NAME)
+    with open(manifestPath + ".tmp", "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def _entry(filePath, md5, fileID=None):
+    stat = os.stat(filePath)
+    return {"file_id": fileID, "md5": md5, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def cachedMd5sums(directory, fileIDs=None, verify=None):
+    """md5sums of the files in a gdcFiles cache directory.
+
+    Hashes are kept in a manifest next to the files and a file is only
+    hashed again when its size or modification time changed, or when a full
+    verification is requested.
+
+    Args:
+        directory (str): Cache directory, e.g. gdcFiles/TCGA-BRCA/mirna.
+        fileIDs (dict): md5sum to GDC file id, recorded in the manifest.
+        verify (bool): Hash every file, defaults to the --verify-cache setting.
+
+    Returns:
+        md5sums (dict): File name to md5sum.
+    """
+    if verify is None:
+        verify = settings["verify"]
+    if fileIDs is None:
+        fileIDs = {}
+    with _manifestLock:
+        manifest = _loadManifest(directory)
+        updated = {}
+        stale = []
+        for fileName in os.listdir(directory):
+            filePath = os.path.join(directory, fileName)
+            if fileName.startswith(".") or not os.path.isfile(filePath):
+                continue
+            entry = manifest.get(fileName)
+            stat = os.stat(filePath)
+            if verify or entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                stale.append(fileName)
+            else:
+                updated[fileName] = entry
+        hashes = md5sums(os.path.join(directory, fileName) for fileName in stale)
+        for fileName in stale:
+            filePath = os.path.join(directory, fileName)
+            updated[fileName] = _entry(filePath, hashes[filePath], manifest.get(fileName, {}).get("file_id"))
+        for entry in updated.values():
+            if entry.get("file_id") is None:
+                entry["file_id"] = fileIDs.get(entry["md5"])
+        if updated != manifest:
+            _saveManifest(directory, updated)
+    logger.info(f"{len(stale)} of {len(updated)} cached files hashed in {directory}")
+    return {fileName: entry["md5"] for fileName, entry in updated.items()}
+
+
+def record(directory, files):
+    """Add freshly downloaded files whose md5sum is already known to the manifest.
+
+    Args:
+        directory (str): Cache directory the files were written to.
+        files (dict): File name to (file id, md5sum).
+    """
+    if len(files) == 0:
+        return
+    with _manifestLock:
+        manifest = _loadManifest(directory)
+        for fileName, (fileID, md5) in files.items():
+            manifest[fileName] = _entry(os.path.join(directory, fileName), md5, fileID)
+        _saveManifest(directory, manifest)
+
+
+def audit(directory):
+    """Re-hash every file of a cache directory and compare with the manifest.
+
+    Files whose md5sum no longer matches the manifest are reported as
+    corrupted. Their recorded md5sum is kept, so every later audit reports
+    them too, but their recorded modification time is cleared, so the next
+    validation run hashes them again and downloads them anew.
+
+    Returns:
+        report (dict): files, bytes and seconds hashed, and the names of the
+            corrupted files.
+    """
+    with _manifestLock:
+        manifest = _loadManifest(directory)
+    fileNames = [fileName for fileName in os.listdir(directory)
+                 if not fileName.startswith(".") and os.path.isfile(os.path.join(directory, fileName))]
+    start = time.perf_counter()
+    found = md5sums(os.path.join(directory, fileName) for fileName in fileNames)
+    seconds = time.perf_counter() - start
+    corrupted = sorted(fileName for fileName in fileNames
+                       if fileName in manifest and manifest[fileName]["md5"] != found[os.path.join(directory, fileName)])
+    if len(corrupted) != 0:
+        with _manifestLock:
+            manifest = _loadManifest(directory)
+            for fileName in corrupted:
+                manifest[fileName]["mtime"] = None
+            _saveManifest(directory, manifest)
+    size = sum(os.path.getsize(filePath) for filePath in found)
+    return {"files": len(found), "bytes": size, "seconds": seconds, "corrupted": corrupted}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Audit the integrity of gdcFiles cache directories.'
+    )
+    parser.add_argument(
+        'directories',
+        nargs='*',
+        default=['gdcFiles'],
+        help='Cache directories to audit, searched recursively. Defaults to gdcFiles.',
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        help='Number of files hashed concurrently. Defaults to the number of cores.',
+    )
+    return parser
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=(logging.StreamHandler(sys.stdout),),
+    )
+    options = create_parser().parse_args()
+    configure(workers=options.workers)
+    corruptedFiles = []
+    totalBytes = 0
+    totalSeconds = 0
+    for top in options.directories:
+        for directory, _, fileNames in os.walk(top):
+            if not any(not fileName.startswith(".") for fileName in fileNames):
+                continue
+            report = audit(directory)
+            totalBytes += report["bytes"]
+            totalSeconds += report["seconds"]
+            corruptedFiles.extend(os.path.join(directory, fileName) for fileName in report["corrupted"])
+            logger.info(f"{directory}: {report['files']} files, {report['bytes'] / 2 ** 20:.0f} MiB in "
+                        f"{report['seconds']:.1f}s, {len(report['corrupted'])} corrupted")
+    throughput = totalBytes / 2 ** 20 / totalSeconds if totalSeconds else 0
+    logger.info(f"Audited {totalBytes / 2 ** 20:.0f} MiB at {throughput:.0f} MiB/s")
+    for filePath in corruptedFiles:
+        logger.info(f"Corrupted: {filePath}")
+    if len(corruptedFiles) != 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import logging
+import requests
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    "mode": None,
+    "directory": None,
+    "chunkSize": 1 << 20
+}
+
+
+class CassetteMiss(requests.RequestException):
+    """A replayed request that was never recorded, which no retry can answer."""
+
+
+def configure(record=None, replay=None):
+    """Record GDC traffic to, or replay it from, a cassette directory.
+
+    Args:
+        record (str): Directory every response is written to.
+        replay (str): Directory responses are served from, with no network access.
+    """
+    if record is not None and replay is not None:
+        raise ValueError("Cannot record and replay at the same time")
+    if record is not None:
+        settings["mode"], settings["directory"] = "record", record
+        os.makedirs(record, exist_ok=True)
+    elif replay is not None:
+        settings["mode"], settings["directory"] = "replay", replay
+
+
+def active():
+    return settings["mode"] is not None
+
+
+def adapter(**kwargs):
+    """Transport adapter for a GDC session, recording or replaying when configured."""
+    if settings["mode"] is None:
+        return requests.adapters.HTTPAdapter(**kwargs)
+    return CassetteAdapter(settings["mode"], settings["directory"], **kwargs)
+
+
+def requestKey(request):
+    """Identify a request by method, url, body and Range header."""
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode()
+    try:
+        # equal JSON bodies are the same request whatever the key order
+        body = json.dumps(json.loads(body), sort_keys=True).encode()
+    except ValueError:
+        pass
+    keyHash = hashlib.sha256()
+    for part in (request.method, request.url, request.headers.get("Range", "")):
+        keyHash.update(part.encode() + b"\0")
+    keyHash.update(body)
+    return keyHash.hexdigest()
+
+
+class CassetteAdapter(requests.adapters.HTTPAdapter):
+    """Stores each response body in a file named by its request key.
+
+    Bodies are kept decoded, so a replayed /data tarball streams from disk
+    exactly like the original response.
+    """
+
+    def __init__(self, mode, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.directory = directory
+
+    def _paths(self, key):
+        return os.path.join(self.directory, key + ".json"), os.path.join(self.directory, key + ".body")
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = requestKey(request)
+        if self.mode == "record":
+            self._record(key, super().send(request, stream=True, timeout=timeout, verify=verify, cert=cert,
+                                           proxies=proxies))
+        elif not os.path.exists(self._paths(key)[0]):
+            raise CassetteMiss(f"No recorded response for {request.method} {request.url}", request=request)
+        return self._replay(key, request)
+
+    def _record(self, key, response):
+        metaPath, bodyPath = self._paths(key)
+        pid = os.getpid()
+        try:
+            with open(f"{bodyPath}.{pid}.tmp", "wb") as bodyFile:
+                for chunk in response.raw.stream(settings["chunkSize"], decode_content=True):
+                    bodyFile.write(chunk)
+        except urllib3.exceptions.HTTPError as error:
+            os.remove(f"{bodyPath}.{pid}.tmp")
+            # surface broken transfers the way requests does for unrecorded sessions
+            raise requests.ConnectionError(error, request=response.request)
+        except BaseException:
+            os.remove(f"{bodyPath}.{pid}.tmp")
+            raise
+        finally:
+            response.close()
+        meta = {
+            "method": response.request.method,
+            "url": response.request.url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers)
+        }
+        with open(f"{metaPath}.{pid}.tmp", "w") as metaFile:
+            json.dump(meta, metaFile, indent=1)
+        os.replace(f"{bodyPath}.{pid}.tmp", bodyPath)
+        os.replace(f"{metaPath}.{pid}.tmp", metaPath)
+
+    def _replay(self, key, request):
+        metaPath, bodyPath = self._paths(key)
+        with open(metaPath, "r") as metaFile:
+            meta = json.load(metaFile)
+        headers = {name: value for name, value in meta["headers"].items()
+                   if name.lower() not in ("content-encoding", "transfer-encoding", "content-length")}
+        headers["Content-Length"] = str(os.path.getsize(bodyPath))
+        raw = urllib3.HTTPResponse(body=open(bodyPath, "rb"), headers=headers, status=meta["status"],
+                                   reason=meta["reason"], preload_content=False, decode_content=False,
+                                   request_method=request.method)
+        return self.build_response(request, raw)
@@ -0,0 +1,245 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import logging
+import requests
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+import gdcCassette
+import traceEvents
+
+logger = logging.getLogger(__name__)
+
+# Point the validators at another API, e.g. gdcStandIn, with GDC_API_URL or --gdc-url.
+GDC_API = os.environ.get("GDC_API_URL", "https://api.gdc.cancer.gov").rstrip("/")
+
+settings = {
+    "pageSize": 5000,
+    "workers": 4,
+    "retries": 5,
+    "backoff": 1.0,
+    # responses are cached per GDC data release, least recently used first out
+    "cacheDir": ".gdcMetadata",
+    "cacheSize": 1 << 30,
+    "refresh": False
+}
+
+# Paging needs a stable order, otherwise hits can move between pages.
+SORT_FIELDS = {
+    "cases": "case_id:asc",
+    "files": "file_id:asc",
+    "projects": "project_id:asc"
+}
+
+_session = None
+_dataRelease = None
+
+
+def configure(pageSize=None, workers=None, cacheDir=None, refresh=None, apiUrl=None):
+    """Override the client settings for this process.
+
+    Args:
+        apiUrl (str): Base URL of the GDC API.
+        cacheDir (str): Metadata cache directory, "" disables the cache.
+        refresh (bool): Query the GDC even when a cached response exists.
+    """
+    global _session, _dataRelease, GDC_API
+    if apiUrl is not None and apiUrl.rstrip("/") != GDC_API:
+        GDC_API = apiUrl.rstrip("/")
+        _dataRelease = None
+    for key, value in (("pageSize", pageSize), ("workers", workers), ("cacheDir", cacheDir), ("refresh", refresh)):
+        if value is not None:
+            settings[key] = value
+    _session = None
+
+
+def session():
+    """Keep-alive session shared by every metadata request of this process."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate"})
+        retry = Retry(total=settings["retries"], backoff_factor=settings["backoff"],
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=None)
+        adapter = gdcCassette.adapter(pool_connections=1, pool_maxsize=settings["workers"], max_retries=retry)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def url(endpoint):
+    return f"{GDC_API}/{endpoint.strip('/')}"
+
+
+def _request(method, endpoint, **kwargs):
+    # the adapter retries refused connections and 429/5xx, but not a body cut off half way
+    for attempt in range(settings["retries"] + 1):
+        try:
+            with traceEvents.span(endpoint.strip("/"), "gdc request", method=method, attempt=attempt):
+                response = session().request(method, url(endpoint), **kwargs)
+                response.raise_for_status()
+                return response.json()
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as error:
+            if attempt == settings["retries"]:
+                raise
+            delay = settings["backoff"] * 2 ** attempt
+            logger.info(f"GDC request to {endpoint} interrupted ({error}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+def get(endpoint):
+    return _request("GET", endpoint)
+
+
+def post(endpoint, params):
+    return _request("POST", endpoint, json=params)
+
+
+def dataRelease():
+    """Current GDC data release, None if /status could not be read."""
+    global _dataRelease
+    if _dataRelease is None:
+        try:
+            _dataRelease = get("status")["data_release"]
+        except (requests.RequestException, ValueError, KeyError) as error:
+            logger.info(f"GDC data release unknown ({error}), metadata cache disabled")
+            _dataRelease = ""
+    return _dataRelease or None
+
+
+def _releaseDir():
+    # a cassette has to see every request to record or replay it
+    if not settings["cacheDir"] or gdcCassette.active():
+        return None
+    release = dataRelease()
+    if release is None:
+        return None
+    return os.path.join(settings["cacheDir"], re.sub(r"[^\w.-]+", "_", release))
+
+
+def _cacheKey(endpoint, params):
+    params = dict(params)
+    if isinstance(params.get("filters"), str):
+        # filters are sent either as JSON text or as a dict, key both the same way
+        params["filters"] = json.loads(params["filters"])
+    text = json.dumps({"api": GDC_API, "endpoint": endpoint.strip("/"), "params": params}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _readCache(endpoint, params):
+    releaseDir = _releaseDir()
+    if releaseDir is None or settings["refresh"]:
+        return None
+    cachePath = os.path.join(releaseDir, _cacheKey(endpoint, params) + ".json.gz")
+    try:
+        with gzip.open(cachePath, "rt") as cacheFile:
+            cached = json.load(cacheFile)
+    except (OSError, ValueError):
+        return None
+    # the modification time doubles as the last use for the LRU cap
+    os.utime(cachePath)
+    return cached
+
+
+def _writeCache(endpoint, params, value):
+    releaseDir = _releaseDir()
+    if releaseDir is None:
+        return
+    if not os.path.isdir(releaseDir):
+        # a new data release invalidates everything cached before it, but -j workers may be
+        # filling the directory of the current release at the same time, so that one stays
+        if os.path.isdir(settings["cacheDir"]):
+            for entry in os.scandir(settings["cacheDir"]):
+                if entry.name != os.path.basename(releaseDir):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        os.makedirs(releaseDir, exist_ok=True)
+    cachePath = os.path.join(releaseDir, _cacheKey(endpoint, params) + ".json.gz")
+    try:
+        with gzip.open(f"{cachePath}.{os.getpid()}.tmp", "wt") as cacheFile:
+            json.dump(value, cacheFile)
+        os.replace(f"{cachePath}.{os.getpid()}.tmp", cachePath)
+    except FileNotFoundError:
+        # the release directory was removed under us, the response is simply not cached
+        return
+    _pruneCache(releaseDir)
+
+
+def _pruneCache(releaseDir):
+    entries = []
+    for entry in os.scandir(releaseDir):
+        if entry.name.endswith(".json.gz"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= settings["cacheSize"]:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def cachedPost(endpoint, params):
+    """post() answered from the metadata cache while the data release is unchanged."""
+    cached = _readCache(endpoint, params)
+    if cached is not None:
+        return cached
+    value = post(endpoint, params)
+    _writeCache(endpoint, params, value)
+    return value
+
+
+def cachedGet(endpoint):
+    """get() answered from the metadata cache while the data release is unchanged."""
+    cached = _readCache(endpoint, {})
+    if cached is not None:
+        return cached
+    value = get(endpoint)
+    _writeCache(endpoint, {}, value)
+    return value
+
+
+def _page(endpoint, params, start):
+    return post(endpoint, dict(params, **{"from": start, "size": settings["pageSize"]}))["data"]
+
+
+def hits(endpoint, params):
+    """Yield every hit of a cases, files or projects query.
+
+    The first page gives the total from its pagination block, the rest are
+    requested concurrently and their hits yielded in order as they arrive,
+    so no result is ever cut off by a fixed "size". The complete hit list
+    is cached on disk until the GDC data release changes.
+
+    Args:
+        endpoint (str): API endpoint, e.g. "files".
+        params (dict): Query parameters without "from" and "size".
+    """
+    params = {key: value for key, value in params.items() if key not in ("from", "size")}
+    sortField = SORT_FIELDS.get(endpoint.strip("/"))
+    if sortField is not None:
+        params.setdefault("sort", sortField)
+    cached = _readCache(endpoint, params)
+    if cached is not None:
+        yield from cached
+        return
+    firstPage = _page(endpoint, params, 0)
+    allHits = list(firstPage["hits"])
+    yield from firstPage["hits"]
+    total = firstPage["pagination"]["total"]
+    starts = range(settings["pageSize"], total, settings["pageSize"])
+    if len(starts) != 0:
+        logger.info(f"Fetching {total} {endpoint.strip('/')} hits in {len(starts) + 1} pages")
+        with ThreadPoolExecutor(max_workers=settings["workers"]) as executor:
+            pages = [executor.submit(_page, endpoint, params, start) for start in starts]
+            for page in pages:
+                pageHits = page.result()["hits"]
+                allHits.extend(pageHits)
+                yield from pageHits
+    _writeCache(endpoint, params, allHits)
@@ -0,0 +1,262 @@
+import os
+import re
+import time
+import logging
+import hashlib
+import tarfile
+import urllib3
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import gdcCache
+import gdcClient
+import gdcCassette
+import traceEvents
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    "workers": 4,
+    "batchSize": 100,
+    "retries": 5,
+    "backoff": 2.0,
+    "chunkSize": 1 << 20
+}
+
+_session = None
+
+
+def configure(workers=None, batchSize=None, retries=None, backoff=None):
+    """Override the download settings for this process."""
+    global _session
+    for key, value in (("workers", workers), ("batchSize", batchSize), ("retries", retries), ("backoff", backoff)):
+        if value is not None:
+            settings[key] = value
+    _session = None
+
+
+def session():
+    """Pooled HTTP session shared by all download workers of this process."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = gdcCassette.adapter(pool_connections=1, pool_maxsize=settings["workers"])
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def _responseFileName(response, fileID):
+    disposition = response.headers.get("Content-Disposition", "")
+    match = re.search(r'filename="?([^";]+)"?', disposition)
+    return match.group(1) if match else fileID
+
+
+def _fileMd5(filePath):
+    md5Hash = hashlib.md5()
+    with open(filePath, "rb") as file:
+        for chunk in iter(lambda: file.read(settings["chunkSize"]), b""):
+            md5Hash.update(chunk)
+    return md5Hash
+
+
+def _finishFile(partPath, md5Hash, expectedMd5, filePath):
+    """Move a fully written part file into place if its md5sum matches.
+
+    Returns:
+        md5 (str): md5sum of the file, None if it was discarded.
+    """
+    md5 = md5Hash.hexdigest()
+    if expectedMd5 is not None and md5 != expectedMd5:
+        logger.info(f"md5sum mismatch for {os.path.basename(filePath)}, discarding it")
+        os.remove(partPath)
+        return None
+    os.replace(partPath, filePath)
+    return md5
+
+
+def _partPath(outputDir, name):
+    """Part file of this process, so concurrent jobs writing the same directory never share one."""
+    return os.path.join(outputDir, f".{name}.{os.getpid()}.part")
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _adoptPart(outputDir, fileID, partPath):
+    """Take over the part file a process that is no longer running left for fileID, so its transfer resumes.
+
+    The rename is atomic, so of several jobs resuming the same file only one
+    gets the part file and the others start from scratch.
+    """
+    prefix = f".{fileID}."
+    for name in os.listdir(outputDir):
+        pid = name[len(prefix):-len(".part")]
+        if not name.startswith(prefix) or not name.endswith(".part") or not pid.isdigit() or _running(int(pid)):
+            continue
+        try:
+            os.rename(os.path.join(outputDir, name), partPath)
+            return
+        except OSError:
+            continue
+
+
+def _streamMember(source, outputDir, fileName, expectedMd5):
+    partPath = _partPath(outputDir, fileName)
+    md5Hash = hashlib.md5()
+    with open(partPath, "wb") as partFile:
+        for chunk in iter(lambda: source.read(settings["chunkSize"]), b""):
+            md5Hash.update(chunk)
+            partFile.write(chunk)
+    return _finishFile(partPath, md5Hash, expectedMd5, os.path.join(outputDir, fileName))
+
+
+def _streamTarball(ids, outputDir, md5sums, completed):
+    """Extract the tarball for a batch of ids while it is being received.
+
+    Members are <file_id>/<file_name> and are written straight to
+    outputDir/<file_name>, equivalent to tar --strip-components=1. Ids whose
+    member arrived intact are added to completed, as file id to (file name,
+    md5sum), as they finish, so an
+    interrupted stream leaves a record of what does not need fetching again.
+    """
+    with session().post(gdcClient.url("data"), json={"ids": ids}, headers={"Content-Type": "application/json"},
+                        stream=True, timeout=(30, 300)) as response:
+        response.raise_for_status()
+        # the tar reader consumes the raw urllib3 stream, whose errors are not wrapped by requests
+        response.raw.decode_content = True
+        with tarfile.open(fileobj=response.raw, mode="r|*") as tar:
+            for member in tar:
+                fileID, _, fileName = member.name.partition("/")
+                if not member.isfile() or fileID not in md5sums or fileName != os.path.basename(fileName):
+                    continue
+                md5 = _streamMember(tar.extractfile(member), outputDir, fileName, md5sums[fileID])
+                if md5 is not None:
+                    completed[fileID] = (fileName, md5)
+
+
+def _streamSingle(fileID, fileName, outputDir, expectedMd5, completed):
+    """Fetch a single id, which the data endpoint returns as the file itself.
+
+    The part file is kept next to its final location so an interrupted
+    transfer resumes with a Range request, also in a later run, see
+    _adoptPart.
+    """
+    partPath = _partPath(outputDir, fileID)
+    if not os.path.exists(partPath):
+        _adoptPart(outputDir, fileID, partPath)
+    offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+    headers = {"Content-Type": "application/json"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with session().post(gdcClient.url("data"), json={"ids": [fileID]}, headers=headers, stream=True,
+                        timeout=(30, 300)) as response:
+        fileName = fileName or _responseFileName(response, fileID)
+        if response.status_code == 416:
+            # the part file already holds the whole file
+            md5Hash = _fileMd5(partPath)
+        else:
+            response.raise_for_status()
+            # servers that ignore the Range header send the whole body again
+            if response.status_code == 206:
+                md5Hash, mode = _fileMd5(partPath), "ab"
+            else:
+                md5Hash, mode = hashlib.md5(), "wb"
+            with open(partPath, mode) as partFile:
+                for chunk in response.iter_content(settings["chunkSize"]):
+                    md5Hash.update(chunk)
+                    partFile.write(chunk)
+    md5 = _finishFile(partPath, md5Hash, expectedMd5, os.path.join(outputDir, fileName))
+    if md5 is not None:
+        completed[fileID] = (fileName, md5)
+
+
+def _downloadBatch(ids, fileNames, outputDir, md5sums):
+    """Download a batch of ids, retrying whatever has not arrived intact.
+
+    Returns:
+        remaining (list): Ids that could not be downloaded.
+        downloaded (dict): File id to (file name, md5sum) of the files written.
+    """
+    remaining = list(ids)
+    downloaded = {}
+    for attempt in range(settings["retries"] + 1):
+        completed = {}
+        error = None
+        try:
+            with traceEvents.span("data", "gdc request", files=len(remaining), attempt=attempt):
+                if len(remaining) == 1:
+                    _streamSingle(remaining[0], fileNames.get(remaining[0]), outputDir, md5sums[remaining[0]],
+                                  completed)
+                else:
+                    _streamTarball(remaining, outputDir, md5sums, completed)
+        except gdcCassette.CassetteMiss:
+            raise
+        except (requests.RequestException, urllib3.exceptions.HTTPError, OSError, tarfile.TarError) as streamError:
+            error = streamError
+        downloaded.update(completed)
+        remaining = [fileID for fileID in remaining if fileID not in completed]
+        if len(remaining) == 0:
+            break
+        if error is None:
+            error = "missing or corrupt files"
+        if attempt == settings["retries"]:
+            logger.info(f"Download of {len(remaining)} files failed: {error}")
+            break
+        delay = settings["backoff"] * 2 ** attempt
+        logger.info(f"Download of {len(remaining)} files interrupted ({error}), retrying in {delay:.0f}s")
+        time.sleep(delay)
+    return remaining, downloaded
+
+
+def sampleMd5sums(sampleDict):
+    """File id to md5sum for a sample -> file id -> file info dict."""
+    return {fileID: sampleDict[sample][fileID]["md5sum"] for sample in sampleDict for fileID in sampleDict[sample]}
+
+
+def downloadFiles(fileList, outputDir, md5sums=None):
+    """Download files from the GDC data endpoint into outputDir.
+
+    The ids are split into batches that are fetched concurrently over a
+    pooled session. Each batch is extracted as it streams in and every file
+    is checked against its md5sum before it is moved into place, so nothing
+    but the files themselves is written to disk. Ids that did not arrive
+    intact are requested again with exponential backoff.
+
+    Args:
+        fileList (list or dict): File ids, or file id to file name.
+        outputDir (str): Directory the files are written to.
+        md5sums (dict): File id to expected md5sum, see sampleMd5sums.
+            Files are not verified when None.
+    """
+    if isinstance(fileList, dict):
+        ids = list(fileList.keys())
+        fileNames = fileList
+    else:
+        ids = list(fileList)
+        fileNames = {}
+    if md5sums is None:
+        md5sums = {}
+    md5sums = {fileID: md5sums.get(fileID) for fileID in ids}
+    os.makedirs(outputDir, exist_ok=True)
+    batchSize = settings["batchSize"]
+    batches = [ids[i:i + batchSize] for i in range(0, len(ids), batchSize)]
+    logger.info(f"Downloading {len(ids)} files from the GDC in {len(batches)} batches")
+    with ThreadPoolExecutor(max_workers=settings["workers"]) as executor:
+        futures = [executor.submit(_downloadBatch, batch, fileNames, outputDir, md5sums) for batch in batches]
+        failed = []
+        downloaded = {}
+        for future in futures:
+            remaining, batchDownloaded = future.result()
+            failed.extend(remaining)
+            downloaded.update(batchDownloaded)
+    # the files were hashed on the way in, so the cache manifest does not need to hash them again
+    gdcCache.record(outputDir, {fileName: (fileID, md5) for fileID, (fileName, md5) in downloaded.items()})
+    if len(failed) != 0:
+        raise RuntimeError(f"{len(failed)} of {len(ids)} files could not be downloaded from the GDC")
@@ -0,0 +1,346 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import tarfile
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Fixture layout:
+#   cases.json, files.json, projects.json   lists of documents as the GDC returns them
+#   survival.json                           list of donors, each with a project_id
+#   status.json, _mapping.json              optional, derived when missing
+#   data/<file_id>                          contents of each file in files.json
+ID_FIELDS = {"cases": "case_id", "files": "file_id", "projects": "project_id"}
+
+
+def leafValues(document, path):
+    """Every value found at a dotted path, descending into lists."""
+    values = [document]
+    for key in path.split("."):
+        found = []
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and key in item:
+                    found.append(item[key])
+        values = found
+    leaves = []
+    for value in values:
+        leaves.extend(value if isinstance(value, list) else [value])
+    return leaves
+
+
+def normalize(value):
+    # the GDC matches keyword values case-insensitively
+    return value.lower() if isinstance(value, str) else value
+
+
+def matches(document, gdcFilter, endpoint):
+    """Evaluate a GDC filter against one document of an endpoint."""
+    if not gdcFilter:
+        return True
+    op = gdcFilter["op"].lower()
+    content = gdcFilter["content"]
+    if op == "and":
+        return all(matches(document, clause, endpoint) for clause in content)
+    if op == "or":
+        return any(matches(document, clause, endpoint) for clause in content)
+    if op == "not":
+        return not matches(document, content[0] if isinstance(content, list) else content, endpoint)
+    field = content["field"]
+    if field.startswith(endpoint + "."):
+        field = field[len(endpoint) + 1:]
+    expected = content.get("value")
+    expected = {normalize(value) for value in (expected if isinstance(expected, list) else [expected])}
+    found = {normalize(value) for value in leafValues(document, field)}
+    if op in ("in", "="):
+        return len(found & expected) != 0
+    if op in ("exclude", "!="):
+        return len(found & expected) == 0
+    if op == "is":
+        return len(found) == 0 if "missing" in expected else len(found) != 0
+    raise ValueError(f"Unsupported filter op {op}")
+
+
+def project(document, tree):
+    """Keep the requested field tree of a document, mirroring the GDC fields parameter."""
+    if isinstance(document, list):
+        return [project(item, tree) for item in document]
+    if not isinstance(document, dict):
+        return document
+    projected = {}
+    for key, subtree in tree.items():
+        if key in document:
+            projected[key] = project(document[key], subtree) if subtree else document[key]
+    return projected
+
+
+def fieldTree(fields):
+    tree = {}
+    for field in fields:
+        node = tree
+        for key in field.split("."):
+            node = node.setdefault(key, {})
+    return tree
+
+
+def mappingFields(documents, prefix=""):
+    fields = set()
+    for document in documents:
+        for key, value in document.items():
+            items = value if isinstance(value, list) else [value]
+            nested = [item for item in items if isinstance(item, dict)]
+            if nested:
+                fields |= mappingFields(nested, f"{prefix}{key}.")
+            else:
+                fields.add(prefix + key)
+    return fields
+
+
+class Fixtures:
+    """Documents of a fixture directory with the cases <-> files relations filled in."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.documents = {}
+        for endpoint in ID_FIELDS:
+            self.documents[endpoint] = self._load(f"{endpoint}.json", [])
+        self.survival = self._load("survival.json", [])
+        self.status = self._load("status.json", {"data_release": "Stand-in", "status": "OK", "version": 1})
+        self.filesById = {document["file_id"]: document for document in self.documents["files"]}
+        # /cases filters on files.* fields, so every case carries its files
+        caseFiles = {}
+        for document in self.documents["files"]:
+            fileFields = {key: value for key, value in document.items() if key != "cases"}
+            for case in document.get("cases", []):
+                caseFiles.setdefault(case["case_id"], []).append(fileFields)
+        for case in self.documents["cases"]:
+            case.setdefault("files", caseFiles.get(case["case_id"], []))
+        self.mapping = self._load("_mapping.json", None)
+        if self.mapping is None:
+            fields = mappingFields(self.documents["files"])
+            self.mapping = {"fields": sorted(fields), "expand": [], "nested": []}
+
+    def _load(self, fileName, default):
+        path = os.path.join(self.directory, fileName)
+        if not os.path.exists(path):
+            return default
+        with open(path, "r") as fixtureFile:
+            return json.load(fixtureFile)
+
+    def dataPath(self, fileID):
+        return os.path.join(self.directory, "data", fileID)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # set on the handler class created by start()
+    fixtures = None
+    faults = None
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.handle_request(url.path, params)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            return self.send_json({"message": "Request body is not JSON"}, 400)
+        self.handle_request(urlparse(self.path).path, params)
+
+    def handle_request(self, path, params):
+        faults = self.faults
+        if faults["latency"]:
+            time.sleep(faults["latency"] * (0.5 + faults["random"].random()))
+        if faults["random"].random() < faults["throttle"]:
+            return self.send_json({"message": "Too many requests"}, 429, {"Retry-After": str(faults["retryAfter"])})
+        parts = [part for part in path.split("/") if part]
+        try:
+            if parts == ["status"]:
+                return self.send_json(self.fixtures.status)
+            if parts == ["files", "_mapping"]:
+                return self.send_json(self.fixtures.mapping)
+            if parts == ["analysis", "survival"]:
+                return self.send_json(self.survival(params))
+            if parts[:1] == ["data"]:
+                return self.send_data(parts[1:] or params.get("ids", []))
+            if len(parts) == 1 and parts[0] in ID_FIELDS:
+                return self.send_json(self.search(parts[0], params))
+        except (ValueError, KeyError, TypeError) as error:
+            return self.send_json({"message": f"Bad request: {error}"}, 400)
+        self.send_json({"message": f"Unknown endpoint {path}"}, 404)
+
+    def search(self, endpoint, params):
+        gdcFilter = params.get("filters") or {}
+        if isinstance(gdcFilter, str):
+            gdcFilter = json.loads(gdcFilter)
+        hits = [document for document in self.fixtures.documents[endpoint] if matches(document, gdcFilter, endpoint)]
+        sort = params.get("sort")
+        if sort:
+            field, _, order = sort.partition(":")
+            hits.sort(key=lambda document: str(leafValues(document, field)), reverse=order == "desc")
+        total = len(hits)
+        start = int(params.get("from", 0))
+        size = int(params.get("size", 10))
+        hits = hits[start:start + size]
+        fields = [field for field in str(params.get("fields", "")).split(",") if field]
+        idField = ID_FIELDS[endpoint]
+        if fields:
+            tree = fieldTree(fields)
+            hits = [dict(project(document, tree), id=document[idField]) for document in hits]
+        else:
+            hits = [dict(document, id=document[idField]) for document in hits]
+        pagination = {"count": len(hits), "total": total, "size": size, "from": start, "sort": sort or "",
+                      "page": start // size + 1 if size else 1, "pages": -(-total // size) if size else 1}
+        return {"data": {"hits": hits, "pagination": pagination}, "warnings": {}}
+
+    def survival(self, params):
+        gdcFilter = params.get("filters") or {}
+        if isinstance(gdcFilter, str):
+            gdcFilter = json.loads(gdcFilter)
+        projects = set()
+        for clause in ([gdcFilter] if gdcFilter.get("op") != "and" else gdcFilter["content"]):
+            if clause and clause["content"].get("field") in ("cases.project.project_id", "project.project_id"):
+                projects |= set(clause["content"]["value"])
+        donors = [{key: value for key, value in donor.items() if key != "project_id"}
+                  for donor in self.fixtures.survival if not projects or donor.get("project_id") in projects]
+        return {"results": [{"donors": donors, "meta": {"id": 0}}], "overallStats": {}}
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.send_body(body)
+
+    def send_body(self, body):
+        if self.faults["random"].random() < self.faults["drop"] and len(body) > 1:
+            # send half of the promised body, then drop the connection
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def send_data(self, ids):
+        for fileID in ids:
+            if fileID not in self.fixtures.filesById:
+                return self.send_json({"message": f"File {fileID} not found"}, 404)
+        if len(ids) == 1:
+            document = self.fixtures.filesById[ids[0]]
+            with open(self.fixtures.dataPath(ids[0]), "rb") as dataFile:
+                body = dataFile.read()
+            headers = {"Content-Disposition": f"attachment; filename={document['file_name']}",
+                       "Content-Type": "application/octet-stream"}
+            return self.send_bytes(body, headers)
+        with tempfile.SpooledTemporaryFile(max_size=64 << 20) as archive:
+            with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+                for fileID in ids:
+                    tar.add(self.fixtures.dataPath(fileID), arcname=f"{fileID}/{self.fixtures.filesById[fileID]['file_name']}")
+                manifest = ("id\tfilename\n" + "".join(
+                    f"{fileID}\t{self.fixtures.filesById[fileID]['file_name']}\n" for fileID in ids)).encode()
+                info = tarfile.TarInfo("MANIFEST.txt")
+                info.size = len(manifest)
+                tar.addfile(info, io.BytesIO(manifest))
+            archive.seek(0)
+            body = archive.read()
+        headers = {"Content-Disposition": f"attachment; filename=gdc_download_{int(time.time())}.tar.gz",
+                   "Content-Type": "application/octet-stream"}
+        self.send_bytes(body, headers)
+
+    def send_bytes(self, body, headers):
+        start = 0
+        rangeHeader = self.headers.get("Range", "")
+        if rangeHeader.startswith("bytes="):
+            start = int(rangeHeader[len("bytes="):].split("-")[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if start else 200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        self.send_body(body[start:])
+
+
+def start(fixtureDir, port=0, host="127.0.0.1", latency=0.0, throttle=0.0, drop=0.0, retryAfter=1, seed=None):
+    """Serve a fixture directory from a background thread.
+
+    Args:
+        latency (float): Mean seconds added to every request.
+        throttle (float): Fraction of requests answered with 429.
+        drop (float): Fraction of responses cut off half way.
+
+    Returns:
+        server (ThreadingHTTPServer): Call shutdown() to stop it.
+        url (str): Base URL to use as the GDC API URL.
+    """
+    faults = {"latency": latency, "throttle": throttle, "drop": drop, "retryAfter": retryAfter,
+              "random": random.Random(seed)}
+    handler = type("FixtureHandler", (StandInHandler,), {"fixtures": Fixtures(fixtureDir), "faults": faults})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Serve GDC API fixtures locally, optionally with injected faults.'
+    )
+    parser.add_argument('fixtures', help='Fixture directory, e.g. one written by syntheticProject.py.')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean seconds of latency added to each request.')
+    parser.add_argument('--throttle', type=float, default=0.0, help='Fraction of requests answered with 429.')
+    parser.add_argument('--drop', type=float, default=0.0, help='Fraction of responses dropped half way.')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429 responses.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the injected faults.')
+    return parser
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=(logging.StreamHandler(sys.stdout),),
+    )
+    options = create_parser().parse_args()
+    server, url = start(options.fixtures, options.port, options.host, options.latency, options.throttle,
+                        options.drop, options.retry_after, options.seed)
+    logger.info(f"Serving {options.fixtures} at {url}, run the validators with --gdc-url {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
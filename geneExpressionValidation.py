@@ -1,33 +1,33 @@
 import os
 import logging
-import hashlib
-import requests
+import gdcClient
 import json
-import subprocess
 import pandas
 import numpy
-from concurrent.futures import ThreadPoolExecutor
 import warnings
+import numericUtils
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
+import xenaMatrix
 warnings.filterwarnings("ignore")
 
 
 logger = logging.getLogger(__name__)
 
-
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
+STAR_DATA_COLUMNS = {
+    "star_counts": "unstranded",
+    "star_tpm": "tpm_unstranded",
+    "star_fpkm": "fpkm_unstranded",
+    "star_fpkm-uq": "fpkm_uq_unstranded"
+}
 
 
 def existing_md5sums(logger, projectName, dataType, sampleDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/STAR") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/STAR/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {sampleDict[sample][fileID]["md5sum"]: fileID for sample in sampleDict for fileID in sampleDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/STAR", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/STAR")
     fileIdDict = {innerKey: value
@@ -38,52 +38,6 @@ def existing_md5sums(logger, projectName, dataType, sampleDict):
     return filesNeededToUpdate
 
 
-def custom_round(chunk):
-    for col in chunk:
-        chunk[col] = chunk[col].apply(lambda x: numpy.format_float_scientific(x, precision=8) if pandas.notna(x) else numpy.nan)
-    
-    return chunk
-
-
-def round_ForNans(x):
-    if( pandas.notna(x) ):
-        return numpy.format_float_scientific(x, precision=8)
-    else:
-        return numpy.nan
-
-
-def downloadFiles(fileList, projectName):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/STAR"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     with open(xenaFile, "r") as xenaData:
         header = xenaData.readline()  # get column labels from xena matrix
@@ -94,82 +48,8 @@ def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     return sampleList
 
 
-def getAllSamples(projectName):
-    casesEndpt = "https://api.gdc.cancer.gov/cases"
-    allSamplesFilter = {
-        "op": "and",
-        "content": [
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.project.project_id",
-                    "value": [
-                        projectName
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.analysis.workflow_type",
-                    "value": [
-                        "STAR - Counts"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_category",
-                    "value": [
-                        "Transcriptome Profiling"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_type",
-                    "value": [
-                        "Gene Expression Quantification"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.experimental_strategy",
-                    "value": [
-                        "RNA-Seq"
-                    ]
-                }
-            }
-        ]
-    }
-    params = {
-        "filters": json.dumps(allSamplesFilter),
-        "fields": "submitter_sample_ids",
-        "format": "json",
-        "size": 20000
-    }
-    response = requests.post(casesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
-    allSamples = []
-    for caseDict in responseJson:
-        for sample in caseDict["submitter_sample_ids"]:
-            allSamples.append(sample)
-    
-    return allSamples
-
-
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-    
-    return jsonObj
-
-
-def dataTypeSamples(samples, projectName):
-    filesEndpt = "https://api.gdc.cancer.gov/files"
+def dataTypeSamples(projectName):
+    filesEndpt = "files"
     dataTypeFilter = {
         "op": "and",
         "content": [
@@ -215,24 +95,15 @@ def dataTypeSamples(samples, projectName):
                         "RNA-Seq"
                     ]
                 }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.samples.submitter_id",
-                    "value": samples
-                }
             }
         ]
     }
     params = {
         "filters": json.dumps(dataTypeFilter),
         "fields": "cases.samples.submitter_id,file_id,file_name,cases.samples.tissue_type,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
+    responseJson = gdcClient.hits(filesEndpt, params)
     dataTypeDict = {}
     uniqueSamples = []
     for caseDict in responseJson:
@@ -253,106 +124,131 @@ def dataTypeSamples(samples, projectName):
 
 
 def xenaDataframe(xenaFile):
-    xenaDF = pandas.read_csv(xenaFile, sep="\t", index_col=0)
-    splitDF = numpy.array_split(xenaDF.columns, 32)
-    tasks = [xenaDF[i] for i in splitDF]
-    with ThreadPoolExecutor() as executor:
-        result = executor.map(custom_round, tasks)
-    resultDF = pandas.concat(result, axis=1)
+    xenaDF = xenaMatrix.read(xenaFile)
     
-    return resultDF
+    return xenaDF
+
+
+def compare(logger, dataColumns, sampleDict, xenaDFs, projectName):
+    """Compare every requested STAR column in a single pass over the GDC files.
 
+    Args:
+        dataColumns (dict): Xena data type to augmented_star_gene_counts column.
+        xenaDFs (dict): Xena data type to Xena matrix.
 
-def compare(logger, dataColumn, sampleDict, xenaDF, projectName):
-    samplesCorrect = 0
-    failed = []
+    Returns:
+        failed (dict): Xena data type to list of failed samples.
+    """
+    failed = {dataType: [] for dataType in dataColumns}
+    columns = list(dataColumns.values())
     sampleNum = 1
     total = len(sampleDict)
     for sample in sampleDict:
-        fileCount = 0
-        for fileID in sampleDict[sample]:
-            fileName = sampleDict[sample][fileID]["fileName"]
-            sampleFile = "gdcFiles/{}/STAR/{}".format(projectName, fileName)
-            if fileCount == 0:
-                sampleDataDF = pandas.read_csv(sampleFile, sep="\t", skiprows=1)
-                sampleDataDF = sampleDataDF.drop(sampleDataDF.index[:4])
-                sampleDataDF.reset_index(inplace=True, drop=True)
-                sampleDataDF["nonNanCount"] = 0
-                sampleDataDF["nonNanCount"] = sampleDataDF.apply(
-                    lambda x: 1 if (not (pandas.isna(x[dataColumn]))) else 0, axis=1)
-                sampleDataDF[dataColumn] = sampleDataDF[dataColumn].fillna(0)
-            else:
-                tempDF = pandas.read_csv(sampleFile, sep="\t", skiprows=1)
-                tempDF = tempDF.drop(tempDF.index[:4])
-                tempDF.reset_index(inplace=True, drop=True)
-                tempDF["nonNanCount"] = 0
-                tempDF["nonNanCount"] = tempDF.apply(lambda x: 1 if (not (pandas.isna(x[dataColumn]))) else 0,
-                                                     axis=1)
-                tempDF[dataColumn] = tempDF[dataColumn].fillna(0)
-                sampleDataDF["nonNanCount"] += tempDF["nonNanCount"]
-                sampleDataDF[dataColumn] += tempDF[dataColumn]
-            fileCount += 1
-        sampleDataDF[dataColumn] = sampleDataDF[dataColumn].astype(float)
-        sampleDataDF[dataColumn] = sampleDataDF.apply(lambda x: x[dataColumn]/x["nonNanCount"] if x["nonNanCount"] != 0 else numpy.nan, axis=1)
-        sampleDataDF[dataColumn] = numpy.log2(sampleDataDF[dataColumn] + 1)
-        vectorRound = numpy.vectorize(round_ForNans)
-        roundedSeries = vectorRound(sampleDataDF[dataColumn])
-        sampleDataDF[dataColumn] = roundedSeries
-        #print(sampleDataDF[dataType])
-        #print(xenaDF[sample])
-        # pool = multiprocessing.Pool()
-        # sampleDataDF[dataType] = pool.map(round_ForNans, sampleDataDF[dataType])
-        sampleDataDF[dataColumn].reset_index(drop=True, inplace=True)
-        xenaDF[sample].reset_index(drop=True, inplace=True)
-        xenaColumn = xenaDF[sample]
-        sampleColumn = sampleDataDF[dataColumn]
-        if( xenaColumn.equals(sampleColumn)):
-            status = "[{:d}/{:d}] Sample: {} - Passed"
-            logger.info(status.format(sampleNum, total, sample))
-            samplesCorrect += 1
+        # the GDC files are parsed once for every data type, so they are only skipped when all are unchanged
+        previous = {dataType: resultsStore.reusedResult(projectName, dataType, sample, xenaDFs[dataType][sample],
+                                                        sampleDict[sample])
+                    for dataType in dataColumns}
+        if None not in previous.values():
+            equal = {dataType: previous[dataType] == "PASSED" for dataType in dataColumns}
         else:
-            status = "[{:d}/{:d}] Sample: {} - Failed"
-            logger.info(status.format(sampleNum, total, sample))
-            failed.append('{} ({})'.format(sample, sampleNum))
+            jobMetrics.stage("GDC load")
+            replicates = []
+            for fileID in sampleDict[sample]:
+                fileName = sampleDict[sample][fileID]["fileName"]
+                sampleFile = "gdcFiles/{}/STAR/{}".format(projectName, fileName)
+                with traceEvents.span(fileName, "parse"):
+                    sampleDataDF = pandas.read_csv(sampleFile, sep="\t", skiprows=1, usecols=columns)
+                # the first four rows are the N_unmapped, N_multimapping, N_noFeature and N_ambiguous counts
+                replicates.append(sampleDataDF[columns].to_numpy(dtype=float)[4:].T)
+            jobMetrics.stage("compare")
+            with traceEvents.span(sample, "compare"):
+                try:
+                    # columns x files x rows, so every column is averaged in one step
+                    stacked = numpy.stack(replicates, axis=1)
+                except ValueError:
+                    logger.info(f"Replicate files of {sample} do not have the same number of rows")
+                    equal = {dataType: False for dataType in dataColumns}
+                else:
+                    sampleColumns = numpy.log2(numericUtils.replicateMean(stacked) + 1)
+                    equal = {dataType: numericUtils.compareValues(xenaDFs[dataType][sample], sampleColumn)[0]
+                             for dataType, sampleColumn in zip(dataColumns, sampleColumns)}
+        for dataType in dataColumns:
+            label = sample if len(dataColumns) == 1 else "{} [{}]".format(sample, dataType)
+            if equal[dataType]:
+                status = "[{:d}/{:d}] Sample: {} - Passed"
+                logger.info(status.format(sampleNum, total, label))
+            else:
+                status = "[{:d}/{:d}] Sample: {} - Failed"
+                logger.info(status.format(sampleNum, total, label))
+                failed[dataType].append('{} ({})'.format(sample, sampleNum))
         sampleNum += 1
     
     return failed
 
 
-def main(dataType, xenaFilePath, projectName):
-    logger.info("Testing [{}] data for [{}].".format(dataType, projectName))
-    dataTypeDict = {
-    "star_fpkm": "fpkm_unstranded",
-    "star_fpkm-uq": "fpkm_uq_unstranded",
-    "star_tpm": "tpm_unstranded",
-    "star_counts": "unstranded"
-    }
-    dataColumn = dataTypeDict[dataType]
-    xenaSamples = getXenaSamples(xenaFilePath)
-    allSamples = getAllSamples(projectName)
-    sampleDict, uniqueSamples = dataTypeSamples(allSamples, projectName)
-    xenaDF = xenaDataframe(xenaFilePath)
-    if sorted(uniqueSamples) != sorted(xenaSamples):
-        logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
-        logger.info(f"Number of samples from the GDC: {len(uniqueSamples)}")
-        logger.info(f"Number of samples in Xena matrix: {len(xenaSamples)}")
-        logger.info(f"Samples from GDC and not in Xena: {[x for x in uniqueSamples if x not in xenaSamples]}")
-        logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in uniqueSamples]}") 
-        exit(1)
+def validateStar(projectName, xenaFilePaths):
+    """Validate several STAR Xena matrices against one download and parse of the GDC files.
+
+    Args:
+        projectName (str): The GDC project.
+        xenaFilePaths (dict): Xena data type (star_counts, star_tpm, star_fpkm
+            or star_fpkm-uq) to the path of its Xena matrix.
+
+    Returns:
+        results (dict): Xena data type to 'PASSED' or 'FAILED'.
+    """
+    dataTypes = list(xenaFilePaths)
+    dataTypeLabel = ", ".join(dataTypes)
+    logger.info("Testing [{}] data for [{}].".format(dataTypeLabel, projectName))
+    dataColumns = {dataType: STAR_DATA_COLUMNS[dataType] for dataType in dataTypes}
+    jobMetrics.stage("metadata")
+    sampleDict, uniqueSamples = dataTypeSamples(projectName)
+    md5sums = gdcDownload.sampleMd5sums(sampleDict)
+    # the matrices are validated in one pass, so they are only skipped together
+    passedAt = {dataType: resultsStore.passedAt(projectName, dataType, xenaFilePaths[dataType], md5sums)
+                for dataType in dataTypes}
+    if all(passedAt.values()):
+        for dataType in dataTypes:
+            resultsStore.skip(projectName, dataType, passedAt[dataType])
+        return {dataType: 'PASSED' for dataType in dataTypes}
+    jobMetrics.stage("Xena load")
+    xenaDFs = {}
+    for dataType in dataTypes:
+        xenaSamples = getXenaSamples(xenaFilePaths[dataType])
+        if sorted(uniqueSamples) != sorted(xenaSamples):
+            logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
+            logger.info(f"Xena matrix: {xenaFilePaths[dataType]}")
+            logger.info(f"Number of samples from the GDC: {len(uniqueSamples)}")
+            logger.info(f"Number of samples in Xena matrix: {len(xenaSamples)}")
+            logger.info(f"Samples from GDC and not in Xena: {[x for x in uniqueSamples if x not in xenaSamples]}")
+            logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in uniqueSamples]}")
+            exit(1)
+        xenaDFs[dataType] = xenaDataframe(xenaFilePaths[dataType])
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/STAR"):
-        fileIDs = existing_md5sums(logger, projectName, dataType, sampleDict)
+        fileIDs = existing_md5sums(logger, projectName, dataTypeLabel, sampleDict)
     else:
         fileIDs = [fileID for sample in sampleDict for fileID in sampleDict[sample]]
-        logger.info(f"{len(fileIDs)} files found from the GDC for {dataType} data for {projectName}")
+        logger.info(f"{len(fileIDs)} files found from the GDC for {dataTypeLabel} data for {projectName}")
         logger.info(f"0 files found at gdcFiles/{projectName}/STAR")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName)
-    result = compare(logger, dataColumn, sampleDict, xenaDF, projectName)
-    if len(result) == 0:
-        logger.info("[{}] test passed for [{}].".format(dataType, projectName))
-        return 'PASSED'
-    else:
-        logger.info("[{}] test failed for [{}].".format(dataType, projectName))
-        logger.info("Samples failed: {}".format(result))
-        return 'FAILED'
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/STAR", md5sums)
+    failed = compare(logger, dataColumns, sampleDict, xenaDFs, projectName)
+    jobMetrics.stage("report")
+    results = {}
+    for dataType in dataTypes:
+        resultsStore.sampleResults(projectName, dataType, list(sampleDict), failed[dataType])
+        if len(failed[dataType]) == 0:
+            logger.info("[{}] test passed for [{}].".format(dataType, projectName))
+            results[dataType] = 'PASSED'
+        else:
+            logger.info("[{}] test failed for [{}].".format(dataType, projectName))
+            logger.info("Samples failed: {}".format(failed[dataType]))
+            results[dataType] = 'FAILED'
+    return results
+
+
+def main(dataType, xenaFilePath, projectName):
+    return validateStar(projectName, {dataType: xenaFilePath})[dataType]
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import contextlib
+import contextvars
+import traceEvents
+
+logger = logging.getLogger(__name__)
+
+# The stages of a validation job, in the order they usually run. Time spent
+# outside of any of them, e.g. setting up the workspace, is reported as "other".
+STAGES = ("metadata", "cache-check", "download", "Xena load", "GDC load", "compare", "report")
+OTHER = "other"
+
+_currentJob = contextvars.ContextVar("jobMetrics", default=None)
+_finishedJobs = []
+
+
+def peakRss():
+    """Peak resident set size of this process in bytes since the last resetPeakRss."""
+    try:
+        with open("/proc/self/status", "r") as statusFile:
+            for line in statusFile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak over the whole life of the process, in kilobytes on Linux and bytes on macOS
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == "darwin" else maxRss * 1024
+
+
+def resetPeakRss():
+    # Linux resets VmHWM to the current RSS, elsewhere a stage reports the process peak so far
+    try:
+        with open("/proc/self/clear_refs", "w") as clearRefsFile:
+            clearRefsFile.write("5")
+    except OSError:
+        pass
+
+
+class JobMetrics:
+    """Wall time, CPU time and peak RSS of every stage of one validation job."""
+
+    def __init__(self, project, dataType):
+        self.project = project
+        self.dataType = dataType
+        self.stages = {}
+        self.current = None
+
+    def _close(self):
+        now, cpu, peak = time.perf_counter(), time.process_time(), peakRss()
+        if self.current is not None:
+            name, wallStart, cpuStart, traceStart = self.current
+            traceEvents.complete(name, "stage", traceStart, args={"job": f"{self.project}.{self.dataType}"})
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "peakRss": 0, "calls": 0})
+            stage["wall"] += now - wallStart
+            stage["cpu"] += cpu - cpuStart
+            stage["peakRss"] = max(stage["peakRss"], peak)
+            stage["calls"] += 1
+        return now, cpu
+
+    def switch(self, name):
+        if self.current is not None and self.current[0] == name:
+            return
+        now, cpu = self._close()
+        resetPeakRss()
+        self.current = (name, now, cpu, traceEvents.now())
+
+    def finish(self):
+        self._close()
+        self.current = None
+
+    def toDict(self):
+        stages = {name: self.stages[name] for name in STAGES + (OTHER,) if name in self.stages}
+        return {
+            "project": self.project,
+            "dataType": self.dataType,
+            "wall": sum(stage["wall"] for stage in stages.values()),
+            "cpu": sum(stage["cpu"] for stage in stages.values()),
+            "peakRss": max((stage["peakRss"] for stage in stages.values()), default=0),
+            "stages": stages
+        }
+
+
+@contextlib.contextmanager
+def job(project, dataType):
+    """Record the stages of the validation job run in a with block.
+
+    The metrics are kept until collect() is called, also when the job raises
+    or exits.
+    """
+    metrics = JobMetrics(project, dataType)
+    token = _currentJob.set(metrics)
+    traceStart = traceEvents.now()
+    metrics.switch(OTHER)
+    try:
+        yield metrics
+    finally:
+        metrics.finish()
+        traceEvents.complete(f"{project}.{dataType}", "job", traceStart)
+        _currentJob.reset(token)
+        _finishedJobs.append(metrics.toDict())
+
+
+def stage(name):
+    """Attribute everything the current job does from now on to stage name.
+
+    Stages are consecutive rather than nested, so a validator marks each
+    step as it starts it, and a loop that alternates between reading GDC
+    files and comparing them switches back and forth. Outside of job this
+    does nothing, so the validators still work when run on their own.
+    """
+    metrics = _currentJob.get()
+    if metrics is not None:
+        metrics.switch(name)
+
+
+def collect():
+    """Metrics of the jobs finished in this process since the last collect, as dicts."""
+    finished = _finishedJobs[:]
+    del _finishedJobs[:]
+    return finished
+
+
+def record(jobs):
+    """Add metrics collected in another process, e.g. a ProcessPoolExecutor worker."""
+    _finishedJobs.extend(jobs)
+
+
+def formatTable(jobs):
+    """One line per stage of every job: wall seconds, CPU seconds and peak RSS in MiB."""
+    lines = [f"{'job':<40} {'stage':<12} {'wall s':>9} {'cpu s':>9} {'peak MiB':>9}"]
+    for metrics in jobs:
+        jobName = f"{metrics['project']}.{metrics['dataType']}"
+        rows = list(metrics["stages"].items()) + [("total", metrics)]
+        for name, stageMetrics in rows:
+            lines.append(f"{jobName:<40} {name:<12} {stageMetrics['wall']:>9.2f} {stageMetrics['cpu']:>9.2f} "
+                         f"{stageMetrics['peakRss'] / (1 << 20):>9.1f}")
+    return lines
+
+
+def writeJson(jobs, path):
+    with open(f"{path}.{os.getpid()}.tmp", "w") as metricsFile:
+        json.dump({"stages": list(STAGES) + [OTHER], "jobs": jobs}, metricsFile, indent=2)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
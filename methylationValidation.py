@@ -1,20 +1,27 @@
 import os
 import logging
-import requests
-from concurrent.futures import ThreadPoolExecutor
+import gdcClient
 import json
-import subprocess
 import pandas
 import numpy
-import hashlib
+import numericUtils
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
+import xenaMatrix
 
 logger = logging.getLogger(__name__)
 
+# <data type>.json holds the probe IDs of a platform in the order of its GDC beta files, a dot
+# directory so listings of gdcFiles skip it as they skip gdcCache's manifests
+PROBE_INDEX_DIR = "gdcFiles/.probeIndex"
+
 
 def existing_md5sums(logger, projectName, dataType, sampleDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/{dataType}") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/{dataType}/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {sampleDict[sample][fileID]["md5sum"]: fileID for sample in sampleDict for fileID in sampleDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/{dataType}", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/{dataType}")
     fileIdDict = {innerKey: value
@@ -26,63 +33,6 @@ def existing_md5sums(logger, projectName, dataType, sampleDict):
     x = 5
 
 
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
-
-
-def custom_round(chunk):
-    for col in chunk:
-        chunk[col] = chunk[col].apply(
-            lambda x: numpy.format_float_scientific(x, precision=8) if pandas.notna(x) else numpy.nan)
-    
-    return chunk
-
-
-def round_ForNans(x):
-    if (pandas.notna(x)):
-        return numpy.format_float_scientific(x, precision=8)
-    else:
-        return numpy.nan
-
-
-def downloadFiles(fileList, projectName, dataType):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/{dataType}"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     with open(xenaFile, "r") as xenaData:
         header = xenaData.readline()  # get column labels from xena matrix
@@ -93,91 +43,8 @@ def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     return sampleList
 
 
-def getAllSamples(projectName, platform):
-    casesEndpt = "https://api.gdc.cancer.gov/cases"
-    allSamplesFilter = {
-        "op": "and",
-        "content": [
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.project.project_id",
-                    "value": [
-                        projectName
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.analysis.workflow_type",
-                    "value": [
-                        "SeSAMe Methylation Beta Estimation"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_category",
-                    "value": [
-                        "dna methylation"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_type",
-                    "value": [
-                        "Methylation Beta Value"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.experimental_strategy",
-                    "value": [
-                        "Methylation Array"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.platform",
-                    "value": [
-                        platform
-                    ]
-                }
-            }
-        ]
-    }
-    params = {
-        "filters": json.dumps(allSamplesFilter),
-        "fields": "submitter_sample_ids",
-        "format": "json",
-        "size": 20000
-    }
-    response = requests.post(casesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
-    allSamples = []
-    for caseDict in responseJson:
-        for sample in caseDict["submitter_sample_ids"]:
-            allSamples.append(sample)
-    
-    return allSamples
-
-
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-    
-    return jsonObj
-
-
-def dataTypeSamples(projectName, samples, platform):
-    filesEndpt = "https://api.gdc.cancer.gov/files"
+def dataTypeSamples(projectName, platform):
+    filesEndpt = "files"
     # MAKE IT SO THAT FILTER GETS DATA TYPE INSERTED
     dataTypeFilter = {
         "op": "and",
@@ -225,13 +92,6 @@ def dataTypeSamples(projectName, samples, platform):
                     ]
                 }
             },
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.samples.submitter_id",
-                    "value": samples
-                }
-            },
             {
                 "op": "in",
                 "content": {
@@ -246,11 +106,9 @@ def dataTypeSamples(projectName, samples, platform):
     params = {
         "filters": json.dumps(dataTypeFilter),
         "fields": "cases.samples.submitter_id,cases.samples.tissue_type,file_id,file_name,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
+    responseJson = gdcClient.hits(filesEndpt, params)
     dataTypeDict = {}
     uniqueSamples = []
     for caseDict in responseJson:
@@ -271,52 +129,134 @@ def dataTypeSamples(projectName, samples, platform):
 
 
 def xenaDataframe(xenaFile):
-    xenaDF = pandas.read_csv(xenaFile, sep="\t", index_col=0)
-    splitDF = numpy.array_split(xenaDF.columns, 32)
-    tasks = [xenaDF[i] for i in splitDF]
-    with ThreadPoolExecutor() as executor:
-        result = executor.map(custom_round, tasks)
-    # print(executor._max_workers)
-    resultDF = pandas.concat(result, axis=1)
+    xenaDF = xenaMatrix.read(xenaFile)
     
-    return resultDF
+    return xenaDF
+
 
+def loadProbeIndex(dataType):
+    """Probe index of a platform, shared by compare and compareBlocks for one Xena matrix.
 
-def compare(sampleDict, xenaDF, projectName, dataType):
+    Returns:
+        probes (dict): "index", the probe IDs saved by an earlier run as a
+            pandas.Index or None, "xenaPositions", the position of every Xena
+            row in it once it was checked against the Xena matrix, and
+            "sameOrder", whether those positions are the index itself.
+    """
+    probes = {"index": None, "xenaPositions": None, "sameOrder": False}
+    try:
+        with open(os.path.join(PROBE_INDEX_DIR, f"{dataType}.json"), "r") as indexFile:
+            probes["index"] = pandas.Index(json.load(indexFile))
+    except (OSError, ValueError):
+        pass
+    return probes
+
+
+def saveProbeIndex(dataType, index):
+    os.makedirs(PROBE_INDEX_DIR, exist_ok=True)
+    indexPath = os.path.join(PROBE_INDEX_DIR, f"{dataType}.json")
+    with open(f"{indexPath}.{os.getpid()}.tmp", "w") as indexFile:
+        json.dump(index.tolist(), indexFile)
+    os.replace(f"{indexPath}.{os.getpid()}.tmp", indexPath)
+
+
+def edgeProbes(sampleFile):
+    """Probe IDs on the first and last line of a beta file, read without parsing the rest of it."""
+    with open(sampleFile, "rb") as betaFile:
+        first = betaFile.readline()
+        betaFile.seek(max(betaFile.seek(0, os.SEEK_END) - 4096, 0))
+        last = [line for line in betaFile.read().splitlines() if line.strip()][-1]
+    return first.split(b"\t", 1)[0].decode(), last.split(b"\t", 1)[0].decode()
+
+
+def xenaPositions(index, xenaIndex):
+    """Position of every Xena row in a probe index, None unless the index lists exactly the Xena rows."""
+    if len(index) != len(xenaIndex) or not index.is_unique:
+        return None
+    positions = index.get_indexer(xenaIndex)
+    if (positions < 0).any():
+        return None
+    return positions
+
+
+def useProbeIndex(probes, index, xenaIndex):
+    probes["index"] = index
+    probes["xenaPositions"] = xenaPositions(index, xenaIndex)
+    # the usual case, the Xena matrix lists the probes as the GDC files do
+    probes["sameOrder"] = bool((probes["xenaPositions"] == numpy.arange(len(xenaIndex))).all())
+
+
+def betaValues(sampleFile, probes, dataType, xenaIndex):
+    """Beta values of a GDC file in the order of the Xena matrix's rows.
+
+    A saved probe index is used as long as it lists exactly the probes of the
+    Xena matrix. Of a file with as many probes as the index that starts and
+    ends with its probes only the value column is parsed. Other files are
+    parsed in full and aligned to the Xena rows by probe ID; the first of
+    them to list exactly the Xena probes becomes the index, and is saved
+    for the next run, when there is none.
+
+    Returns:
+        values (numpy.ndarray): None if the file's probes are not exactly
+            the rows of the Xena matrix, which fails its sample.
+    """
+    index = probes["index"]
+    if index is not None and probes["xenaPositions"] is None:
+        if xenaPositions(index, xenaIndex) is None:
+            logger.info(f"The saved {dataType} probe index does not list the probes of the Xena matrix, "
+                        f"ignoring it")
+            probes["index"] = index = None
+        else:
+            useProbeIndex(probes, index, xenaIndex)
+    if index is not None and edgeProbes(sampleFile) == (index[0], index[-1]):
+        values = pandas.read_csv(sampleFile, sep="\t", header=None, usecols=[1], dtype={1: numpy.float64})[1]
+        if len(values) == len(index):
+            values = values.to_numpy()
+            return values if probes["sameOrder"] else values[probes["xenaPositions"]]
+    sampleDataDF = pandas.read_csv(sampleFile, sep="\t", names=["compElement", "betaValue"], skiprows=0,
+                                   dtype={"betaValue": numpy.float64})
+    fileIndex = pandas.Index(sampleDataDF["compElement"])
+    positions = xenaPositions(fileIndex, xenaIndex)
+    if positions is None:
+        logger.info(f"{os.path.basename(sampleFile)} lists {len(fileIndex)} probes, "
+                    f"{len(fileIndex.difference(xenaIndex))} of them not in the Xena matrix of {len(xenaIndex)}")
+        return None
+    if probes["index"] is None:
+        logger.info(f"Writing the {dataType} probe index of {len(fileIndex)} probes to {PROBE_INDEX_DIR}")
+        saveProbeIndex(dataType, fileIndex)
+        useProbeIndex(probes, fileIndex, xenaIndex)
+    return sampleDataDF["betaValue"].to_numpy()[positions]
+
+
+def compare(sampleDict, xenaDF, projectName, dataType, sampleNum=1, total=None, probes=None):
     samplesCorrect = 0
     failed = []
-    sampleNum = 1
-    total = len(sampleDict)
+    total = total or len(sampleDict)
+    probes = probes or loadProbeIndex(dataType)
+    # the GDC files are aligned to the Xena rows by probe ID, so the row labels are part of every column
+    rowLabels = numericUtils.fingerprint(xenaDF.index.to_numpy())
     for sample in sampleDict:
-        fileCount = 0
-        for fileID in sampleDict[sample]:
-            fileName = sampleDict[sample][fileID]["fileName"]
-            sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
-            if fileCount == 0:
-                sampleDataDF = pandas.read_csv(sampleFile, sep="\t", names=["compElement", "betaValue"], skiprows=0)
-                sampleDataDF.reset_index(inplace=True, drop=True)
-                sampleDataDF["nonNanCount"] = 0
-                sampleDataDF["nonNanCount"] = sampleDataDF.apply(
-                    lambda x: 1 if (not (pandas.isna(x["betaValue"]))) else 0, axis=1)
-                sampleDataDF["betaValue"] = sampleDataDF["betaValue"].fillna(0)
-            else:
-                tempDF = pandas.read_csv(sampleFile, sep="\t", names=["compElement", "betaValue"], skiprows=0)
-                tempDF.reset_index(inplace=True, drop=True)
-                tempDF["nonNanCount"] = 0
-                tempDF["nonNanCount"] = tempDF.apply(lambda x: 1 if (not (pandas.isna(x["betaValue"]))) else 0,
-                                                     axis=1)
-                tempDF["betaValue"] = tempDF["betaValue"].fillna(0)
-                sampleDataDF["nonNanCount"] += tempDF["nonNanCount"]
-                sampleDataDF["betaValue"] += tempDF["betaValue"]
-            fileCount += 1
-        sampleDataDF["betaValue"] = sampleDataDF["betaValue"].astype(float)
-        sampleDataDF["betaValue"] = sampleDataDF.apply(lambda x: x["betaValue"]/x["nonNanCount"] if x["nonNanCount"] != 0 else numpy.nan, axis=1)
-        sampleDataDF["betaValue"] = sampleDataDF["betaValue"].apply(round_ForNans)
         xenaColumn = xenaDF[sample]
-        sampleColumn = sampleDataDF["betaValue"]
-        xenaColumn.reset_index(inplace=True, drop=True)
-        sampleColumn.reset_index(inplace=True, drop=True)
-        if (sampleColumn.equals(xenaColumn)):
+        # samples whose Xena column and GDC files are unchanged keep their previous result
+        previous = resultsStore.reusedResult(projectName, dataType, sample, xenaColumn, sampleDict[sample],
+                                             rowLabels)
+        if previous is not None:
+            equal = previous == "PASSED"
+        else:
+            jobMetrics.stage("GDC load")
+            replicates = []
+            for fileID in sampleDict[sample]:
+                fileName = sampleDict[sample][fileID]["fileName"]
+                sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
+                with traceEvents.span(fileName, "parse"):
+                    replicates.append(betaValues(sampleFile, probes, dataType, xenaDF.index))
+            jobMetrics.stage("compare")
+            with traceEvents.span(sample, "compare"):
+                if any(values is None for values in replicates):
+                    equal = False
+                else:
+                    equal = numericUtils.compareValues(xenaColumn, numericUtils.replicateMean(replicates))[0]
+        if equal:
             status = "[{:d}/{:d}] Sample: {} - Passed"
             logger.info(status.format(sampleNum, total, sample))
             samplesCorrect += 1
@@ -329,6 +269,27 @@ def compare(sampleDict, xenaDF, projectName, dataType):
     return failed
 
 
+def compareBlocks(sampleDict, sidecarDir, projectName, dataType):
+    """Compare the samples a column block of the Xena matrix at a time, see xenaMatrix.columnBlocks.
+
+    Only one block of Xena columns and the GDC files of one sample are in
+    memory at once, so the peak stays within --max-memory however many
+    samples the project has.
+    """
+    failed = []
+    sampleNum = 1
+    probes = loadProbeIndex(dataType)
+    jobMetrics.stage("Xena load")
+    for xenaBlock in xenaMatrix.columnBlocks(sidecarDir, list(sampleDict)):
+        blockDict = {sample: sampleDict[sample] for sample in xenaBlock.columns}
+        failed.extend(compare(blockDict, xenaBlock, projectName, dataType, sampleNum, len(sampleDict), probes))
+        sampleNum += len(blockDict)
+        del xenaBlock
+        jobMetrics.stage("Xena load")
+
+    return failed
+
+
 def main(projectName, xenaFilePath, dataType):
     logger.info("Testing [{}] data for [{}].".format(dataType, projectName))
     platformDict = {
@@ -338,10 +299,17 @@ def main(projectName, xenaFilePath, dataType):
         "methylation_epic_v2": "illumina methylation epic v2"
     }
     platform = platformDict[dataType]
+    jobMetrics.stage("metadata")
+    sampleDict, uniqueSamples = dataTypeSamples(projectName, platform)
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, gdcDownload.sampleMd5sums(sampleDict)):
+        return 'PASSED'
+    jobMetrics.stage("Xena load")
     xenaSamples = getXenaSamples(xenaFilePath)
-    allSamples = getAllSamples(projectName, platform)
-    sampleDict, uniqueSamples = dataTypeSamples(projectName, allSamples, platform)
-    xenaDF = xenaDataframe(xenaFilePath)
+    if xenaMatrix.settings["maxMemory"]:
+        # the whole matrix may not fit, its columns are read a block at a time by compareBlocks
+        sidecarDir = xenaMatrix.sidecar(xenaFilePath)
+    else:
+        xenaDF = xenaDataframe(xenaFilePath)
     if sorted(uniqueSamples) != sorted(xenaSamples):
         logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
         logger.info(f"Number of samples from the GDC: {len(uniqueSamples)}")
@@ -349,6 +317,7 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"Samples from GDC and not in Xena: {[x for x in uniqueSamples if x not in xenaSamples]}")
         logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in uniqueSamples]}")
         exit(1)
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/{dataType}"):
         fileIDs = existing_md5sums(logger, projectName, dataType, sampleDict)
     else:
@@ -357,8 +326,14 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"0 files found at gdcFiles/{projectName}/{dataType}")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName, dataType)
-    result = compare(sampleDict, xenaDF, projectName, dataType)
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/{dataType}", gdcDownload.sampleMd5sums(sampleDict))
+    if xenaMatrix.settings["maxMemory"]:
+        result = compareBlocks(sampleDict, sidecarDir, projectName, dataType)
+    else:
+        result = compare(sampleDict, xenaDF, projectName, dataType)
+    resultsStore.sampleResults(projectName, dataType, list(sampleDict), result)
+    jobMetrics.stage("report")
     if len(result) == 0:
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return 'PASSED'
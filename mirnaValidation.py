@@ -1,30 +1,24 @@
-import requests
+import gdcClient
 import logging
 import json
-import subprocess
 import pandas
 import numpy
 import os
-import hashlib
+import numericUtils
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
+import xenaMatrix
 
 logger = logging.getLogger(__name__)
 
 
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
-
-
 def existing_md5sums(logger, projectName, dataType, sampleDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/{dataType}") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/{dataType}/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {sampleDict[sample][fileID]["md5sum"]: fileID for sample in sampleDict for fileID in
                          sampleDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/{dataType}", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/{dataType}")
     fileIdDict = {innerKey: value
@@ -37,48 +31,6 @@ def existing_md5sums(logger, projectName, dataType, sampleDict):
     x = 5
 
 
-def round_ForNans(x):
-    if( pandas.notna(x) ):
-        return numpy.format_float_scientific(x, precision=8)
-    else:
-        return numpy.nan
-
-
-'''
-Given a list of files a post request will be made to the GDC to download all the files
-'''
-def downloadFiles(fileList, projectName, dataType):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/{dataType}"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 '''
 Given a xena matrix file all samples will be extracted in order to compare
 if gdc requested samples match
@@ -93,81 +45,7 @@ def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     return sampleList
 
 
-def getAllSamples(projectName, gdcDataType):
-    casesEndpt = "https://api.gdc.cancer.gov/cases"
-    allSamplesFilter = {
-        "op": "and",
-        "content": [
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.project.project_id",
-                    "value": [
-                        projectName
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.analysis.workflow_type",
-                    "value": [
-                        "BCGSC miRNA Profiling"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_category",
-                    "value": [
-                        "transcriptome profiling"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_type",
-                    "value": [
-                        gdcDataType
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.experimental_strategy",
-                    "value": [
-                        "miRNA-Seq"
-                    ]
-                }
-            }
-        ]
-    }
-    params = {
-        "filters": json.dumps(allSamplesFilter),
-        "fields": "submitter_sample_ids",
-        "format": "json",
-        "size": 2000000
-    }
-    response = requests.post(casesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
-    allSamples = []
-    for caseDict in responseJson:
-        for sample in caseDict["submitter_sample_ids"]:
-            allSamples.append(sample)
-    
-    return allSamples
-
-
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-    
-    return jsonObj
-
-
-def miRNASamples(projectName, samples, gdcDataType):
+def miRNASamples(projectName, gdcDataType):
     mirnaSamplesFilter = {
         "op": "and",
         "content": [
@@ -213,25 +91,16 @@ def miRNASamples(projectName, samples, gdcDataType):
                         "miRNA-Seq"
                     ]
                 }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.samples.submitter_id",
-                    "value": samples
-                }
             }
         ]
     }
-    filesEndpt = "https://api.gdc.cancer.gov/files"
+    filesEndpt = "files"
     params = {
         "filters": json.dumps(mirnaSamplesFilter),
         "fields": "cases.samples.submitter_id,file_id,file_name,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
+    responseJson = gdcClient.hits(filesEndpt, params)
     mirnaSamplesDict = {}
     for caseDict in responseJson:
         for submitterDict in caseDict["cases"][0]["samples"]:
@@ -250,9 +119,7 @@ def miRNASamples(projectName, samples, gdcDataType):
 
 
 def xenaDataframe(xenaFile):
-    xenaDF = pandas.read_csv(xenaFile, sep="\t", index_col=0)
-    for column in xenaDF:
-        xenaDF[column] = xenaDF[column].apply(round_ForNans)
+    xenaDF = xenaMatrix.read(xenaFile)
     return xenaDF
 
 def mirnaDataframe(mirnaSamplesDict, projectName, dataType):
@@ -265,30 +132,17 @@ def mirnaDataframe(mirnaSamplesDict, projectName, dataType):
     useCol = useColDict[dataType]
     indexCol = indexColDict[dataType]
     mirnaDataTitle = "reads_per_million_miRNA_mapped"
-    mirnaDataframe = pandas.DataFrame()
+    sampleReplicates = {}
     for sample in mirnaSamplesDict:
-        sampleDataframe = pandas.DataFrame()
-        fileCount = 0
+        sampleReplicates[sample] = []
         for fileID in mirnaSamplesDict[sample]:
             fileName = mirnaSamplesDict[sample][fileID]["fileName"]
             sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
-            tempDF = pandas.read_csv(sampleFile, sep="\t", skiprows=0, usecols=useCol, index_col=indexCol)
-            tempDF["nonNanCount"] = tempDF.apply(
-                lambda x: 1 if (not (pandas.isna(x[mirnaDataTitle]))) else 0, axis=1)
-            tempDF[mirnaDataTitle] = tempDF[mirnaDataTitle].fillna(0)
-            if fileCount == 0:
-                sampleDataframe = tempDF
-            else:
-                sampleDataframe += tempDF
-            fileCount += 1
-        sampleDataframe[mirnaDataTitle] = sampleDataframe[mirnaDataTitle].astype(float)
-        sampleDataframe[mirnaDataTitle] = sampleDataframe.apply(
-            lambda x: x[mirnaDataTitle] / x["nonNanCount"] if x["nonNanCount"] != 0 else numpy.nan, axis=1)
-        sampleDataframe[mirnaDataTitle] = numpy.log2(sampleDataframe[mirnaDataTitle] + 1)
-        sampleDataframe[mirnaDataTitle] = sampleDataframe[mirnaDataTitle].apply(round_ForNans)
-        sampleDataframe.drop("nonNanCount", inplace=True, axis=1)
-        sampleDataframe.rename(columns={"reads_per_million_miRNA_mapped": sample}, inplace=True)
-        mirnaDataframe = pandas.concat([mirnaDataframe, sampleDataframe], axis=1)
+            with traceEvents.span(fileName, "parse"):
+                tempDF = pandas.read_csv(sampleFile, sep="\t", skiprows=0, usecols=useCol, index_col=indexCol)
+            sampleReplicates[sample].append(tempDF[mirnaDataTitle])
+    mirnaDataframe = numericUtils.replicateFrame(sampleReplicates)
+    mirnaDataframe = numpy.log2(mirnaDataframe + 1)
     return mirnaDataframe
 
 
@@ -298,10 +152,13 @@ def compare(logger, gdcDF, xenaDF):
     total = len(gdcDF.columns)
     gdcDF.sort_index(inplace=True)
     xenaDF.sort_index(inplace=True)
+    sameIndex = xenaDF.index.equals(gdcDF.index)
     for sample in list(gdcDF.columns):
         xenaColumn = xenaDF[sample]
         gdcColumn = gdcDF[sample]
-        if not xenaColumn.equals(gdcColumn):
+        with traceEvents.span(sample, "compare"):
+            equal = sameIndex and numericUtils.compareValues(xenaColumn, gdcColumn)[0]
+        if not equal:
             status = "[{:d}/{:d}] Sample: {} - Failed"
             logger.info(status.format(sampleNum, total, sample))
             failed.append('{} ({})'.format(sample, sampleNum))
@@ -317,9 +174,12 @@ def main(projectName, xenaFilePath, dataType):
                        "mirna_isoform": "Isoform Expression Quantification"}
     gdcDataType = gdcDataTypeDict[dataType]
     logger.info("Testing [{}] data for [{}].".format(dataType, projectName))
+    jobMetrics.stage("metadata")
+    mirnaSamplesDict = miRNASamples(projectName, gdcDataType)
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, gdcDownload.sampleMd5sums(mirnaSamplesDict)):
+        return 'PASSED'
+    jobMetrics.stage("Xena load")
     xenaSamples = getXenaSamples(xenaFilePath)
-    allSamples = getAllSamples(projectName, gdcDataType)
-    mirnaSamplesDict = miRNASamples(projectName, allSamples, gdcDataType)
     xenaDF = xenaDataframe(xenaFilePath)
     if sorted(mirnaSamplesDict) != sorted(xenaSamples):
         logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
@@ -328,6 +188,7 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"Samples from GDC and not in Xena: {[x for x in mirnaSamplesDict if x not in xenaSamples]}")
         logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in mirnaSamplesDict]}")
         exit(1)
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/{dataType}"):
         fileIDs = existing_md5sums(logger, projectName, dataType, mirnaSamplesDict)
     else:
@@ -336,9 +197,14 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"0 files found at gdcFiles/{projectName}/{dataType}")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName, dataType)
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/{dataType}", gdcDownload.sampleMd5sums(mirnaSamplesDict))
+    jobMetrics.stage("GDC load")
     gdcDF = mirnaDataframe(mirnaSamplesDict, projectName, dataType)
+    jobMetrics.stage("compare")
     result = compare(logger, gdcDF, xenaDF)
+    resultsStore.sampleResults(projectName, dataType, list(mirnaSamplesDict), result)
+    jobMetrics.stage("report")
     if len(result) == 0:
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return 'PASSED'
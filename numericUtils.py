@@ -0,0 +1,273 @@
+import hashlib
+import numpy
+import pandas
+
+
+# Xena and GDC values are considered equal when they agree to this many
+# significant digits, i.e. numpy.format_float_scientific(x, precision=8).
+SIGNIFICANT_DIGITS = 9
+
+# Exponent sentinels used for values that have no ordinary mantissa.
+NAN_EXPONENT = 1 << 20
+SPECIAL_EXPONENT = (1 << 20) + 1
+SPECIAL_CODES = {"0.e+00": 0, "-0.e+00": 1, "inf": 2, "-inf": 3}
+
+_LOWER = 10 ** (SIGNIFICANT_DIGITS - 1)
+_UPPER = 10 ** SIGNIFICANT_DIGITS
+# Scaled mantissas this close to a rounding boundary are resolved with the
+# string rule so the result never depends on floating point error in the scaling.
+_TIE_BAND = 1e-5
+
+
+def formatSignificant(x):
+    """Reference string rule the numeric kernel reproduces."""
+    if pandas.notna(x):
+        return numpy.format_float_scientific(x, precision=SIGNIFICANT_DIGITS - 1)
+    else:
+        return numpy.nan
+
+
+def _parseFormatted(text):
+    if text in SPECIAL_CODES:
+        return SPECIAL_CODES[text], SPECIAL_EXPONENT, False
+    digits, exponent = text.split("e")
+    sign = -1 if digits.startswith("-") else 1
+    digits = digits.lstrip("-").replace(".", "")
+    # Only values rounded towards zero keep their trailing zeros.
+    padded = len(digits) == SIGNIFICANT_DIGITS and digits.endswith("0")
+    digits = digits.ljust(SIGNIFICANT_DIGITS, "0")
+    return sign * int(digits), int(exponent), padded
+
+
+def _decimalValue(mantissa, exponent):
+    # Correctly rounded value of mantissa * 10 ** (exponent - 8); exact powers
+    # of ten only go up to 1e22, hence the exponent window in significantDigitKeys.
+    shift = exponent - (SIGNIFICANT_DIGITS - 1)
+    mantissa = mantissa.astype(numpy.float64)
+    return numpy.where(shift >= 0,
+                       mantissa * numpy.power(10.0, numpy.maximum(shift, 0)),
+                       mantissa / numpy.power(10.0, numpy.maximum(-shift, 0)))
+
+
+def significantDigitKeys(values):
+    """Reduce float64 values to integer keys.
+
+    Two values share a key exactly when formatSignificant renders them as the
+    same string, with NaN sharing a key with NaN. Besides the rounded digits,
+    the string rule keeps trailing zeros only for values that do not round
+    trip through 9 digits and were rounded towards zero (6.0 and
+    5.999999999999999 are "6.e+00" but 6.000000000000001 is
+    "6.00000000e+00"), which the padded flag tracks.
+
+    Args:
+        values (array-like): Values to reduce, any shape.
+
+    Returns:
+        mantissa (numpy.ndarray): Signed 9 digit mantissas as int64.
+        exponent (numpy.ndarray): Decimal exponents as int64.
+        padded (numpy.ndarray): True where the string rule pads with zeros.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    flat = values.ravel()
+    mantissa = numpy.zeros(flat.shape, dtype=numpy.int64)
+    exponent = numpy.zeros(flat.shape, dtype=numpy.int64)
+    padded = numpy.zeros(flat.shape, dtype=bool)
+    nanMask = numpy.isnan(flat)
+    exponent[nanMask] = NAN_EXPONENT
+
+    magnitude = numpy.abs(flat)
+    regularIndex = numpy.flatnonzero(numpy.isfinite(flat) & (magnitude != 0))
+    with numpy.errstate(all="ignore"):
+        regularMagnitude = magnitude[regularIndex]
+        decimalExponent = numpy.floor(numpy.log10(regularMagnitude)).astype(numpy.int64)
+        inRange = (decimalExponent >= -14) & (decimalExponent <= 30)
+        scaled = regularMagnitude * numpy.power(10.0, numpy.where(inRange, SIGNIFICANT_DIGITS - 1 - decimalExponent, 0))
+        rounded = numpy.rint(scaled)
+        fraction = scaled - numpy.floor(scaled)
+    resolved = inRange & (scaled >= _LOWER) & (scaled < _UPPER) & (numpy.abs(fraction - 0.5) > _TIE_BAND)
+    carried = rounded == _UPPER
+    rounded[carried] = _LOWER
+    decimalExponent[carried] += 1
+    resolved &= decimalExponent <= 30
+    rounded = numpy.where(resolved, rounded, _LOWER).astype(numpy.int64)
+    with numpy.errstate(all="ignore"):
+        roundedDown = _decimalValue(rounded, decimalExponent) < regularMagnitude
+    signs = numpy.where(flat[regularIndex] < 0, -1, 1)
+    resolvedIndex = regularIndex[resolved]
+    mantissa[resolvedIndex] = rounded[resolved] * signs[resolved]
+    exponent[resolvedIndex] = decimalExponent[resolved]
+    padded[resolvedIndex] = roundedDown[resolved] & (rounded[resolved] % 10 == 0)
+
+    fallback = ~nanMask
+    fallback[resolvedIndex] = False
+    for i in numpy.flatnonzero(fallback):
+        mantissa[i], exponent[i], padded[i] = _parseFormatted(formatSignificant(flat[i]))
+
+    return mantissa.reshape(values.shape), exponent.reshape(values.shape), padded.reshape(values.shape)
+
+
+def roundSignificant(values):
+    """Round float64 values to SIGNIFICANT_DIGITS significant digits.
+
+    Returns one representative float per formatSignificant string, so the
+    result can stand in for the formatted strings in frame level comparisons.
+    Values whose string keeps trailing zeros map to the neighbour of the
+    rounded decimal away from zero, which renders the same way. The only difference from
+    the string rule is that -0.0 compares equal to 0.0.
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    mantissa, exponent, padded = significantDigitKeys(values)
+    flatMantissa = mantissa.ravel()
+    flatExponent = exponent.ravel()
+    rounded = values.astype(numpy.float64).ravel()
+    regular = flatExponent < NAN_EXPONENT
+    window = regular & (numpy.abs(flatExponent - (SIGNIFICANT_DIGITS - 1)) <= 22)
+    with numpy.errstate(all="ignore"):
+        rounded[window] = _decimalValue(flatMantissa[window], flatExponent[window])
+    for i in numpy.flatnonzero(regular & ~window):
+        rounded[i] = float(f"{flatMantissa[i]}e{flatExponent[i] - (SIGNIFICANT_DIGITS - 1)}")
+    flatPadded = padded.ravel()
+    rounded[flatPadded] = numpy.nextafter(rounded[flatPadded], numpy.copysign(numpy.inf, rounded[flatPadded]))
+    return rounded.reshape(values.shape)
+
+
+def compareValues(xenaValues, gdcValues):
+    """Compare two columns to SIGNIFICANT_DIGITS significant digits.
+
+    Args:
+        xenaValues (array-like): Column from the Xena matrix.
+        gdcValues (array-like): Column derived from GDC files.
+
+    Returns:
+        equal (bool): True when every row matches, NaN matching NaN.
+        mismatch (numpy.ndarray): Boolean mask of mismatching rows, or None
+            when the columns differ in length.
+    """
+    xenaValues = numpy.asarray(xenaValues, dtype=numpy.float64)
+    gdcValues = numpy.asarray(gdcValues, dtype=numpy.float64)
+    if xenaValues.shape != gdcValues.shape:
+        return False, None
+    mismatch = keysMismatch(significantDigitKeys(xenaValues), significantDigitKeys(gdcValues))
+    return not mismatch.any(), mismatch
+
+
+def compareMatrices(xenaValues, gdcValues):
+    """Compare two rows x samples matrices column by column.
+
+    Returns:
+        equal (numpy.ndarray): One boolean per sample column.
+        mismatch (numpy.ndarray): Boolean mask of mismatching cells.
+    """
+    xenaValues = numpy.asarray(xenaValues, dtype=numpy.float64)
+    gdcValues = numpy.asarray(gdcValues, dtype=numpy.float64)
+    if xenaValues.shape != gdcValues.shape:
+        raise ValueError(f"Matrix shapes differ: {xenaValues.shape} and {gdcValues.shape}")
+    mismatch = keysMismatch(significantDigitKeys(xenaValues), significantDigitKeys(gdcValues))
+    return ~mismatch.any(axis=0), mismatch
+
+
+def keysMismatch(leftKeys, rightKeys):
+    mismatch = numpy.zeros(leftKeys[0].shape, dtype=bool)
+    for left, right in zip(leftKeys, rightKeys):
+        mismatch |= left != right
+    return mismatch
+
+
+def fingerprint(values):
+    """Digest of a column as compareValues sees it.
+
+    Columns share a digest exactly when compareValues cannot tell them apart,
+    so a verdict stays valid for as long as the digest of its column does.
+    Non-numeric columns are digested as text.
+    """
+    values = numpy.asarray(values)
+    md5Hash = hashlib.md5()
+    if values.dtype.kind not in "iuf":
+        md5Hash.update(b"text")
+        md5Hash.update("\t".join(map(str, values.ravel())).encode())
+        return md5Hash.hexdigest()
+    for keys in significantDigitKeys(values):
+        md5Hash.update(numpy.ascontiguousarray(keys).tobytes())
+    return md5Hash.hexdigest()
+
+
+def replicateMean(replicates):
+    """NaN-aware mean of replicate files.
+
+    Args:
+        replicates (array-like): Equal length value vectors, stacked as
+            files x rows, or samples x files x rows for a batch of samples
+            padded with NaN replicates.
+
+    Returns:
+        numpy.ndarray: Mean of the non-NaN replicate values per row, NaN
+            where no replicate has a value.
+    """
+    try:
+        stacked = numpy.asarray(replicates, dtype=numpy.float64)
+    except ValueError:
+        raise ValueError("Replicate files do not have the same number of rows")
+    valid = ~numpy.isnan(stacked)
+    # Reducing over the file axis adds replicates in file order, matching the
+    # running fillna(0) sums the validators used to build.
+    total = numpy.where(valid, stacked, 0).sum(axis=-2)
+    count = valid.sum(axis=-2)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return numpy.where(count != 0, total / numpy.maximum(count, 1), numpy.nan)
+
+
+def batchReplicateMean(sampleReplicates):
+    """Replicate means for a batch of samples in one vectorized step.
+
+    Args:
+        sampleReplicates (list): One list of equal length vectors per sample.
+
+    Returns:
+        numpy.ndarray: samples x rows matrix of replicate means.
+    """
+    if len(sampleReplicates) == 0:
+        return numpy.empty((0, 0))
+    depth = max(len(replicates) for replicates in sampleReplicates)
+    rows = len(sampleReplicates[0][0])
+    stacked = numpy.full((len(sampleReplicates), depth, rows), numpy.nan)
+    for i, replicates in enumerate(sampleReplicates):
+        for j, values in enumerate(replicates):
+            if len(values) != rows:
+                raise ValueError("Replicate files do not have the same number of rows")
+            stacked[i, j] = values
+    return replicateMean(stacked)
+
+
+def replicateFrame(sampleReplicates):
+    """Average replicate Series per sample into a rows x samples DataFrame.
+
+    Rows are aligned on the Series index. When every file shares one index
+    the whole batch is averaged at once; otherwise each sample is aligned on
+    the union of its replicate indexes and rows missing from any replicate
+    are NaN, as adding the replicate frames together used to produce.
+
+    Args:
+        sampleReplicates (dict): Sample name to list of replicate Series.
+
+    Returns:
+        pandas.DataFrame: Replicate means with one column per sample.
+    """
+    allSeries = [series for replicates in sampleReplicates.values() for series in replicates]
+    if len(allSeries) == 0:
+        return pandas.DataFrame()
+    index = allSeries[0].index
+    if all(series.index.equals(index) for series in allSeries):
+        means = batchReplicateMean([[series.to_numpy(dtype=numpy.float64) for series in replicates]
+                                    for replicates in sampleReplicates.values()])
+        return pandas.DataFrame(means.T, index=index, columns=list(sampleReplicates))
+    columns = []
+    for sample, replicates in sampleReplicates.items():
+        sampleIndex = replicates[0].index
+        for series in replicates[1:]:
+            if not series.index.equals(sampleIndex):
+                sampleIndex = sampleIndex.union(series.index)
+        stacked = numpy.array([series.reindex(sampleIndex).to_numpy(dtype=numpy.float64) for series in replicates])
+        for series in replicates:
+            stacked[:, ~sampleIndex.isin(series.index)] = numpy.nan
+        columns.append(pandas.Series(replicateMean(stacked), index=sampleIndex, name=sample))
+    return pandas.concat(columns, axis=1)
@@ -1,29 +1,22 @@
 import pandas
-import requests
+import gdcClient
 import logging
-import subprocess
 import os
-import numpy
-import hashlib
+import numericUtils
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
+import xenaMatrix
 
 
 logger = logging.getLogger(__name__)
 
 
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
-
-
 def existing_md5sums(logger, projectName, dataType, proteinSamplesDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/{dataType}") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/{dataType}/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {proteinSamplesDict[sample][fileID]["md5sum"]: fileID for sample in proteinSamplesDict for fileID in proteinSamplesDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/{dataType}", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/{dataType}")
     fileIdDict = {innerKey: value
@@ -46,7 +39,7 @@ def getXenaSamples(xenaFile):
 
 
 def proteinSamples(projectName):
-    filesEndpoint = "https://api.gdc.cancer.gov/files"
+    filesEndpoint = "files"
     proteinSamplesFilter = {
         "op": "and",
         "content": [
@@ -109,11 +102,9 @@ def proteinSamples(projectName):
     params = {
         "filters": proteinSamplesFilter,
         "fields": "cases.samples.submitter_id,file_id,file_name,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpoint, json=params, headers={"Content-Type": "application/json"})
-    responseJson = response.json()["data"]["hits"]
+    responseJson = gdcClient.hits(filesEndpoint, params)
     proteinSamplesDict = {}
     for caseDict in responseJson:
         for submitterDict in caseDict["cases"][0]["samples"]:
@@ -131,59 +122,16 @@ def proteinSamples(projectName):
     return proteinSamplesDict
 
 
-def downloadFiles(fileList, projectName, dataType):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/{dataType}"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 def proteinDataframe(proteinSamples, projectName, dataType):
-    proteinDataframe = pandas.DataFrame()
+    sampleReplicates = {}
     for sample in proteinSamples:
-        sampleDataframe = pandas.DataFrame()
-        fileCount = 0
+        sampleReplicates[sample] = []
         for fileName in [x["fileName"] for x in list(proteinSamples[sample].values())]:
             filePath = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
-            tempDF = pandas.read_csv(filePath, sep="\t", usecols=[4, 5], index_col=0)
-            tempDF["nonNanCount"] = tempDF.apply(
-                    lambda x: 1 if (not (pandas.isna(x["protein_expression"]))) else 0, axis=1)
-            tempDF.fillna(0, inplace=True)
-            fileCount += 1
-            if fileCount == 1:
-                sampleDataframe = tempDF
-            else:
-                sampleDataframe += tempDF
-        sampleDataframe["protein_expression"] = sampleDataframe.apply(
-            lambda x: x["protein_expression"] / x["nonNanCount"] if x["nonNanCount"] != 0 else numpy.nan, axis=1)
-        sampleDataframe.drop("nonNanCount", inplace=True, axis=1)
-        sampleDataframe.rename(columns={"protein_expression": sample}, inplace=True)
-        proteinDataframe[sample] = sampleDataframe[sample]
+            with traceEvents.span(fileName, "parse"):
+                tempDF = pandas.read_csv(filePath, sep="\t", usecols=[4, 5], index_col=0)
+            sampleReplicates[sample].append(tempDF["protein_expression"])
+    proteinDataframe = numericUtils.replicateFrame(sampleReplicates)
     return proteinDataframe
 
 
@@ -194,7 +142,9 @@ def compare(logger, gdcDF, xenaDF):
     for sample in gdcDF:
         xenaColumn = xenaDF[sample]
         gdcColumn = gdcDF[sample]
-        if not xenaColumn.equals(gdcColumn):
+        with traceEvents.span(sample, "compare"):
+            equal = xenaColumn.equals(gdcColumn)
+        if not equal:
             status = "[{:d}/{:d}] Sample: {} - Failed"
             logger.info(status.format(sampleNum, total, sample))
             failed.append('{} ({})'.format(sample, sampleNum))
@@ -206,8 +156,12 @@ def compare(logger, gdcDF, xenaDF):
 
 
 def main(projectName, xenaFilePath, dataType):
-    xenaSamples = getXenaSamples(xenaFilePath)
+    jobMetrics.stage("metadata")
     proteinSamplesDict = proteinSamples(projectName)
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, gdcDownload.sampleMd5sums(proteinSamplesDict)):
+        return "PASSED"
+    jobMetrics.stage("Xena load")
+    xenaSamples = getXenaSamples(xenaFilePath)
     if sorted(proteinSamplesDict) != sorted(xenaSamples):
         logger.info("ERROR: Samples retrieved from the GDC do not match those found in Xena matrix.")
         logger.info(f"Number of samples from the GDC: {len(proteinSamplesDict)}")
@@ -215,6 +169,7 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"Samples from GDC and not in Xena: {[x for x in proteinSamplesDict if x not in xenaSamples]}")
         logger.info(f"Samples from Xena and not in GDC: {[x for x in xenaSamples if x not in proteinSamplesDict]}")
         exit(1)
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/{dataType}"):
         fileIDs = existing_md5sums(logger, projectName, dataType, proteinSamplesDict)
     else:
@@ -223,13 +178,19 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"0 files found at gdcFiles/{projectName}/{dataType}")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName, dataType)
-    xenaDF = pandas.read_csv(xenaFilePath, sep="\t", index_col=0)
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/{dataType}", gdcDownload.sampleMd5sums(proteinSamplesDict))
+    jobMetrics.stage("Xena load")
+    xenaDF = xenaMatrix.read(xenaFilePath)
+    jobMetrics.stage("GDC load")
     gdcDF = proteinDataframe(proteinSamplesDict, projectName, dataType)
 
+    jobMetrics.stage("compare")
     logger.info("Testing in progress ...")
 
     result = compare(logger, gdcDF, xenaDF)
+    resultsStore.sampleResults(projectName, dataType, list(proteinSamplesDict), result)
+    jobMetrics.stage("report")
     if len(result) == 0:
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return "PASSED"
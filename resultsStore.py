@@ -0,0 +1,240 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import contextlib
+import contextvars
+import gdcClient
+import numericUtils
+import xenaMatrix
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    "path": "results.sqlite",
+    # validate even when a job's inputs are unchanged since it last PASSED
+    "force": False
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    project TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    xena_md5 TEXT NOT NULL,
+    gdc_release TEXT,
+    file_md5s TEXT NOT NULL,
+    checked_at TEXT NOT NULL,
+    PRIMARY KEY (project, data_type)
+);
+CREATE TABLE IF NOT EXISTS sample_results (
+    project TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    result TEXT NOT NULL,
+    xena_fingerprint TEXT,
+    gdc_fingerprint TEXT,
+    PRIMARY KEY (project, data_type, sample)
+);
+"""
+
+# columns added since the table was first created, for databases written before them
+MIGRATIONS = {
+    "sample_results": (("xena_fingerprint", "TEXT"), ("gdc_fingerprint", "TEXT"))
+}
+
+_currentJob = contextvars.ContextVar("resultsStore", default=None)
+
+
+def configure(path=None, force=None):
+    """Override the results store settings for this process.
+
+    Args:
+        path (str): SQLite database file, "" disables the store.
+        force (bool): Validate jobs whose inputs are unchanged.
+    """
+    for key, value in (("path", path), ("force", force)):
+        if value is not None:
+            settings[key] = value
+
+
+@contextlib.contextmanager
+def connect():
+    # -j workers share the database, so wait for each other's writes instead of failing
+    connection = sqlite3.connect(settings["path"], timeout=300)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        for table, columns in MIGRATIONS.items():
+            existing = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            for column, columnType in columns:
+                if column not in existing:
+                    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {columnType}")
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+@contextlib.contextmanager
+def job():
+    """Collect the inputs and per-sample results the validators report during a with block, see save()."""
+    token = _currentJob.set({})
+    try:
+        yield
+    finally:
+        _currentJob.reset(token)
+
+
+def passedAt(projectName, dataType, xenaFilePath, md5sums):
+    """Record the inputs of a validation and tell when it PASSED with the same inputs.
+
+    The inputs are the Xena matrix, GDC data release and set of GDC files.
+    Nothing is logged or marked skipped, see skip(), so validators that test
+    several matrices together can check all of them first.
+
+    Args:
+        md5sums (dict): File id to md5sum of the GDC files, see gdcDownload.sampleMd5sums.
+
+    Returns:
+        checkedAt (str): When it last PASSED with these inputs, None if it
+            did not, outside of job, with --force or when the data release
+            is unknown.
+    """
+    inputs = _currentJob.get()
+    if inputs is None or not settings["path"]:
+        return None
+    entry = {
+        # memoised with the sidecars, so a matrix is hashed once for both
+        "xenaMd5": xenaMatrix.md5(xenaFilePath),
+        "release": gdcClient.dataRelease(),
+        "fileMd5s": json.dumps(sorted(set(md5sums.values()))),
+        "samples": {},
+        "fingerprints": {},
+        "previous": None,
+        "skipped": False
+    }
+    inputs[(projectName, dataType)] = entry
+    if settings["force"] or entry["release"] is None:
+        return None
+    with connect() as connection:
+        row = connection.execute(
+            "SELECT verdict, xena_md5, gdc_release, file_md5s, checked_at FROM results "
+            "WHERE project = ? AND data_type = ?", (projectName, dataType)).fetchone()
+    if row is None or row[:4] != ("PASSED", entry["xenaMd5"], entry["release"], entry["fileMd5s"]):
+        return None
+    return row[4]
+
+
+def skip(projectName, dataType, checkedAt):
+    """Mark a validation recorded by passedAt() as skipped, so save() keeps its stored results."""
+    logger.info(f"[{dataType}] for [{projectName}] is unchanged since it PASSED at {checkedAt}")
+    _currentJob.get()[(projectName, dataType)]["skipped"] = True
+
+
+def unchanged(projectName, dataType, xenaFilePath, md5sums):
+    """Record the inputs of a validation and skip it if it PASSED with the same inputs, see passedAt().
+
+    Returns:
+        skip (bool): True if the validation already PASSED with these inputs.
+    """
+    checkedAt = passedAt(projectName, dataType, xenaFilePath, md5sums)
+    if checkedAt is None:
+        return False
+    skip(projectName, dataType, checkedAt)
+    return True
+
+
+def gdcFingerprint(sampleFiles):
+    """Digest of the md5sums of the GDC files a sample is derived from.
+
+    Args:
+        sampleFiles (dict): File id to file info with an "md5sum", one sample of a sampleDict.
+    """
+    md5sums = sorted(fileInfo["md5sum"] for fileInfo in sampleFiles.values())
+    return hashlib.md5(",".join(md5sums).encode()).hexdigest()
+
+
+def reusedResult(projectName, dataType, sample, xenaValues, sampleFiles, rowLabels=None):
+    """Fingerprint a sample and return its stored result if neither side of it changed.
+
+    The Xena side is numericUtils.fingerprint of the sample's column, the GDC
+    side gdcFingerprint of its files. Both are stored with the sample's result
+    by save(), so the next run only derives and compares the samples whose
+    fingerprints differ. Outside of job or with --force nothing is reused.
+
+    Args:
+        xenaValues (array-like): The sample's column of the Xena matrix.
+        sampleFiles (dict): File id to file info with an "md5sum".
+        rowLabels (str): numericUtils.fingerprint of the Xena matrix's row
+            labels, for validators that align the GDC files to them by label.
+            Moving a label to another row then changes the Xena side too.
+
+    Returns:
+        result (str): "PASSED" or "FAILED" from the previous run, None if the
+            sample has to be compared.
+    """
+    inputs = _currentJob.get()
+    if inputs is None or (projectName, dataType) not in inputs:
+        return None
+    entry = inputs[(projectName, dataType)]
+    xenaFingerprint = numericUtils.fingerprint(xenaValues)
+    if rowLabels is not None:
+        xenaFingerprint = hashlib.md5(f"{xenaFingerprint}{rowLabels}".encode()).hexdigest()
+    fingerprints = (xenaFingerprint, gdcFingerprint(sampleFiles))
+    entry["fingerprints"][sample] = fingerprints
+    if settings["force"]:
+        return None
+    if entry["previous"] is None:
+        with connect() as connection:
+            entry["previous"] = {
+                row[0]: row[1:] for row in connection.execute(
+                    "SELECT sample, result, xena_fingerprint, gdc_fingerprint FROM sample_results "
+                    "WHERE project = ? AND data_type = ?", (projectName, dataType))
+            }
+    previous = entry["previous"].get(sample)
+    if previous is None or previous[1:] != fingerprints:
+        return None
+    return previous[0]
+
+
+def sampleResults(projectName, dataType, samples, failed):
+    """Record the result of every sample of a validation.
+
+    Args:
+        samples (list): Every sample compared.
+        failed (list): The failed samples as a compare function lists them, "<sample> (<n>)".
+    """
+    inputs = _currentJob.get()
+    if inputs is None or (projectName, dataType) not in inputs:
+        return
+    entry = inputs[(projectName, dataType)]
+    failedSamples = {label.rsplit(" (", 1)[0] for label in failed}
+    entry["samples"] = {sample: "FAILED" if sample in failedSamples else "PASSED" for sample in samples}
+    if entry["previous"]:
+        unchangedSamples = [sample for sample in samples if sample in entry["previous"] and
+                            entry["previous"][sample][1:] == entry["fingerprints"].get(sample)]
+        logger.info(f"[{dataType}] for [{projectName}]: {len(unchangedSamples)} of {len(samples)} samples unchanged "
+                    f"since the previous run")
+
+
+def save(projectName, dataType, verdict):
+    """Store the verdict of a validation along with the inputs it recorded with unchanged()."""
+    inputs = _currentJob.get()
+    if inputs is None or (projectName, dataType) not in inputs:
+        return
+    entry = inputs[(projectName, dataType)]
+    checkedAt = time.strftime("%Y-%m-%d %H:%M:%S")
+    with connect() as connection:
+        if entry["skipped"]:
+            connection.execute("UPDATE results SET checked_at = ? WHERE project = ? AND data_type = ?",
+                               (checkedAt, projectName, dataType))
+            return
+        connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (projectName, dataType, verdict, entry["xenaMd5"], entry["release"], entry["fileMd5s"],
+                            checkedAt))
+        connection.execute("DELETE FROM sample_results WHERE project = ? AND data_type = ?", (projectName, dataType))
+        connection.executemany("INSERT INTO sample_results VALUES (?, ?, ?, ?, ?, ?)",
+                               [(projectName, dataType, sample, result) + entry["fingerprints"].get(sample, (None, None))
+                                for sample, result in entry["samples"].items()])
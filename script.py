@@ -1,9 +1,14 @@
 import argparse
+import contextlib
+import cProfile
+import io
 import logging
+import pstats
 import time
 import os
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import geneExpressionValidation as ge_test
 import mirnaValidation as mirna_test
@@ -14,6 +19,15 @@ import methylationValidation as methylation_test
 import survivalAnalysisEndpointValidation as survival_test
 import proteinValidation as protein_test
 import clinicalValidation as clinical_test
+import workspace
+import gdcCache
+import gdcCassette
+import gdcClient
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
+import xenaMatrix
 
 
 valid_dtype = [
@@ -44,6 +58,19 @@ valid_dtype = [
     'STAR'
 ]
 
+star_dtypes = ['star_counts', 'star_tpm', 'star_fpkm', 'star_fpkm-uq']
+
+
+def parse_size(size):
+    """Bytes in a size such as 512M, 16G or 1048576."""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    try:
+        if size[-1:].upper() in units:
+            return int(float(size[:-1]) * units[size[-1].upper()])
+        return int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: {}'.format(size))
+
 
 def create_parser():
     """
@@ -69,10 +96,134 @@ def create_parser():
         required=False,
         help='The Xena data type of the file.',
     )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of (project, data type) jobs to run in parallel.',
+    )
+    parser.add_argument(
+        '--workspace-root',
+        type=str,
+        default='workspaces',
+        help='Directory in which each job gets its own scratch workspace.',
+    )
+    parser.add_argument(
+        '--keep-workspace',
+        action='store_true',
+        help='Keep job workspaces instead of removing them when the job ends.',
+    )
+    parser.add_argument(
+        '--download-workers',
+        type=int,
+        default=4,
+        help='Number of concurrent GDC download batches per job.',
+    )
+    parser.add_argument(
+        '--download-batch-size',
+        type=int,
+        default=100,
+        help='Number of files requested from the GDC per download batch.',
+    )
+    parser.add_argument(
+        '--verify-cache',
+        action='store_true',
+        help='Re-hash every cached GDC file instead of trusting the cache manifest.',
+    )
+    parser.add_argument(
+        '--refresh-metadata',
+        action='store_true',
+        help='Query the GDC API again instead of using cached metadata responses.',
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        '--record',
+        metavar='DIR',
+        help='Record every GDC API response and download to DIR. Files already in gdcFiles are not downloaded, '
+             'so record from an empty cache to replay downloads too.',
+    )
+    cassette.add_argument(
+        '--replay',
+        metavar='DIR',
+        help='Serve GDC API responses and downloads from a recording in DIR without network access.',
+    )
+    parser.add_argument(
+        '--gdc-url',
+        default=None,
+        help='Base URL of the GDC API, e.g. a local gdcStandIn server. Defaults to $GDC_API_URL or the public API.',
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='profiles',
+        default=None,
+        metavar='DIR',
+        help='Profile every job and write <project>.<data type>.pstats to DIR (profiles by default).',
+    )
+    parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=25,
+        help='Number of functions, by cumulative time, to log from each job profile.',
+    )
+    parser.add_argument(
+        '--trace',
+        action='store_true',
+        help='Write a trace-event timeline of jobs, stages, GDC requests, file parses and sample comparisons '
+             'next to the log, for chrome://tracing or Perfetto.',
+    )
+    parser.add_argument(
+        '--results-db',
+        type=str,
+        default='results.sqlite',
+        help='SQLite database of verdicts and their inputs. Jobs that PASSED with the same Xena matrix, GDC data '
+             'release and GDC files are skipped. An empty string disables it.',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Validate every job, also those unchanged since they PASSED.',
+    )
+    parser.add_argument(
+        '--xena-cache',
+        type=str,
+        default='.xenaMatrices',
+        help='Directory for memory-mappable binary copies of the dense Xena matrices, keyed by their md5sum. '
+             'An empty string parses every matrix on every read.',
+    )
+    parser.add_argument(
+        '--xena-parser',
+        choices=xenaMatrix.PARSERS,
+        default='auto',
+        help='Parser for Xena matrices without a binary copy. auto uses the multi-threaded pyarrow CSV reader '
+             'when pyarrow is installed and pandas otherwise.',
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=parse_size,
+        default=None,
+        help='Memory budget per job, e.g. 4G, for the methylation matrices. Samples are compared in column blocks '
+             'that fit it instead of loading the whole matrix. Needs --xena-cache.',
+    )
 
     return parser
 
 
+def run_star_tests(project):
+    """Run tests on all four STAR Xena matrices in a single pass.
+
+    Args:
+        project (str): The project to have tests run on.
+
+    Returns:
+        results (dict): 'PASSED' or 'FAILED' for each STAR data type.
+    """
+
+    paths = {data_type: '../{}/Xena_Matrices/{}.{}.tsv'.format(project, project, data_type) for data_type in star_dtypes}
+    return ge_test.validateStar(project, paths)
+
+
 def run_tests(project, data_type):
     """Run tests on Xena matrices.
 
@@ -105,9 +256,134 @@ def run_tests(project, data_type):
     return result
 
 
+@contextlib.contextmanager
+def job_profile(project, data_type, options):
+    """Profile the with block if --profile was given.
+
+    The stats are written to <project>.<data type>.pstats in the profile
+    directory and the top functions by cumulative time are logged. Only the
+    job's own thread is profiled, not the download threads it starts.
+    """
+
+    if options.profile is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(options.profile, exist_ok=True)
+        profile_path = os.path.join(options.profile, '{}.{}.pstats'.format(project, data_type))
+        profiler.dump_stats(profile_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(options.profile_top)
+        logger = logging.getLogger(__name__)
+        logger.info('Profile of {} data for {} written to {}'.format(data_type, project, profile_path))
+        logger.info(summary.getvalue().strip('\n'))
+
+
+class JobLogHandler(logging.Handler):
+    """Collect the log records of a job so they can be written out as one group."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # merge args and exception text into the message so the record can be
+        # sent back to the parent process, as logging.handlers.QueueHandler does
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        self.records.append(record)
+
+
+def run_job(project, data_type, options):
+    """Run the tests for one (project, data type) pair in its own workspace.
+
+    Returns:
+        rows (list): [project, data_type, result] for each Xena matrix tested.
+    """
+
+    gdcDownload.configure(workers=options.download_workers, batchSize=options.download_batch_size)
+    gdcCache.configure(verify=options.verify_cache)
+    gdcCassette.configure(record=options.record, replay=options.replay)
+    gdcClient.configure(refresh=options.refresh_metadata, apiUrl=options.gdc_url)
+    traceEvents.configure(enabled=options.trace)
+    resultsStore.configure(path=options.results_db, force=options.force)
+    xenaMatrix.configure(cacheDir=options.xena_cache, parser=options.xena_parser, maxMemory=options.max_memory)
+    with jobMetrics.job(project, data_type), resultsStore.job(), \
+            workspace.jobWorkspace('{}.{}'.format(project, data_type), options.workspace_root, options.keep_workspace), \
+            job_profile(project, data_type, options):
+        if data_type == 'STAR':
+            results = run_star_tests(project)
+            rows = [[project, star_dtype, results[star_dtype]] for star_dtype in star_dtypes]
+        else:
+            rows = [[project, data_type, run_tests(project, data_type)]]
+        for row in rows:
+            resultsStore.save(*row)
+        return rows
+
+
+def run_job_buffered(project, data_type, options):
+    """Run a job in a worker process, buffering its log records.
+
+    Returns:
+        rows (list): As returned by run_job, with 'ERROR' results if the job
+            raised or exited.
+        records (list): The job's log records.
+        metrics (list): The job's stage metrics, see jobMetrics.collect.
+        events (list): The job's trace events, see traceEvents.collect.
+    """
+
+    root = logging.getLogger()
+    handler = JobLogHandler()
+    previous_handlers, previous_level = root.handlers[:], root.level
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    try:
+        try:
+            rows = run_job(project, data_type, options)
+        except (Exception, SystemExit):
+            logging.getLogger(__name__).exception('{} data for {} did not complete.'.format(data_type, project))
+            data_types = star_dtypes if data_type == 'STAR' else [data_type]
+            rows = [[project, dt, 'ERROR'] for dt in data_types]
+    finally:
+        root.handlers = previous_handlers
+        root.setLevel(previous_level)
+    return rows, handler.records, jobMetrics.collect(), traceEvents.collect()
+
+
+def run_jobs_parallel(jobs, options):
+    """Run jobs in a process pool.
+
+    Log records of each job are written as one group once the job finishes,
+    and results are returned in the order the jobs were given.
+    """
+
+    job_rows = [None] * len(jobs)
+    job_metrics = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        futures = {executor.submit(run_job_buffered, project, data_type, options): i for i, (project, data_type) in enumerate(jobs)}
+        for future in as_completed(futures):
+            rows, records, metrics, events = future.result()
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            traceEvents.record(events)
+            job_rows[futures[future]] = rows
+            job_metrics[futures[future]] = metrics
+    for metrics in job_metrics:
+        jobMetrics.record(metrics)
+    return [row for rows in job_rows for row in rows]
+
+
 def main():
     logger = logging.getLogger(__name__)
-    handlers = logging.StreamHandler(sys.stdout), logging.FileHandler(os.path.join('test_' + time.strftime("%Y%m%d-%H%M%S") + '.log',))
+    log_path = 'test_' + time.strftime("%Y%m%d-%H%M%S") + '.log'
+    handlers = logging.StreamHandler(sys.stdout), logging.FileHandler(log_path)
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(message)s',
@@ -116,6 +392,12 @@ def main():
     )
     parser = create_parser()
     options = parser.parse_args()
+    if options.max_memory and not options.xena_cache:
+        parser.error('--max-memory reads column blocks from the binary copies, it needs --xena-cache')
+    if options.trace:
+        traceEvents.configure(enabled=True)
+        # every log line, also those replayed from the workers, becomes an instant event on the timeline
+        logging.getLogger().addHandler(traceEvents.TraceHandler())
     test_results = []
     projects = options.projects
     data_types = options.datatype
@@ -124,19 +406,29 @@ def main():
              if dt not in valid_dtype:
                 logger.info('ValueError: Unsupported data type: {}.'.format(dt))
                 exit(1)
+    jobs = []
     for project in projects:
         if data_types is None:
             data_types = [file for file in os.listdir('../{}/Raw_Data/'.format(project)) if not file.startswith('.')]
         for data_type in data_types:
-            if data_type == 'STAR':
-                for star_dtype in ['star_counts', 'star_tpm', 'star_fpkm', 'star_fpkm-uq']:
-                    result = run_tests(project, star_dtype)
-                    test_results.append([project, star_dtype, result])
-            else:
-                result = run_tests(project, data_type)
-                test_results.append([project, data_type, result])
+            jobs.append((project, data_type))
+    if options.jobs > 1:
+        test_results = run_jobs_parallel(jobs, options)
+    else:
+        for project, data_type in jobs:
+            test_results.extend(run_job(project, data_type, options))
     for r in test_results:
         logger.info('{} data for {} has {}.'.format(r[1], r[0], r[2]))
+    metrics = jobMetrics.collect()
+    for line in jobMetrics.formatTable(metrics):
+        logger.info(line)
+    metrics_path = os.path.splitext(log_path)[0] + '.metrics.json'
+    jobMetrics.writeJson(metrics, metrics_path)
+    logger.info('Stage metrics written to {}'.format(metrics_path))
+    if options.trace:
+        trace_path = os.path.splitext(log_path)[0] + '.trace.json'
+        traceEvents.write(trace_path, traceEvents.collect())
+        logger.info('Trace written to {}, open it in chrome://tracing or https://ui.perfetto.dev'.format(trace_path))
 
 if __name__ == '__main__':
     main()
@@ -1,31 +1,25 @@
 import os
 import logging
-import requests
+import gdcClient
 import json
-import subprocess
 import pandas
 import numpy
 import difflib
-import hashlib
+import numericUtils
+import workspace
+import gdcCache
+import gdcDownload
+import jobMetrics
+import traceEvents
+import resultsStore
 
 logger = logging.getLogger(__name__)
 
 
-def md5sum(filePath):
-    md5_hash = hashlib.md5()
-
-    with open(filePath, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            md5_hash.update(chunk)
-
-    return md5_hash.hexdigest()
-
-
 def existing_md5sums(logger, projectName, dataType, sampleDict):
-    existingFiles = [file for file in os.listdir(f"gdcFiles/{projectName}/{dataType}") if not file.startswith(".")]
-    existingMd5sumFileDict = {md5sum(f"gdcFiles/{projectName}/{dataType}/{file}"): file for file in existingFiles}
     gdcMd5sumFileDict = {sampleDict[sample][fileID]["md5sum"]: fileID for sample in sampleDict for fileID in
                          sampleDict[sample]}
+    existingMd5sumFileDict = {md5: file for file, md5 in gdcCache.cachedMd5sums(f"gdcFiles/{projectName}/{dataType}", gdcMd5sumFileDict).items()}
     logger.info(f"{len(gdcMd5sumFileDict)} files found from the GDC for {dataType} data for {projectName}")
     logger.info(f"{len(existingMd5sumFileDict)} files found at gdcFiles/{projectName}/{dataType}")
     fileIdDict = {innerKey: value
@@ -37,49 +31,10 @@ def existing_md5sums(logger, projectName, dataType, sampleDict):
     return filesNeededToUpdate
 
 
-def round_ForNans(x):
-    if pandas.notna(x):
-        return numpy.format_float_scientific(x, precision=8)
-    else:
-        return numpy.nan
-
-
 def vaf(t_alt_count, t_depth):
     return t_alt_count / t_depth
 
 
-def downloadFiles(fileList, projectName, dataType):
-    if isinstance(fileList, list):
-        ids = fileList
-    elif isinstance(fileList, dict):
-        ids = list(fileList.keys())
-    jsonPayload = {
-        "ids": ids
-    }
-    with open("payload.txt", "w") as payloadFile:
-        payloadFile.write(str(jsonPayload).replace("\'", "\""))
-
-    logger.info("Downloading from GDC: ")
-
-    outputDir = f"gdcFiles/{projectName}/{dataType}"
-    os.makedirs(outputDir, exist_ok=True)
-
-    curlCommand = [
-        "curl", "--request", "POST", "--header", "Content-Type: application/json",
-        "--data", "@payload.txt", "https://api.gdc.cancer.gov/data"
-    ]
-
-    if len(fileList) != 1:
-        outputFile = "gdcFiles.tar.gz"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-        os.system(f"tar --strip-components=1 -xzf  gdcFiles.tar.gz -C {outputDir}")
-    else:
-        outputFile = f"{outputDir}/{list(fileList.values())[0]}"
-        curlCommand.extend(["-o", outputFile])
-        subprocess.run(curlCommand)
-
-
 def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     xenaMatrix = pandas.read_csv(xenaFile, sep="\t")
     sampleList = list(xenaMatrix["sample"].unique())
@@ -87,91 +42,8 @@ def getXenaSamples(xenaFile):  # get all samples from the xena matrix
     return sampleList
 
 
-def getAllSamples(projectName, experimentalStrategy):
-    casesEndpt = "https://api.gdc.cancer.gov/cases"
-    allSamplesFilter = {
-        "op": "and",
-        "content": [
-            {
-                "op": "in",
-                "content": {
-                    "field": "cases.project.project_id",
-                    "value": [
-                        projectName
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.analysis.workflow_type",
-                    "value": [
-                        "Aliquot Ensemble Somatic Variant Merging and Masking"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_category",
-                    "value": [
-                        "simple nucleotide variation"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.data_type",
-                    "value": [
-                        "Masked Somatic Mutation"
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.experimental_strategy",
-                    "value": [
-                        experimentalStrategy
-                    ]
-                }
-            },
-            {
-                "op": "in",
-                "content": {
-                    "field": "files.access",
-                    "value": [
-                        "open"
-                    ]
-                }
-            }
-        ]
-    }
-    params = {
-        "filters": json.dumps(allSamplesFilter),
-        "fields": "submitter_sample_ids",
-        "format": "json",
-        "size": 20000
-    }
-    response = requests.post(casesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
-    allSamples = []
-    for caseDict in responseJson:
-        for sample in caseDict["submitter_sample_ids"]:
-            allSamples.append(sample)
-
-    return allSamples
-
-
-def unpeelJson(jsonObj):
-    jsonObj = jsonObj.get("data").get("hits")
-
-    return jsonObj
-
-
-def dataTypeSamples(projectName, experimentalStrategy, samples):
-    filesEndpt = "https://api.gdc.cancer.gov/files"
+def dataTypeSamples(projectName, experimentalStrategy):
+    filesEndpt = "files"
     # MAKE IT SO THAT FILTER GETS DATA TYPE INSERTED
     dataTypeFilter = {
         "op": "and",
@@ -222,8 +94,10 @@ def dataTypeSamples(projectName, experimentalStrategy, samples):
             {
                 "op": "in",
                 "content": {
-                    "field": "cases.samples.submitter_id",
-                    "value": samples
+                    "field": "access",
+                    "value": [
+                        "open"
+                    ]
                 }
             },
             {
@@ -240,11 +114,9 @@ def dataTypeSamples(projectName, experimentalStrategy, samples):
     params = {
         "filters": json.dumps(dataTypeFilter),
         "fields": "cases.samples.submitter_id,cases.samples.tissue_type,file_id,file_name,md5sum",
-        "format": "json",
-        "size": 20000
+        "format": "json"
     }
-    response = requests.post(filesEndpt, json=params, headers={"Content-Type": "application/json"})
-    responseJson = unpeelJson(response.json())
+    responseJson = gdcClient.hits(filesEndpt, params)
     dataTypeDict = {}
     # create seen dict to see how many times a sample has been seen
     seenDict = {}
@@ -266,7 +138,7 @@ def dataTypeSamples(projectName, experimentalStrategy, samples):
 
 def xenaDataframe(xenaFile):
     xenaDF = pandas.read_csv(xenaFile, sep="\t")
-    xenaDF["dna_vaf"] = xenaDF["dna_vaf"].apply(round_ForNans)
+    xenaDF["dna_vaf"] = numericUtils.roundSignificant(xenaDF["dna_vaf"])
 
     return xenaDF
 
@@ -279,7 +151,8 @@ def nonEmptySamples(sampleDict, projectName, dataType):
             fileName = sampleDict[sample][fileID]["file_name"]
             sampleFile = "gdcFiles/{}/{}/{}".format(projectName, dataType, fileName)
             normalSampleName = sample[:sample.index(".")]
-            sampleDataDF = pandas.read_csv(sampleFile, sep="\t", skiprows=7)
+            with traceEvents.span(fileName, "parse"):
+                sampleDataDF = pandas.read_csv(sampleFile, sep="\t", skiprows=7)
             if len(sampleDataDF.index) == 0:
                 allSampleNames.append(normalSampleName)
                 continue
@@ -300,7 +173,8 @@ def sampleDataframe(sampleDict, nonEmpty, projectName, dataType):
             normalSampleName = sample[:sample.index(".")]
             # Create data frame for sample data
             if sample in nonEmpty:
-                sampleDataDF = pandas.read_csv(sampleFile, sep="\t", skiprows=7)
+                with traceEvents.span(fileName, "parse"):
+                    sampleDataDF = pandas.read_csv(sampleFile, sep="\t", skiprows=7)
                 sampleDataDF.rename(columns={'Hugo_Symbol': 'gene'}, inplace=True)
                 sampleDataDF.rename(columns={'Chromosome': 'chrom'}, inplace=True)
                 sampleDataDF.rename(columns={'Start_Position': 'start'}, inplace=True)
@@ -336,7 +210,12 @@ def sampleDataframe(sampleDict, nonEmpty, projectName, dataType):
                 sampleDataDF.insert(0, 'sample', normalSampleName)
                 dataFrame = pandas.concat([dataFrame, sampleDataDF])
 
-    dataFrame["dna_vaf"] = dataFrame["dna_vaf"].apply(round_ForNans)
+    # a sample without mutations read first would otherwise put its columns first, and when no sample has
+    # mutations the columns only the MAF files have are missing, so they are added empty
+    dataFrame = dataFrame.reindex(columns=["sample", "gene", "chrom", "start", "end", "ref", "alt",
+                                           "Tumor_Sample_Barcode", "Amino_Acid_Change", "effect", "callers",
+                                           "dna_vaf"])
+    dataFrame["dna_vaf"] = numericUtils.roundSignificant(dataFrame["dna_vaf"])
 
     return dataFrame
 
@@ -347,10 +226,14 @@ def main(projectName, xenaFilePath, dataType):
         "somaticmutation_targeted": "Targeted Sequencing"
     }
     experimentalStrategy = experimentalStrategyDict[dataType]
+    jobMetrics.stage("metadata")
+    sampleDict, seenSamples = dataTypeSamples(projectName, experimentalStrategy)
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, gdcDownload.sampleMd5sums(sampleDict)):
+        return 'PASSED'
+    jobMetrics.stage("Xena load")
     xenaSamples = getXenaSamples(xenaFilePath)
-    allSamples = getAllSamples(projectName, experimentalStrategy)
-    sampleDict, seenSamples = dataTypeSamples(projectName, experimentalStrategy, allSamples)
     xenaDF = xenaDataframe(xenaFilePath)
+    jobMetrics.stage("cache-check")
     if os.path.isdir(f"gdcFiles/{projectName}/{dataType}"):
         fileIDs = existing_md5sums(logger, projectName, dataType, sampleDict)
     else:
@@ -359,7 +242,9 @@ def main(projectName, xenaFilePath, dataType):
         logger.info(f"0 files found at gdcFiles/{projectName}/{dataType}")
         logger.info(f"{len(fileIDs)} files needed to download")
     if len(fileIDs) != 0:
-        downloadFiles(fileIDs, projectName, dataType)
+        jobMetrics.stage("download")
+        gdcDownload.downloadFiles(fileIDs, f"gdcFiles/{projectName}/{dataType}", gdcDownload.sampleMd5sums(sampleDict))
+    jobMetrics.stage("GDC load")
     nonEmpty, sampleNames = nonEmptySamples(sampleDict, projectName, dataType)
     nonEmpty = list(set(nonEmpty))
     sampleNames = list(set(sampleNames))
@@ -372,6 +257,7 @@ def main(projectName, xenaFilePath, dataType):
         exit(1)
     # create dataframe for samples
     sampleDf = sampleDataframe(sampleDict, nonEmpty, projectName, dataType)
+    jobMetrics.stage("compare")
     xenaDF.sort_values(by=sorted(xenaDF), inplace=True)
     # sort sample dataframe as well
     sampleDf.sort_values(by=sorted(xenaDF), inplace=True)
@@ -389,22 +275,29 @@ def main(projectName, xenaFilePath, dataType):
     sampleDf.drop(indicesToDrop, inplace=True)
     sampleDf.reset_index(inplace=True, drop=True)
 
-    with open("sampleDF.csv", "w") as sampleFile:
+    sampleCsv = workspace.path("sampleDF.csv")
+    xenaCsv = workspace.path("xenaDF.csv")
+    with open(sampleCsv, "w") as sampleFile:
         sampleDf.to_csv(sampleFile)
-    with open("xenaDF.csv", "w") as xenaDfFile:
+    with open(xenaCsv, "w") as xenaDfFile:
         xenaDF.to_csv(xenaDfFile)
     try:
         logger.info("Testing in progress ...")
-        pandas.testing.assert_frame_equal(sampleDf, xenaDF, check_dtype=False)
+        pandas.testing.assert_frame_equal(sampleDf, xenaDF, check_dtype=False, check_exact=True)
+        jobMetrics.stage("report")
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return 'PASSED'
     except AssertionError:
+        jobMetrics.stage("report")
         logger.info("[{}] test failed for [{}].".format(dataType, projectName))
         logger.info("Diff file is being generated with unequal values.")
-        with open("sampleDF.csv", "r") as sampleFile:
-            with open("xenaDF.csv", "r") as xenaDfFile:
+        # the diff is a result rather than scratch, so it outlives the workspace
+        diffPath = f"{projectName}.{dataType}.diff.txt"
+        logger.info(f"Diff written to {diffPath}")
+        with open(sampleCsv, "r") as sampleFile:
+            with open(xenaCsv, "r") as xenaDfFile:
                 # if they are not equal then output diff of both files
-                with open("diff.txt", "w") as diffFile:
+                with open(diffPath, "w") as diffFile:
                     diffFile.writelines(difflib.unified_diff(sampleFile.readlines(), xenaDfFile.readlines(),
                                                              fromfile="sampleDF.csv", tofile="xenaDF.csv"))
         return 'FAILED'
@@ -1,13 +1,15 @@
 import json
 import pandas
-import requests
+import gdcClient
 import logging
+import jobMetrics
+import resultsStore
 
 logger = logging.getLogger(__name__)
 
 
 def getTimeAndPatientData(project):
-    survivalEndpoint = "https://api.gdc.cancer.gov/analysis/survival"
+    survivalEndpoint = "analysis/survival"
 
     filter = {
         "op": "in",
@@ -23,8 +25,7 @@ def getTimeAndPatientData(project):
         "size": 200000
     }
 
-    response = requests.post(survivalEndpoint, headers={"Content-Type": "application/json"}, json=params)
-    responseJson = response.json()
+    responseJson = gdcClient.cachedPost(survivalEndpoint, params)
     timeData = responseJson["results"][0]["donors"]
     timeDict = {}
     censoredDict = {}
@@ -37,7 +38,7 @@ def getTimeAndPatientData(project):
 
 
 def getOSAndFilterSamples(submitterIDs, projectName, survivalData, keepSamples):
-    casesEndpoint = "https://api.gdc.cancer.gov/cases"
+    casesEndpoint = "cases"
     filter = {
         "op": "and",
         "content":[
@@ -60,13 +61,10 @@ def getOSAndFilterSamples(submitterIDs, projectName, survivalData, keepSamples):
     params = {
         "filters": filter,
         "fields": "demographic.vital_status,submitter_id,submitter_sample_ids",
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
 
-    response = requests.post(casesEndpoint, headers={"Content-Type": "application/json"}, json=params)
-    responseJson = response.json()
-    statusData = responseJson["data"]["hits"]
+    statusData = gdcClient.hits(casesEndpoint, params)
     unknownStatusCases = []
     for entry in statusData:
         submitterID = entry["submitter_id"]
@@ -87,7 +85,7 @@ def getOSAndFilterSamples(submitterIDs, projectName, survivalData, keepSamples):
 
 
 def getKeepSamples(project):
-    filesEndpoint = "https://api.gdc.cancer.gov/files/"
+    filesEndpoint = "files"
     fileFilter = {
         "op": "and",
         "content": [
@@ -124,13 +122,10 @@ def getKeepSamples(project):
     params = {
         "filters": json.dumps(fileFilter),
         "fields": 'data_category,cases.samples.submitter_id,cases.samples.tissue_type',
-        "format": "json",
-        "size": 2000000
+        "format": "json"
     }
 
-    response = requests.post(filesEndpoint, json=params,
-                             headers={"Content-Type": "application/json"})
-    response = response.json()["data"]["hits"]
+    response = gdcClient.hits(filesEndpoint, params)
 
     keepSamples = []
     for file in response:
@@ -192,6 +187,10 @@ def fixUnknownStatuses(unknownStatusCases, survivalData, censoredData):
     return survivalData
 
 def main(projectName, xenaFilePath, dataType):
+    jobMetrics.stage("metadata")
+    # survival data has no GDC files, it changes with the data release
+    if resultsStore.unchanged(projectName, dataType, xenaFilePath, {}):
+        return "PASSED"
     timeData, censoredData = getTimeAndPatientData(projectName)
     submitterIDs = [submitterId for submitterId in timeData]
     keepSamples = getKeepSamples(projectName)
@@ -199,10 +198,13 @@ def main(projectName, xenaFilePath, dataType):
     if len(unknownStatusCases) != 0:
         survivalData = fixUnknownStatuses(unknownStatusCases, survivalData, censoredData)
 
+    jobMetrics.stage("GDC load")
     formattedData = formatData(survivalData)
     gdcDF = pandas.DataFrame(formattedData)
+    jobMetrics.stage("Xena load")
     xenaDF = pandas.read_csv(xenaFilePath, sep="\t")
 
+    jobMetrics.stage("compare")
     gdcDF.sort_values(by=["sample"], inplace=True)
     xenaDF.sort_values(by=["sample"], inplace=True)
     gdcDF.reset_index(inplace=True, drop=True)
@@ -226,6 +228,8 @@ def main(projectName, xenaFilePath, dataType):
     gdcDF = gdcDF.astype({'sample': 'str', "OS.time": "float64", "OS": "int64", "_PATIENT": "str"})
 
     result = compare(logger, gdcDF, xenaDF)
+    resultsStore.sampleResults(projectName, dataType, gdcSamples, result)
+    jobMetrics.stage("report")
     if len(result) == 0:
         logger.info("[{}] test passed for [{}].".format(dataType, projectName))
         return "PASSED"
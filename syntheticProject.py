@@ -0,0 +1,625 @@
+"""Synthetic GDC projects for end-to-end benchmarks.
+
+Writes a project in the layout script.py expects, with Xena matrices that
+agree with generated GDC files, and gdcStandIn fixtures that serve those
+files and their metadata:
+
+    <output>/<project>/Xena_Matrices/<project>.<data type>.tsv
+    <output>/<project>/Raw_Data/<data type>/
+    <output>/<project>/gdcFixtures/
+
+    python syntheticProject.py SYN-BENCH -s 1000
+    python gdcStandIn.py ../SYN-BENCH/gdcFixtures -p 8080
+    python script.py -p SYN-BENCH --gdc-url http://127.0.0.1:8080
+"""
+import os
+import sys
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import argparse
+import numpy
+import pandas
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    "samples": 100,
+    # fraction of samples with a second file of a data type
+    "replicates": 0.05,
+    # fraction of cases that also have a normal sample
+    "normals": 0.1,
+    # fraction of values left empty in the GDC files
+    "nanDensity": 0.01,
+    "genes": 1000,
+    "mirnas": 200,
+    "isoforms": 400,
+    "probes": 1000,
+    "proteins": 200,
+    "segments": 40,
+    "mutations": 20
+}
+
+# GDC metadata of the files behind each Xena data type, as the validators query it.
+# STAR stands for star_counts, star_tpm, star_fpkm and star_fpkm-uq, which share their files.
+FILE_METADATA = {
+    "STAR": ("STAR - Counts", "Transcriptome Profiling", "Gene Expression Quantification", "RNA-Seq",
+             "Illumina", "rna_seq.augmented_star_gene_counts.tsv"),
+    "mirna": ("BCGSC miRNA Profiling", "Transcriptome Profiling", "miRNA Expression Quantification", "miRNA-Seq",
+              "Illumina", "mirbase21.mirnas.quantification.txt"),
+    "mirna_isoform": ("BCGSC miRNA Profiling", "Transcriptome Profiling", "Isoform Expression Quantification",
+                      "miRNA-Seq", "Illumina", "mirbase21.isoforms.quantification.txt"),
+    "methylation27": ("SeSAMe Methylation Beta Estimation", "DNA Methylation", "Methylation Beta Value",
+                      "Methylation Array", "Illumina Human Methylation 27", "methylation_array.sesame.level3betas.txt"),
+    "methylation450": ("SeSAMe Methylation Beta Estimation", "DNA Methylation", "Methylation Beta Value",
+                       "Methylation Array", "Illumina Human Methylation 450", "methylation_array.sesame.level3betas.txt"),
+    "methylation_epic": ("SeSAMe Methylation Beta Estimation", "DNA Methylation", "Methylation Beta Value",
+                         "Methylation Array", "Illumina Methylation Epic", "methylation_array.sesame.level3betas.txt"),
+    "methylation_epic_v2": ("SeSAMe Methylation Beta Estimation", "DNA Methylation", "Methylation Beta Value",
+                            "Methylation Array", "Illumina Methylation Epic v2",
+                            "methylation_array.sesame.level3betas.txt"),
+    "gene-level_absolute": ("ABSOLUTE LiftOver", "Copy Number Variation", "Gene Level Copy Number",
+                            "Genotyping Array", "Affymetrix SNP 6.0", "absolute_liftover.gene_level_copy_number.v36.tsv"),
+    "gene-level_ascat2": ("ASCAT2", "Copy Number Variation", "Gene Level Copy Number", "Genotyping Array",
+                          "Affymetrix SNP 6.0", "ascat2.gene_level_copy_number.v36.tsv"),
+    "gene-level_ascat3": ("ASCAT3", "Copy Number Variation", "Gene Level Copy Number", "Genotyping Array",
+                          "Affymetrix SNP 6.0", "ascat3.gene_level_copy_number.v36.tsv"),
+    "gene-level_ascat-ngs": ("AscatNGS", "Copy Number Variation", "Gene Level Copy Number", "WGS",
+                             "Illumina", "wgs.ascat_ngs.gene_level_copy_number.v36.tsv"),
+    "segment_cnv_ascat-ngs": ("AscatNGS", "Copy Number Variation", "Copy Number Segment", "WGS",
+                              "Illumina", "wgs.ascat_ngs.copy_number_variation.seg.txt"),
+    "segment_cnv_DNAcopy": ("DNAcopy", "Copy Number Variation", "Copy Number Segment", "Genotyping Array",
+                            "Affymetrix SNP 6.0", "grch38.seg.v2.txt"),
+    "masked_cnv_DNAcopy": ("DNAcopy", "Copy Number Variation", "Masked Copy Number Segment", "Genotyping Array",
+                           "Affymetrix SNP 6.0", "nocnv_grch38.seg.v2.txt"),
+    "allele_cnv_ascat2": ("ASCAT2", "Copy Number Variation", "Allele-specific Copy Number Segment",
+                          "Genotyping Array", "Affymetrix SNP 6.0", "ascat2.allelic_specific.seg.txt"),
+    "allele_cnv_ascat3": ("ASCAT3", "Copy Number Variation", "Allele-specific Copy Number Segment",
+                          "Genotyping Array", "Affymetrix SNP 6.0", "ascat3.allelic_specific.seg.txt"),
+    "somaticmutation_wxs": ("Aliquot Ensemble Somatic Variant Merging and Masking", "Simple Nucleotide Variation",
+                            "Masked Somatic Mutation", "WXS", "Illumina", "wxs.aliquot_ensemble_masked.maf"),
+    "somaticmutation_targeted": ("Aliquot Ensemble Somatic Variant Merging and Masking",
+                                 "Simple Nucleotide Variation", "Masked Somatic Mutation", "Targeted Sequencing",
+                                 "Illumina", "targeted_sequencing.aliquot_ensemble_masked.maf"),
+    "protein": (None, "Proteome Profiling", "Protein Expression Quantification", "Reverse Phase Protein Array",
+                "RPPA", "RPPA_data.tsv")
+}
+
+DATA_TYPES = list(FILE_METADATA) + ["clinical", "survival"]
+
+STAR_COLUMNS = {
+    "star_counts": "unstranded",
+    "star_tpm": "tpm_unstranded",
+    "star_fpkm": "fpkm_unstranded",
+    "star_fpkm-uq": "fpkm_uq_unstranded"
+}
+
+# Untransformed values are multiples of 2 ** -12, so replicate means are exact and short
+# enough to read back from the Xena text as the very floats the validators compute.
+QUANTUM = 2.0 ** -12
+
+CHROMOSOMES = [f"chr{chromosome}" for chromosome in list(range(1, 23)) + ["X"]]
+
+
+def configure(**kwargs):
+    for key, value in kwargs.items():
+        if key not in settings:
+            raise ValueError(f"Unknown setting {key}")
+        if value is not None:
+            settings[key] = value
+
+
+class SyntheticProject:
+    """One generated project: its cases, its GDC files and the Xena matrices built from them."""
+
+    def __init__(self, project, output, seed=0, gdcFiles=None):
+        self.project = project
+        self.directory = os.path.join(output, project)
+        self.fixtureDir = os.path.join(self.directory, "gdcFixtures")
+        self.gdcFiles = gdcFiles
+        self.random = numpy.random.default_rng(seed)
+        self.files = []
+        for directory in ("Xena_Matrices", "Raw_Data", os.path.join("gdcFixtures", "data")):
+            os.makedirs(os.path.join(self.directory, directory), exist_ok=True)
+        self.cases = self._cases()
+
+    def newID(self):
+        return str(uuid.UUID(bytes=self.random.bytes(16), version=4))
+
+    def _cases(self):
+        cases = []
+        sampleCount = 0
+        while sampleCount < settings["samples"]:
+            submitterID = f"{self.project}-{len(cases) + 1:05d}"
+            samples = [{"submitter_id": f"{submitterID}-01A", "sample_type": "Primary Tumor", "tissue_type": "Tumor"}]
+            if self.random.random() < settings["normals"] and sampleCount + 1 < settings["samples"]:
+                samples.append({"submitter_id": f"{submitterID}-11A", "sample_type": "Solid Tissue Normal",
+                                "tissue_type": "Normal"})
+            sampleCount += len(samples)
+            dead = bool(self.random.random() < 0.3)
+            cases.append({
+                "case_id": self.newID(),
+                "submitter_id": submitterID,
+                "disease_type": "Adenomas and Adenocarcinomas",
+                "primary_site": str(self.random.choice(["Breast", "Bronchus and lung", "Colon", "Kidney"])),
+                "demographic": {
+                    "gender": self._optional(self.random.choice(["female", "male"])),
+                    "race": self._optional(self.random.choice(["white", "asian", "black or african american"])),
+                    "vital_status": "Dead" if dead else "Alive",
+                    "days_to_death": int(self.random.integers(30, 4000)) if dead else None
+                },
+                "diagnoses": [{
+                    "diagnosis_id": self.newID(),
+                    "age_at_diagnosis": int(self.random.integers(20 * 365, 90 * 365)),
+                    "days_to_last_follow_up": None if dead else int(self.random.integers(30, 4000)),
+                    "primary_diagnosis": "Adenocarcinoma, NOS",
+                    "tumor_grade": self._optional(self.random.choice(["G1", "G2", "G3"]))
+                }],
+                "project": {"project_id": self.project, "name": f"Synthetic {self.project}",
+                            "program": {"name": self.project.split("-")[0]}},
+                "samples": samples
+            })
+        return cases
+
+    def _optional(self, value):
+        return None if self.random.random() < settings["nanDensity"] else str(value)
+
+    def samples(self, tumorOnly=False):
+        """(case, sample) pairs with files of a data type, each repeated once per replicate file."""
+        pairs = []
+        for case in self.cases:
+            for sample in case["samples"]:
+                if tumorOnly and sample["tissue_type"] != "Tumor":
+                    continue
+                replicates = 2 if self.random.random() < settings["replicates"] else 1
+                pairs.extend([(case, sample)] * replicates)
+        return pairs
+
+    def sprinkle(self, values):
+        values = numpy.asarray(values, dtype=float)
+        values[self.random.random(values.shape) < settings["nanDensity"]] = numpy.nan
+        return values
+
+    def addFile(self, dataType, case, sample, text):
+        """Store a GDC file under its file_id and describe it in files.json."""
+        workflow, category, gdcDataType, strategy, platform, suffix = FILE_METADATA[dataType]
+        fileID = self.newID()
+        fileName = f"{fileID}.{suffix}"
+        body = text.encode()
+        dataPath = os.path.join(self.fixtureDir, "data", fileID)
+        with open(dataPath, "wb") as dataFile:
+            dataFile.write(body)
+        document = {
+            "file_id": fileID,
+            "file_name": fileName,
+            "md5sum": hashlib.md5(body).hexdigest(),
+            "file_size": len(body),
+            "access": "open",
+            "data_category": category,
+            "data_type": gdcDataType,
+            "experimental_strategy": strategy,
+            "platform": platform,
+            "cases": [dict({key: value for key, value in case.items() if key != "samples"}, samples=[sample])]
+        }
+        if workflow is not None:
+            document["analysis"] = {"workflow_type": workflow}
+        self.files.append(document)
+        if self.gdcFiles is not None:
+            # pre-populate the validators' download cache so only the comparison is measured
+            targetDir = os.path.join(self.gdcFiles, self.project, dataType)
+            os.makedirs(targetDir, exist_ok=True)
+            targetPath = os.path.join(targetDir, fileName)
+            try:
+                os.link(dataPath, targetPath)
+            except OSError:
+                shutil.copyfile(dataPath, targetPath)
+        return fileID
+
+    def writeMatrix(self, dataType, matrix, index=True):
+        matrix.to_csv(os.path.join(self.directory, "Xena_Matrices", f"{self.project}.{dataType}.tsv"), sep="\t",
+                      index=index)
+
+    def star(self):
+        geneCount = settings["genes"]
+        genes = pandas.DataFrame({
+            "gene_id": [f"ENSG{gene:011d}.1" for gene in range(1, geneCount + 1)],
+            "gene_name": [f"GENE{gene}" for gene in range(1, geneCount + 1)],
+            "gene_type": self.random.choice(["protein_coding", "lncRNA", "miRNA"], geneCount)
+        })
+        lengths = self.random.integers(500, 10000, geneCount)
+        header = pandas.DataFrame({"gene_id": ["N_unmapped", "N_multimapping", "N_noFeature", "N_ambiguous"]})
+        replicates = {}
+        for case, sample in self.samples():
+            counts = self.random.negative_binomial(2, 0.01, geneCount)
+            firstStrand = self.random.binomial(counts, 0.5)
+            perKilobase = counts / (lengths / 1000)
+            upperQuartile = max(numpy.percentile(counts, 75), 1)
+            data = genes.assign(
+                unstranded=self.sprinkle(counts),
+                stranded_first=firstStrand,
+                stranded_second=counts - firstStrand,
+                tpm_unstranded=self.sprinkle(numpy.round(perKilobase / perKilobase.sum() * 1e6, 4)),
+                fpkm_unstranded=self.sprinkle(numpy.round(perKilobase / counts.sum() * 1e6, 4)),
+                fpkm_uq_unstranded=self.sprinkle(numpy.round(perKilobase / upperQuartile * 1e6, 4))
+            )
+            counted = header.assign(unstranded=self.random.integers(0, 1000000, 4), stranded_first=0,
+                                    stranded_second=0)
+            text = "# gene-model: GENCODE v36\n" + pandas.concat([counted, data]).to_csv(sep="\t", index=False)
+            self.addFile("STAR", case, sample, text)
+            replicates.setdefault(sample["submitter_id"], []).append(data)
+        for dataType, column in STAR_COLUMNS.items():
+            matrix = pandas.DataFrame(
+                {sample: numpy.log2(replicateMean([data[column] for data in files]) + 1)
+                 for sample, files in replicates.items()})
+            matrix.index = pandas.Index(genes["gene_id"], name="Ensembl_ID")
+            self.writeMatrix(dataType, matrix)
+
+    def mirna(self, dataType):
+        if dataType == "mirna":
+            identifiers = pandas.Index([f"hsa-mir-{mirna}" for mirna in range(1, settings["mirnas"] + 1)],
+                                       name="miRNA_ID")
+        else:
+            starts = numpy.sort(self.random.choice(10 ** 8, settings["isoforms"], replace=False))
+            identifiers = pandas.Index([f"hg38:{self.random.choice(CHROMOSOMES)}:{start}-{start + 21}:+"
+                                        for start in starts], name="isoform_coords")
+        replicates = {}
+        for case, sample in self.samples():
+            # isoform files only list the isoforms seen in that sample
+            kept = identifiers if dataType == "mirna" else identifiers[self.random.random(len(identifiers)) < 0.9]
+            counts = self.random.negative_binomial(1, 0.005, len(kept))
+            perMillion = self.sprinkle(numpy.round(counts / max(counts.sum(), 1) * 1e6, 6))
+            data = pandas.DataFrame({"read_count": counts, "reads_per_million_miRNA_mapped": perMillion,
+                                     "cross-mapped": "N"}, index=kept)
+            if dataType == "mirna":
+                text = data.to_csv(sep="\t")
+            else:
+                data.insert(0, "miRNA_ID", [f"hsa-mir-{position % settings['mirnas'] + 1}"
+                                            for position in range(len(kept))])
+                data["miRNA_region"] = "mature,MIMAT0000062"
+                text = data.reset_index()[["miRNA_ID", "isoform_coords", "read_count",
+                                           "reads_per_million_miRNA_mapped", "cross-mapped",
+                                           "miRNA_region"]].to_csv(sep="\t", index=False)
+            self.addFile(dataType, case, sample, text)
+            replicates.setdefault(sample["submitter_id"], []).append(data["reads_per_million_miRNA_mapped"])
+        matrix = pandas.concat({sample: replicateMean(files) for sample, files in replicates.items()}, axis=1)
+        matrix.index.name = identifiers.name
+        self.writeMatrix(dataType, numpy.log2(matrix.sort_index() + 1))
+
+    def methylation(self, dataType):
+        probes = pandas.Index([f"cg{probe:08d}" for probe in range(1, settings["probes"] + 1)],
+                              name="Composite Element REF")
+        replicates = {}
+        for case, sample in self.samples():
+            betas = pandas.Series(self.sprinkle(quantize(self.random.beta(0.5, 0.5, len(probes)))),
+                                  index=probes)
+            self.addFile(dataType, case, sample, betas.to_csv(sep="\t", header=False))
+            replicates.setdefault(sample["submitter_id"], []).append(betas)
+        self.writeMatrix(dataType, pandas.DataFrame({sample: replicateMean(files)
+                                                     for sample, files in replicates.items()}))
+
+    def geneLevel(self, dataType):
+        geneCount = settings["genes"]
+        starts = self.random.integers(1, 2 * 10 ** 8, geneCount)
+        genes = pandas.DataFrame({
+            "gene_id": [f"ENSG{gene:011d}.1" for gene in range(1, geneCount + 1)],
+            "gene_name": [f"GENE{gene}" for gene in range(1, geneCount + 1)],
+            "chromosome": self.random.choice(CHROMOSOMES, geneCount),
+            "start": starts,
+            "end": starts + self.random.integers(1000, 100000, geneCount)
+        })
+        replicates = {}
+        for case, sample in self.samples(tumorOnly=True):
+            copyNumber = self.sprinkle(self.random.poisson(2, geneCount))
+            data = genes.assign(copy_number=copyNumber, min_copy_number=copyNumber, max_copy_number=copyNumber)
+            self.addFile(dataType, case, sample, data.to_csv(sep="\t", index=False))
+            replicates.setdefault(sample["submitter_id"], []).append(data["copy_number"])
+        matrix = pandas.DataFrame({sample: replicateMean(files)
+                                   for sample, files in replicates.items()})
+        matrix.index = pandas.Index(genes["gene_id"], name="Ensembl_ID")
+        self.writeMatrix(dataType, matrix)
+
+    def segments(self, dataType):
+        workflow = FILE_METADATA[dataType][0]
+        rows = []
+        for case, sample in self.samples(tumorOnly=True):
+            count = settings["segments"]
+            starts = self.random.integers(1, 2 * 10 ** 8, count)
+            data = pandas.DataFrame({
+                "GDC_Aliquot": self.newID(),
+                "Chromosome": self.random.choice(CHROMOSOMES, count),
+                "Start": starts,
+                "End": starts + self.random.integers(1000, 10 ** 7, count)
+            })
+            if workflow == "DNAcopy":
+                data["Num_Probes"] = self.random.integers(10, 5000, count)
+                data["Segment_Mean"] = numpy.round(self.random.normal(0, 0.5, count), 4)
+                value = data["Segment_Mean"]
+            else:
+                data["Copy_Number"] = self.random.poisson(2, count)
+                data["Major_Copy_Number"] = (data["Copy_Number"] + 1) // 2
+                data["Minor_Copy_Number"] = data["Copy_Number"] // 2
+                value = data["Copy_Number"]
+            self.addFile(dataType, case, sample, data.to_csv(sep="\t", index=False))
+            rows.append(pandas.DataFrame({"sample": sample["submitter_id"], "Chrom": data["Chromosome"],
+                                          "Start": data["Start"], "End": data["End"], "value": value}))
+        self.writeMatrix(dataType, pandas.concat(rows), index=False)
+
+    def mutations(self, dataType):
+        rows = []
+        mutated = set()
+        emptyFiles = []
+        for case, sample in self.samples(tumorOnly=True):
+            count = self.random.poisson(settings["mutations"])
+            barcode = f"{sample['submitter_id']}-01D-A000-09"
+            starts = self.random.integers(1, 2 * 10 ** 8, count)
+            reference = self.random.choice(list("ACGT"), count)
+            depth = self.random.integers(20, 300, count)
+            data = pandas.DataFrame({
+                "Hugo_Symbol": [f"GENE{gene}" for gene in self.random.integers(1, settings["genes"] + 1, count)],
+                "Entrez_Gene_Id": 0,
+                "Center": "BI",
+                "NCBI_Build": "GRCh38",
+                "Chromosome": self.random.choice(CHROMOSOMES, count),
+                "Start_Position": starts,
+                "End_Position": starts,
+                "Strand": "+",
+                "Variant_Classification": "Missense_Mutation",
+                "Variant_Type": "SNP",
+                "Reference_Allele": reference,
+                "Tumor_Seq_Allele1": reference,
+                "Tumor_Seq_Allele2": self.random.choice(list("ACGT"), count),
+                "Tumor_Sample_Barcode": barcode,
+                "Matched_Norm_Sample_Barcode": f"{case['submitter_id']}-10A-01D-A000-09",
+                "HGVSp_Short": [f"p.A{position}V" for position in self.random.integers(1, 2000, count)],
+                "Consequence": self.random.choice(["missense_variant", "synonymous_variant", "stop_gained"], count),
+                "callers": "muse;mutect2;varscan2",
+                "t_depth": depth,
+                "t_ref_count": 0,
+                "t_alt_count": self.random.integers(1, depth + 1)
+            })
+            # alternate alleles always differ from the reference
+            same = data["Tumor_Seq_Allele2"] == data["Reference_Allele"]
+            data.loc[same, "Tumor_Seq_Allele2"] = data.loc[same, "Reference_Allele"].map(
+                {"A": "C", "C": "G", "G": "T", "T": "A"})
+            data["t_ref_count"] = data["t_depth"] - data["t_alt_count"]
+            comments = ["#version gdc-1.0.0", "#filedate 20240101", "#annotation.spec gdc-1.0.1-public",
+                        "#n.analyzed.samples 1", f"#tumor.aliquots.submitter_id {barcode}",
+                        f"#normal.aliquots.submitter_id {case['submitter_id']}-10A-01D-A000-09",
+                        "#masking.spec synthetic"]
+            self.addFile(dataType, case, sample, "\n".join(comments) + "\n" + data.to_csv(sep="\t", index=False))
+            if count != 0:
+                mutated.add(sample["submitter_id"])
+            else:
+                emptyFiles.append(sample["submitter_id"])
+            rows.append(pandas.DataFrame({
+                "sample": sample["submitter_id"],
+                "gene": data["Hugo_Symbol"],
+                "chrom": data["Chromosome"],
+                "start": data["Start_Position"],
+                "end": data["End_Position"],
+                "ref": data["Reference_Allele"],
+                "alt": data["Tumor_Seq_Allele2"],
+                "Tumor_Sample_Barcode": data["Tumor_Sample_Barcode"],
+                "Amino_Acid_Change": data["HGVSp_Short"],
+                "effect": data["Consequence"],
+                "callers": data["callers"],
+                "dna_vaf": data["t_alt_count"] / data["t_depth"]
+            }))
+        # samples without any mutation keep a start = -1 row per file
+        for sample in emptyFiles:
+            if sample not in mutated:
+                rows.append(pandas.DataFrame([{"sample": sample, "start": -1, "end": -1}]))
+        matrix = pandas.concat(rows)
+        self.writeMatrix(dataType, matrix[["sample", "gene", "chrom", "start", "end", "ref", "alt",
+                                           "Tumor_Sample_Barcode", "Amino_Acid_Change", "effect", "callers",
+                                           "dna_vaf"]], index=False)
+
+    def protein(self):
+        proteinCount = settings["proteins"]
+        targets = pandas.DataFrame({
+            "AGID": [f"AGID{target:05d}" for target in range(1, proteinCount + 1)],
+            "lab_id": range(1, proteinCount + 1),
+            "catalog_number": [f"CAT-{target}" for target in range(1, proteinCount + 1)],
+            "set_id": "MDA_RPPA_Core",
+            "peptide_target": [f"PROTEIN{target}" for target in range(1, proteinCount + 1)]
+        })
+        replicates = {}
+        for case, sample in self.samples():
+            data = targets.assign(protein_expression=self.sprinkle(quantize(self.random.normal(0, 1, proteinCount))))
+            self.addFile("protein", case, sample, data.to_csv(sep="\t", index=False))
+            replicates.setdefault(sample["submitter_id"], []).append(data["protein_expression"])
+        matrix = pandas.DataFrame({sample: replicateMean(files)
+                                   for sample, files in replicates.items()})
+        matrix.index = pandas.Index(targets["peptide_target"], name="peptide_target")
+        self.writeMatrix("protein", matrix)
+
+    def keptSamples(self):
+        """Samples the clinical and survival matrices list, as the validators select them."""
+        kept = set()
+        for document in self.files:
+            sample = document["cases"][0]["samples"][0]
+            if document["data_category"] in ("Transcriptome Profiling", "Proteome Profiling", "DNA Methylation"):
+                kept.add(sample["submitter_id"])
+            elif sample["tissue_type"] == "Tumor":
+                kept.add(sample["submitter_id"])
+        return kept
+
+    def clinical(self):
+        kept = self.keptSamples()
+        rows = []
+        for case in self.cases:
+            caseColumns = clinicalColumns({key: value for key, value in case.items() if key != "samples"})
+            caseColumns["id"] = case["case_id"]
+            age = case["diagnoses"][0]["age_at_diagnosis"]
+            caseColumns["age_at_earliest_diagnosis.diagnoses.xena_derived"] = age
+            caseColumns["age_at_earliest_diagnosis_in_years.diagnoses.xena_derived"] = age / 365
+            for sample in case["samples"]:
+                if sample["submitter_id"] in kept:
+                    row = {"sample": sample["submitter_id"], "sample_type.samples": sample["sample_type"],
+                           "tissue_type.samples": sample["tissue_type"]}
+                    row.update(caseColumns)
+                    rows.append(row)
+        self.writeMatrix("clinical", pandas.DataFrame(rows).dropna(axis=1, how="all"), index=False)
+
+    def survival(self):
+        kept = self.keptSamples()
+        rows = []
+        for case in self.cases:
+            dead = case["demographic"]["vital_status"] == "Dead"
+            time = case["demographic"]["days_to_death"] if dead else case["diagnoses"][0]["days_to_last_follow_up"]
+            for sample in case["samples"]:
+                if sample["submitter_id"] in kept:
+                    rows.append({"sample": sample["submitter_id"], "OS.time": time, "OS": int(dead),
+                                 "_PATIENT": case["submitter_id"]})
+        self.writeMatrix("survival", pandas.DataFrame(rows, columns=["sample", "OS.time", "OS", "_PATIENT"]),
+                         index=False)
+
+    def writeFixtures(self):
+        cases = []
+        for case in self.cases:
+            samples = [sample["submitter_id"] for sample in case["samples"]]
+            cases.append(dict(case, submitter_sample_ids=samples))
+        donors = []
+        for case in self.cases:
+            dead = case["demographic"]["vital_status"] == "Dead"
+            donors.append({
+                "id": case["case_id"],
+                "submitter_id": case["submitter_id"],
+                "project_id": self.project,
+                "time": case["demographic"]["days_to_death"] if dead else case["diagnoses"][0]["days_to_last_follow_up"],
+                "censored": not dead
+            })
+        fixtures = {
+            "cases.json": cases,
+            "files.json": self.files,
+            "projects.json": [self.cases[0]["project"]],
+            "survival.json": donors,
+            "status.json": {"data_release": f"Synthetic {self.project}", "status": "OK", "version": 1}
+        }
+        for fileName, documents in fixtures.items():
+            with open(os.path.join(self.fixtureDir, fileName), "w") as fixtureFile:
+                json.dump(documents, fixtureFile)
+
+
+def quantize(values):
+    return numpy.round(numpy.asarray(values) / QUANTUM) * QUANTUM
+
+
+def replicateMean(replicates):
+    """Mean of replicate Series, NaN for rows missing from any replicate, as the validators align them."""
+    if len(replicates) == 1:
+        return replicates[0]
+    stacked = pandas.concat(replicates, axis=1)
+    present = pandas.concat([pandas.Series(True, index=series.index) for series in replicates], axis=1).notna()
+    return stacked.mean(axis=1).where(present.all(axis=1))
+
+
+def clinicalColumns(document, path=()):
+    """Xena clinical column names of a case document, its dotted path reversed."""
+    columns = {}
+    for key, value in document.items():
+        if key == "diagnosis_id":
+            continue
+        if isinstance(value, list):
+            # synthetic cases have a single diagnosis
+            value = value[0]
+        if isinstance(value, dict):
+            columns.update(clinicalColumns(value, (key,) + path))
+        else:
+            columns[".".join((key,) + path)] = value
+    return columns
+
+
+def generate(project, output, dataTypes=None, seed=0, gdcFiles=None):
+    """Write a synthetic project, its Xena matrices and its gdcStandIn fixtures.
+
+    Args:
+        project (str): Project name, e.g. "SYN-BENCH".
+        output (str): Directory the project directory is created in.
+        dataTypes (list): Data types from DATA_TYPES, all by default.
+        gdcFiles (str): Also place the GDC files in this gdcFiles directory,
+            so the validators find them without downloading.
+
+    Returns:
+        fixtureDir (str): Directory to serve with gdcStandIn.
+    """
+    dataTypes = DATA_TYPES if dataTypes is None else dataTypes
+    synthetic = SyntheticProject(project, output, seed, gdcFiles)
+    for dataType in dataTypes:
+        logger.info(f"Generating {dataType} data for {project}")
+        # script.py runs every data type listed in Raw_Data when none is given
+        os.makedirs(os.path.join(synthetic.directory, "Raw_Data", dataType), exist_ok=True)
+        if dataType == "STAR":
+            synthetic.star()
+        elif dataType.startswith("mirna"):
+            synthetic.mirna(dataType)
+        elif dataType.startswith("methylation"):
+            synthetic.methylation(dataType)
+        elif dataType.startswith("gene-level"):
+            synthetic.geneLevel(dataType)
+        elif dataType.endswith(("_ascat-ngs", "_DNAcopy", "_ascat2", "_ascat3")):
+            synthetic.segments(dataType)
+        elif dataType.startswith("somaticmutation"):
+            synthetic.mutations(dataType)
+        elif dataType == "protein":
+            synthetic.protein()
+    # clinical and survival list the samples of every generated file, so they come last
+    if "clinical" in dataTypes:
+        synthetic.clinical()
+    if "survival" in dataTypes:
+        synthetic.survival()
+    synthetic.writeFixtures()
+    logger.info(f"{len(synthetic.files)} GDC files for {sum(len(case['samples']) for case in synthetic.cases)} "
+                f"samples written to {synthetic.directory}")
+    return synthetic.fixtureDir
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic project with matching Xena matrices and GDC fixtures.'
+    )
+    parser.add_argument('project', help='Project name, e.g. SYN-BENCH.')
+    parser.add_argument('-o', '--output', default='..', help='Directory to create the project in, .. for script.py.')
+    parser.add_argument('-t', '--datatype', nargs='+', default=None, choices=DATA_TYPES,
+                        help='Data types to generate, all by default. STAR writes the four star_* matrices.')
+    parser.add_argument('-s', '--samples', type=int, default=settings["samples"], help='Number of samples.')
+    parser.add_argument('--replicates', type=float, default=settings["replicates"],
+                        help='Fraction of samples with two files of a data type.')
+    parser.add_argument('--normals', type=float, default=settings["normals"],
+                        help='Fraction of cases that also have a normal sample.')
+    parser.add_argument('--nan-density', type=float, default=settings["nanDensity"],
+                        help='Fraction of values left empty in the GDC files.')
+    parser.add_argument('--genes', type=int, default=settings["genes"], help='Genes per STAR and gene-level file.')
+    parser.add_argument('--mirnas', type=int, default=settings["mirnas"], help='miRNAs per miRNA file.')
+    parser.add_argument('--isoforms', type=int, default=settings["isoforms"], help='Isoforms to draw isoform files from.')
+    parser.add_argument('--probes', type=int, default=settings["probes"], help='Probes per methylation file.')
+    parser.add_argument('--proteins', type=int, default=settings["proteins"], help='Targets per RPPA file.')
+    parser.add_argument('--segments', type=int, default=settings["segments"], help='Segments per segment file.')
+    parser.add_argument('--mutations', type=int, default=settings["mutations"],
+                        help='Mean mutations per MAF file.')
+    parser.add_argument('--gdc-files', default=None,
+                        help='Also place the GDC files in this gdcFiles directory so nothing is downloaded.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated values.')
+    return parser
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=(logging.StreamHandler(sys.stdout),),
+    )
+    options = create_parser().parse_args()
+    configure(samples=options.samples, replicates=options.replicates, normals=options.normals,
+              nanDensity=options.nan_density, genes=options.genes, mirnas=options.mirnas, isoforms=options.isoforms,
+              probes=options.probes, proteins=options.proteins, segments=options.segments,
+              mutations=options.mutations)
+    fixtureDir = generate(options.project, options.output, options.datatype, options.seed, options.gdc_files)
+    logger.info(f"Serve the fixtures with: python gdcStandIn.py {fixtureDir}")
+
+
+if __name__ == '__main__':
+    main()
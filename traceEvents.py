@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+# Spans and log lines in the Chrome trace-event format, which chrome://tracing and Perfetto open.
+settings = {
+    "enabled": False
+}
+
+_events = []
+
+
+def configure(enabled=None):
+    """Turn span recording on or off for this process."""
+    if enabled is not None:
+        settings["enabled"] = enabled
+
+
+def now():
+    """Microseconds since the epoch, comparable between the processes of a run."""
+    return time.time_ns() // 1000
+
+
+def complete(name, category, start, end=None, args=None):
+    """Record a span that started at start, see now(), and ends at end or now."""
+    if not settings["enabled"]:
+        return
+    end = now() if end is None else end
+    thread = threading.current_thread()
+    event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": max(end - start, 0),
+             "pid": os.getpid(), "tid": thread.ident, "threadName": thread.name}
+    if args:
+        event["args"] = args
+    _events.append(event)
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """Record the with block as a span on the current process and thread.
+
+    Args:
+        name (str): Shown on the span, e.g. a file name.
+        category (str): "job", "stage", "gdc request", "parse" or "compare".
+        args: Shown in the details of the span.
+    """
+    if not settings["enabled"]:
+        yield
+        return
+    start = now()
+    try:
+        yield
+    finally:
+        complete(name, category, start, args=args)
+
+
+def collect():
+    """Events recorded in this process since the last collect."""
+    events = _events[:]
+    del _events[:]
+    return events
+
+
+def record(events):
+    """Add events recorded in another process, e.g. a ProcessPoolExecutor worker."""
+    _events.extend(events)
+
+
+class TraceHandler(logging.Handler):
+    """Turn log records into instant events, so every log line shows on the timeline.
+
+    Records replayed from worker processes keep the process, thread and
+    time they were created with.
+    """
+
+    def emit(self, record):
+        if not settings["enabled"]:
+            return
+        _events.append({"name": record.getMessage()[:200], "cat": record.name, "ph": "i", "s": "t",
+                        "ts": int(record.created * 1000000), "pid": record.process, "tid": record.thread,
+                        "threadName": record.threadName})
+
+
+def write(path, events):
+    """Write events as a trace-event JSON file, naming every process and thread in it."""
+    traceEvents = []
+    names = {}
+    for event in events:
+        event = dict(event)
+        names[(event["pid"], event["tid"])] = event.pop("threadName", None)
+        traceEvents.append(event)
+    mainPid = os.getpid()
+    for pid in sorted({pid for pid, _ in names}):
+        processName = "script.py" if pid == mainPid else f"worker {pid}"
+        traceEvents.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": processName}})
+    for (pid, tid), threadName in sorted(names.items(), key=lambda item: (item[0][0], item[0][1] or 0)):
+        if threadName is not None:
+            traceEvents.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                "args": {"name": threadName}})
+    with open(f"{path}.{os.getpid()}.tmp", "w") as traceFile:
+        json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms"}, traceFile)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
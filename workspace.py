@@ -0,0 +1,50 @@
+import os
+import re
+import shutil
+import logging
+import tempfile
+import contextlib
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+_currentWorkspace = contextvars.ContextVar("workspace", default=None)
+
+
+@contextlib.contextmanager
+def jobWorkspace(jobName, root=None, keep=False):
+    """Give a job its own scratch directory for the duration of a with block.
+
+    Args:
+        jobName (str): Used as the directory name prefix, e.g. "TCGA-BRCA.mirna".
+        root (str): Directory to create workspaces in, the system temporary
+            directory if None.
+        keep (bool): Leave the workspace on disk instead of removing it.
+
+    Yields:
+        directory (str): Path of the workspace.
+    """
+    if root is not None:
+        os.makedirs(root, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix=re.sub(r"[^\w.-]", "_", jobName) + ".", dir=root)
+    token = _currentWorkspace.set(directory)
+    try:
+        yield directory
+    finally:
+        _currentWorkspace.reset(token)
+        if keep:
+            logger.info(f"Workspace kept at {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def path(fileName):
+    """Path of a scratch file in the current job's workspace.
+
+    Outside of jobWorkspace this is the file name itself, i.e. the current
+    working directory, so the validators still work when run on their own.
+    """
+    directory = _currentWorkspace.get()
+    if directory is None:
+        return fileName
+    return os.path.join(directory, fileName)
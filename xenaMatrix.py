@@ -0,0 +1,319 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import numpy
+import pandas
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+PARSERS = ("auto", "pyarrow", "pandas")
+
+# the strings pandas.read_csv reads as NaN by default, so both parsers agree on missing values
+NA_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A",
+             "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+settings = {
+    # <md5>/ holds values.npy and labels.json for the dense Xena matrix with that md5sum
+    "cacheDir": ".xenaMatrices",
+    # least recently used sidecars are removed beyond this many bytes
+    "cacheSize": 64 << 30,
+    "chunkSize": 1 << 20,
+    # TSV parser for matrices without a sidecar, one of PARSERS
+    "parser": "auto",
+    # bytes of Xena values a validator that streams column blocks may hold at once, None loads whole matrices
+    "maxMemory": None
+}
+
+
+def configure(cacheDir=None, cacheSize=None, parser=None, maxMemory=None):
+    """Override the sidecar settings for this process.
+
+    Args:
+        cacheDir (str): Sidecar directory, "" parses every matrix on every read.
+        cacheSize (int): Bytes of sidecars to keep.
+        parser (str): "pyarrow", "pandas" or "auto", which is pyarrow when it is installed.
+        maxMemory (int): Memory budget in bytes for streaming validators, see columnBlocks.
+    """
+    for key, value in (("cacheDir", cacheDir), ("cacheSize", cacheSize), ("parser", parser),
+                       ("maxMemory", maxMemory)):
+        if value is not None:
+            settings[key] = value
+
+
+def _memoPath(path):
+    return os.path.join(settings["cacheDir"], "paths", hashlib.sha1(path.encode()).hexdigest() + ".json")
+
+
+def md5(xenaFilePath):
+    """md5sum of a Xena matrix, hashed again only when its size or modification time changed.
+
+    The memo is kept in the sidecar directory, with no sidecar directory
+    the matrix is hashed on every call.
+    """
+    path = os.path.abspath(xenaFilePath)
+    stat = os.stat(path)
+    memoPath = _memoPath(path)
+    try:
+        if settings["cacheDir"]:
+            with open(memoPath, "r") as memoFile:
+                memo = json.load(memoFile)
+            if (memo["size"], memo["mtimeNs"]) == (stat.st_size, stat.st_mtime_ns):
+                return memo["md5"]
+    except (OSError, ValueError, KeyError):
+        pass
+    md5Hash = hashlib.md5()
+    with open(path, "rb") as xenaFile:
+        for chunk in iter(lambda: xenaFile.read(settings["chunkSize"]), b""):
+            md5Hash.update(chunk)
+    if not settings["cacheDir"]:
+        return md5Hash.hexdigest()
+    os.makedirs(os.path.dirname(memoPath), exist_ok=True)
+    with open(f"{memoPath}.{os.getpid()}.tmp", "w") as memoFile:
+        json.dump({"path": path, "size": stat.st_size, "mtimeNs": stat.st_mtime_ns, "md5": md5Hash.hexdigest()},
+                  memoFile)
+    os.replace(f"{memoPath}.{os.getpid()}.tmp", memoPath)
+    return md5Hash.hexdigest()
+
+
+def _parseArrow(xenaFilePath):
+    """Parse a numeric matrix with the multi-threaded Arrow CSV reader.
+
+    The schema comes from the header: the first column is the string index,
+    every other column float64. Raises ValueError for a header with
+    duplicated names and pyarrow.ArrowInvalid for a non-numeric value.
+    """
+    with open(xenaFilePath, "r") as xenaFile:
+        header = xenaFile.readline().rstrip("\r\n").split("\t")
+    if len(set(header)) != len(header):
+        raise ValueError(f"{xenaFilePath} has duplicated column names")
+    columnTypes = {name: pyarrow.float64() for name in header[1:]}
+    columnTypes[header[0]] = pyarrow.string()
+    table = pyarrow.csv.read_csv(
+        xenaFilePath,
+        read_options=pyarrow.csv.ReadOptions(use_threads=True, block_size=16 << 20),
+        parse_options=pyarrow.csv.ParseOptions(delimiter="\t"),
+        convert_options=pyarrow.csv.ConvertOptions(column_types=columnTypes, null_values=NA_VALUES,
+                                                   strings_can_be_null=False)
+    )
+    # self_destruct frees every Arrow column once it is converted, split_blocks avoids one more copy to consolidate
+    xenaDF = table.to_pandas(self_destruct=True, split_blocks=True)
+    del table
+    return xenaDF.set_index(header[0])
+
+
+def parse(xenaFilePath, parser=None):
+    """Parse a Xena matrix TSV, index_col=0 as pandas.read_csv would.
+
+    With pyarrow installed, numeric matrices are parsed on every core as
+    float64 columns. Matrices the Arrow reader can not take, e.g. with a
+    non-numeric column, and every matrix without pyarrow go through
+    pandas.read_csv.
+
+    Args:
+        parser (str): One of PARSERS, settings["parser"] by default.
+    """
+    parser = parser or settings["parser"]
+    if parser == "pyarrow" and pyarrow is None:
+        raise ImportError("the pyarrow parser needs pyarrow to be installed")
+    if parser != "pandas" and pyarrow is not None:
+        try:
+            return _parseArrow(xenaFilePath)
+        except (ValueError, pyarrow.ArrowInvalid) as error:
+            logger.info(f"Parsing {os.path.basename(xenaFilePath)} with pandas, pyarrow can not: {error}")
+    return pandas.read_csv(xenaFilePath, sep="\t", index_col=0)
+
+
+def _open(sidecarDir):
+    with open(os.path.join(sidecarDir, "labels.json"), "r") as labelsFile:
+        labels = json.load(labelsFile)
+    # copy-on-write pages, so an in-place change to the frame never reaches the sidecar
+    values = numpy.load(os.path.join(sidecarDir, "values.npy"), mmap_mode="c")
+    # the modification time doubles as the last use for the LRU cap
+    os.utime(sidecarDir)
+    return pandas.DataFrame(values, index=pandas.Index(labels["rows"], name=labels["indexName"]),
+                            columns=labels["columns"], copy=False)
+
+
+def _write(xenaDF, sidecarDir):
+    """Write a numeric frame as a column-major float64 array and its labels."""
+    building = f"{sidecarDir}.{os.getpid()}.tmp"
+    os.makedirs(building, exist_ok=True)
+    values = numpy.lib.format.open_memmap(os.path.join(building, "values.npy"), mode="w+", dtype=numpy.float64,
+                                          shape=xenaDF.shape, fortran_order=True)
+    for i, column in enumerate(xenaDF.columns):
+        values[:, i] = xenaDF[column].to_numpy(dtype=numpy.float64)
+    values.flush()
+    del values
+    with open(os.path.join(building, "labels.json"), "w") as labelsFile:
+        json.dump({"indexName": xenaDF.index.name, "rows": xenaDF.index.tolist(), "columns": xenaDF.columns.tolist()},
+                  labelsFile)
+    try:
+        os.rename(building, sidecarDir)
+    except OSError:
+        # another job wrote the same matrix first
+        shutil.rmtree(building, ignore_errors=True)
+    _pruneCache(sidecarDir)
+
+
+def _writeStreaming(xenaFilePath, sidecarDir, maxMemory):
+    """Write the sidecar of a numeric matrix from row chunks, holding about maxMemory bytes at a time.
+
+    Each chunk of rows is parsed and written at its offset in every column
+    of the column-major values.npy, so neither the matrix nor the pages of
+    the file being written stay in memory.
+    """
+    with open(xenaFilePath, "r") as xenaFile:
+        header = xenaFile.readline().rstrip("\r\n").split("\t")
+        # pandas skips blank lines, so they are not rows
+        rows = sum(1 for line in xenaFile if line.strip())
+    # the text, tokens and float64 values of a chunk take about four times its values
+    chunkRows = max(1, maxMemory // (len(header) * 8 * 4))
+    building = f"{sidecarDir}.{os.getpid()}.tmp"
+    os.makedirs(building, exist_ok=True)
+    valuesPath = os.path.join(building, "values.npy")
+    with open(valuesPath, "wb") as valuesFile:
+        numpy.lib.format.write_array_header_1_0(
+            valuesFile, {"descr": numpy.lib.format.dtype_to_descr(numpy.dtype(numpy.float64)), "fortran_order": True,
+                         "shape": (rows, len(header) - 1)})
+        offset = valuesFile.tell()
+        valuesFile.truncate(offset + rows * (len(header) - 1) * 8)
+    rowLabels = []
+    columns = None
+    with open(valuesPath, "r+b") as valuesFile:
+        for chunk in pandas.read_csv(xenaFilePath, sep="\t", index_col=0, chunksize=chunkRows,
+                                     dtype={name: numpy.float64 for name in header[1:]}):
+            columns = chunk.columns.tolist()
+            if len(rowLabels) + len(chunk) > rows:
+                raise ValueError(f"{xenaFilePath} has more rows than lines")
+            values = chunk.to_numpy(dtype=numpy.float64)
+            for i in range(values.shape[1]):
+                os.pwrite(valuesFile.fileno(), values[:, i].tobytes(), offset + (i * rows + len(rowLabels)) * 8)
+            rowLabels.extend(chunk.index.tolist())
+            indexName = chunk.index.name
+    if len(rowLabels) != rows or columns is None:
+        shutil.rmtree(building, ignore_errors=True)
+        raise ValueError(f"{xenaFilePath} has {len(rowLabels)} rows of values in {rows} lines")
+    with open(os.path.join(building, "labels.json"), "w") as labelsFile:
+        json.dump({"indexName": indexName, "rows": rowLabels, "columns": columns}, labelsFile)
+    try:
+        os.rename(building, sidecarDir)
+    except OSError:
+        shutil.rmtree(building, ignore_errors=True)
+    _pruneCache(sidecarDir)
+
+
+def _pruneCache(sidecarDir):
+    """Remove the least recently used sidecars until the cache fits in cacheSize.
+
+    sidecarDir, the sidecar just written, is counted but never removed, as
+    its caller is about to open it. Sidecars that another job removes while
+    they are being measured are skipped.
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(settings["cacheDir"]):
+        if not entry.is_dir() or len(entry.name) != 32:
+            continue
+        try:
+            size = sum(os.path.getsize(os.path.join(entry.path, name)) for name in os.listdir(entry.path))
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        total += size
+        if entry.name != os.path.basename(sidecarDir):
+            entries.append((mtime, size, entry.path))
+    for _, size, path in sorted(entries):
+        if total <= settings["cacheSize"]:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def read(xenaFilePath):
+    """Read a Xena genes x samples matrix, index_col=0 as pandas.read_csv would.
+
+    The first read of a numeric matrix also writes it to a sidecar keyed by
+    the md5sum of the TSV: a column-major float64 .npy plus the row and column
+    labels. Later reads memory-map the sidecar, so loading takes milliseconds
+    and only the pages of the sample columns that are actually used are read.
+    Matrices with non-numeric columns are parsed on every read, see parse().
+
+    Returns:
+        xenaDF (pandas.DataFrame): Rows x samples, float64 when numeric.
+    """
+    if not settings["cacheDir"]:
+        return parse(xenaFilePath)
+    sidecarDir = os.path.join(settings["cacheDir"], md5(xenaFilePath))
+    if os.path.isdir(sidecarDir):
+        return _open(sidecarDir)
+    xenaDF = parse(xenaFilePath)
+    if not all(pandas.api.types.is_numeric_dtype(dtype) and not pandas.api.types.is_bool_dtype(dtype)
+               for dtype in xenaDF.dtypes):
+        return xenaDF
+    logger.info(f"Writing the binary sidecar of {os.path.basename(xenaFilePath)} to {sidecarDir}")
+    _write(xenaDF, sidecarDir)
+    del xenaDF
+    return _open(sidecarDir)
+
+
+def sidecar(xenaFilePath):
+    """Directory of the sidecar of a numeric Xena matrix, written first if needed.
+
+    With a maxMemory budget the sidecar is written from row chunks within
+    it, otherwise from the whole parsed matrix as read() would.
+    """
+    sidecarDir = os.path.join(settings["cacheDir"], md5(xenaFilePath))
+    if os.path.isdir(sidecarDir):
+        os.utime(sidecarDir)
+        return sidecarDir
+    logger.info(f"Writing the binary sidecar of {os.path.basename(xenaFilePath)} to {sidecarDir}")
+    os.makedirs(settings["cacheDir"], exist_ok=True)
+    if settings["maxMemory"]:
+        _writeStreaming(xenaFilePath, sidecarDir, settings["maxMemory"])
+    else:
+        _write(parse(xenaFilePath), sidecarDir)
+    return sidecarDir
+
+
+def columnBlocks(sidecarDir, columns, maxMemory=None):
+    """Yield the given columns of a sidecar as DataFrames of as many columns as fit in maxMemory.
+
+    Every block is read into memory of its own rather than memory-mapped,
+    so once the caller drops a block, nothing of it stays resident and the
+    peak does not grow with the number of columns. Half of the budget is
+    left for whatever the caller loads to compare a block with.
+
+    Args:
+        columns (list): Column labels in the order to yield them.
+        maxMemory (int): Bytes, settings["maxMemory"] by default.
+    """
+    maxMemory = maxMemory or settings["maxMemory"]
+    with open(os.path.join(sidecarDir, "labels.json"), "r") as labelsFile:
+        labels = json.load(labelsFile)
+    index = pandas.Index(labels["rows"], name=labels["indexName"])
+    positions = {column: i for i, column in enumerate(labels["columns"])}
+    rows = len(index)
+    blockColumns = max(1, maxMemory // 2 // max(rows * 8, 1))
+    with open(os.path.join(sidecarDir, "values.npy"), "rb") as valuesFile:
+        if numpy.lib.format.read_magic(valuesFile) == (1, 0):
+            numpy.lib.format.read_array_header_1_0(valuesFile)
+        else:
+            numpy.lib.format.read_array_header_2_0(valuesFile)
+        offset = valuesFile.tell()
+        for start in range(0, len(columns), blockColumns):
+            blockLabels = columns[start:start + blockColumns]
+            values = numpy.empty((rows, len(blockLabels)), dtype=numpy.float64, order="F")
+            for i, column in enumerate(blockLabels):
+                valuesFile.seek(offset + positions[column] * rows * 8)
+                valuesFile.readinto(memoryview(values[:, i]).cast("B"))
+            yield pandas.DataFrame(values, index=index, columns=blockLabels, copy=False)
+            # free the block before the next one is read
+            del values